@@ -0,0 +1,140 @@
+import itertools
+from collections import deque
+from threading import Lock
+
+from proxy_google_analytics.logger import logger
+
+
+class Deliveries(object):
+    """Delivery tags of one channel waiting to be settled."""
+    __slots__ = ['ioloop', 'channel', 'outstanding', 'delivered', 'failed', 'scheduled']
+
+    def __init__(self, ioloop, channel):
+        self.ioloop = ioloop
+        self.channel = channel
+        self.outstanding = deque()
+        self.delivered = set()
+        self.failed = []
+        self.scheduled = False
+
+
+class Acknowledger(object):
+    """Acknowledge AMQP deliveries once their hits reached Google Analytics.
+
+    Every consuming channel is tracked under a generation of its own and
+    ``received`` returns a ``(generation, tag)`` token for each of its
+    deliveries; workers resolve those tokens from their own threads and
+    the deliveries are settled on the ioloop. Tokens of a channel that
+    has been released meanwhile are ignored, its deliveries are
+    redelivered anyway. Delivered tags are acknowledged with a single
+    ``multiple=True`` ack on the highest contiguous delivered tag of a
+    channel, failed ones are nacked back to the queue right away.
+    """
+    __slots__ = ['requeue', '_lock', '_generations', '_channels']
+
+    def __init__(self, requeue=True):
+        self.requeue = requeue
+        self._lock = Lock()
+        self._generations = itertools.count(1)
+        self._channels = {}
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(deliveries.outstanding) for deliveries in self._channels.values())
+
+    def track(self, ioloop, channel):
+        """Start tracking deliveries of a channel, returning its generation."""
+        with self._lock:
+            generation = next(self._generations)
+            self._channels[generation] = Deliveries(ioloop, channel)
+            return generation
+
+    def release(self, generation):
+        """Forget a closed channel along with its unsettled tags."""
+        with self._lock:
+            self._channels.pop(generation, None)
+
+    def tracked(self, tokens):
+        """Return True when a delivery of ``tokens`` belongs to a channel still tracked."""
+        with self._lock:
+            return any(generation in self._channels for generation, tag in tokens)
+
+    def received(self, generation, tag):
+        with self._lock:
+            deliveries = self._channels.get(generation)
+            if deliveries is not None:
+                deliveries.outstanding.append(tag)
+            return generation, tag
+
+    def resolve(self, tokens, delivered=True):
+        scheduled = []
+        with self._lock:
+            for generation, tag in tokens:
+                deliveries = self._channels.get(generation)
+                if deliveries is None:
+                    continue
+                if delivered:
+                    deliveries.delivered.add(tag)
+                else:
+                    deliveries.failed.append(tag)
+                if not deliveries.scheduled:
+                    deliveries.scheduled = True
+                    scheduled.append((generation, deliveries.ioloop))
+        for generation, ioloop in scheduled:
+            ioloop.add_callback_threadsafe(lambda generation=generation: self.settle(generation))
+
+    def settle(self, generation):
+        with self._lock:
+            deliveries = self._channels.get(generation)
+            if deliveries is None:
+                return
+            deliveries.scheduled = False
+            failed = set(deliveries.failed)
+            deliveries.failed = []
+            outstanding = deliveries.outstanding
+            last = None
+            while outstanding:
+                tag = outstanding[0]
+                if tag in failed:
+                    pass
+                elif tag in deliveries.delivered:
+                    deliveries.delivered.discard(tag)
+                    last = tag
+                else:
+                    break
+                outstanding.popleft()
+            if failed and outstanding:
+                deliveries.outstanding = deque(tag for tag in outstanding if tag not in failed)
+        channel = deliveries.channel
+        if not channel.is_open:
+            return
+        for tag in sorted(failed):
+            logger.debug('Nacknowledging message %s', tag)
+            channel.basic_nack(tag, requeue=self.requeue)
+        if last is not None:
+            logger.debug('Acknowledging messages up to %s', last)
+            channel.basic_ack(last, multiple=True)
+
+    def abandon(self):
+        """Settle resolved deliveries and nack every other outstanding one back to the queue.
+
+        Must run on the ioloop. Every channel is released, so tokens
+        resolved afterwards are ignored. Returns the number of deliveries
+        nacked.
+        """
+        nacked = 0
+        with self._lock:
+            generations = list(self._channels)
+        for generation in generations:
+            self.settle(generation)
+            with self._lock:
+                deliveries = self._channels.pop(generation, None)
+            if deliveries is None or not deliveries.channel.is_open:
+                continue
+            for tag in deliveries.outstanding:
+                if tag in deliveries.delivered:
+                    deliveries.channel.basic_ack(tag)
+                else:
+                    deliveries.channel.basic_nack(tag, requeue=True)
+                    nacked += 1
+        return nacked
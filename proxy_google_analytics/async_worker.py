@@ -0,0 +1,222 @@
+import asyncio
+from itertools import chain
+
+import aiohttp
+
+from proxy_google_analytics.google_measurement_protocol.report import (TRACKING_URI, BATCH_URI, FORM_HEADERS,
+                                                                       _batch_lines, _stamp_queue_time)
+from proxy_google_analytics.google_measurement_protocol.transport import is_healthy
+from proxy_google_analytics.limits import AdaptiveConcurrency
+from proxy_google_analytics.logger import logger, exception_message
+from proxy_google_analytics.metrics import GA_CONCURRENCY_LIMIT, Timer, record_request
+from proxy_google_analytics.worker import Worker, STOP
+
+
+class AsyncWorker(Worker):
+    """Worker sending hits concurrently from an asyncio event loop.
+
+    Messages are decoded and turned into hits exactly as in ``Worker``,
+    but hits are posted through a pooled aiohttp session with at most
+    ``concurrency`` requests in flight, fewer while ``limits.adaptive``
+    has backed off. The worker stops taking messages from the queue while
+    all slots are busy, so the queue fills up and its watermarks pause the
+    AMQP consumer.
+    """
+
+    def __init__(self, queue, db_click, config, transport=None, acker=None, spill=None, dedup=None, router=None,
+                 enricher=None, limiter=None, sampler=None, dispatcher=None, sinks=()):
+        self.__queue = queue
+        self.concurrency = config.get('engine', {}).get('concurrency', 100)
+        limits = config.get('limits', {})
+        self.gate = AdaptiveConcurrency(minimum=min(limits.get('min_concurrency', 1), self.concurrency),
+                                        maximum=self.concurrency,
+                                        backoff=limits.get('backoff', 0.5) if limits.get('adaptive') else 1.0,
+                                        cooldown=limits.get('cooldown', 1.0))
+        self.client = None
+        self._hits = []
+        self._job = None
+        super(AsyncWorker, self).__init__(queue, db_click, config, transport, acker, spill, dedup, router,
+                                          enricher, limiter, sampler, dispatcher, sinks)
+        GA_CONCURRENCY_LIMIT.set_function(lambda: self.gate.limit, self.name)
+
+    def setup_report(self, transport):
+        transport_config = self.config.get('transport', {})
+        report_config = self.config.get('report', {})
+        self.transport = None
+        self.batched = report_config.get('mode') == 'batch'
+        self.batch_size = report_config.get('batch_size', 20)
+        self.batch_bytes = report_config.get('batch_bytes', 16384)
+        self.retries = transport_config.get('retries', 3)
+        self.backoff_factor = transport_config.get('backoff_factor', 0.3)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=transport_config.get('connect_timeout', 3.05),
+                                             sock_read=transport_config.get('read_timeout', 5.0))
+        return self.collect
+
+    def collect(self, lines, extra_headers=None):
+        for line in lines:
+            self._hits.append((line, extra_headers, self._job))
+        return []
+
+    def run(self):
+        logger.info('Starting AsyncWorker')
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.consume())
+        finally:
+            loop.close()
+        logger.info('Stopping AsyncWorker')
+
+    async def consume(self):
+        loop = asyncio.get_event_loop()
+        released = asyncio.Event()
+        tasks = set()
+        settling = set()
+
+        def free(task):
+            self.gate.release()
+            released.set()
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=self.timeout) as self.client:
+            running = True
+            while running:
+                settled = []
+                identities = []
+                sink_lines = []
+                jobs = await loop.run_in_executor(None, self.drain)
+                with Timer(self.busy.inc):
+                    for job in chain(self.release(), jobs):
+                        if job is not STOP:
+                            job = None if self.stale(job) else self.expire(job)
+                        if job is STOP:
+                            running = False
+                        elif job is not None:
+                            key, data, job_tokens, decoded, spill, event_time = job
+                            self._job = len(settled)
+                            self._spilling = spill
+                            self._event_time = event_time
+                            self.message_processing(key, data, decoded)
+                            self._spilling = False
+                            self._event_time = None
+                            settled.append((key, job_tokens))
+                            identities.append(self._identity)
+                            self._identity = None
+                            if self.acker is None:
+                                self.sink(self._sink_lines)
+                            else:
+                                sink_lines.append(self._sink_lines)
+                            self._sink_lines = []
+                        self.__queue.task_done()
+                sends = []
+                owners = []
+                for url, data, headers, jobs in self.requests():
+                    while not self.gate.try_acquire():
+                        released.clear()
+                        await released.wait()
+                    task = loop.create_task(self.post(url, data, headers))
+                    task.add_done_callback(free)
+                    task.add_done_callback(tasks.discard)
+                    tasks.add(task)
+                    sends.append(task)
+                    owners.append(jobs)
+                if self.acker is not None and settled:
+                    task = loop.create_task(self.settle(sends, owners, settled, identities, sink_lines))
+                    task.add_done_callback(settling.discard)
+                    settling.add(task)
+            if tasks:
+                done, pending = await asyncio.wait(tasks, timeout=self.remaining())
+                if pending:
+                    logger.warning('Cancelling %s requests at the drain deadline', len(pending))
+                    for task in pending:
+                        task.cancel()
+            if tasks or settling:
+                await asyncio.wait(tasks | settling)
+
+    def drain(self):
+        return self.prepare(self.dequeue())
+
+    def requests(self):
+        """Yield url, body, headers and the indexes of the jobs whose hits it carries."""
+        hits = self._hits
+        self._hits = []
+        if not self.batched:
+            for line, headers, job in hits:
+                yield TRACKING_URI, line, dict(headers or {}, **FORM_HEADERS), (job,)
+            return
+        offset = 0
+        lines = (line for line, headers, job in hits)
+        for batch in _batch_lines(lines, self.batch_size, self.batch_bytes):
+            jobs = set(job for line, headers, job in hits[offset:offset + len(batch)])
+            offset += len(batch)
+            yield BATCH_URI, '\n'.join(batch), None, jobs
+
+    async def settle(self, sends, owners, jobs, identities, sink_lines):
+        """Settle every job by the outcome of the requests carrying its hits.
+
+        Hits of delivered jobs go to the sinks. The dedup window forgets
+        the identities of jobs that are nacked, so their redeliveries are
+        processed again.
+        """
+        results = await asyncio.gather(*sends)
+        failed = set()
+        for delivered, owner in zip(results, owners):
+            if not delivered:
+                failed.update(owner)
+        self.resolve([job for index, job in enumerate(jobs) if index not in failed], True)
+        for index, lines in enumerate(sink_lines):
+            if index not in failed:
+                self.sink(lines)
+        if failed:
+            if self.dedup is not None:
+                for index in failed:
+                    if identities[index] is not None:
+                        self.dedup.forget(identities[index])
+            self.resolve([jobs[index] for index in sorted(failed)], False)
+
+    async def post(self, url, data, headers):
+        """Post hits, returning whether they were delivered, expired or spilled.
+
+        The queue time of the hits is stamped on every attempt. A request
+        cancelled at the drain deadline is spilled when there is a spill
+        log, its messages are requeued otherwise.
+        """
+        try:
+            if await self.attempts(url, data, headers):
+                return True
+        except asyncio.CancelledError:
+            if self.spill is None:
+                raise
+            logger.warning('Spilling %s cancelled at the drain deadline', url)
+        if self.spill is not None:
+            self.spill.append(data.split('\n'))
+            return True
+        return False
+
+    async def attempts(self, url, data, headers):
+        loop = asyncio.get_event_loop()
+        endpoint = 'batch' if url.endswith('/batch') else 'collect'
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+            body = '\n'.join(_stamp_queue_time(data.split('\n')))
+            if not body:
+                return True
+            status = 'error'
+            started = loop.time()
+            try:
+                async with self.client.post(url, data=body, headers=headers) as response:
+                    await response.read()
+                    status = response.status
+                    if is_healthy(response.status):
+                        return True
+                    logger.warning('Google Analytics responded %s', response.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(exception_message(exc=str(e)))
+            except Exception as e:
+                logger.error(exception_message(exc=str(e)))
+                break
+            finally:
+                record_request(endpoint, status, loop.time() - started)
+                self.gate.feedback(status != 'error' and is_healthy(status))
+        logger.error('Giving up %s after %s attempts', url, attempt + 1)
+        return False
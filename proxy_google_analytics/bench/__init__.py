@@ -0,0 +1,76 @@
+"""Replay benchmark of the reporting pipeline.
+
+Replays a JSONL capture of ``(routing_key, body)`` messages, or
+synthetic click and goal messages, through a worker against a local
+stand-in of the Google Analytics collector and prints, for every engine,
+report mode and hit construction path, messages per second, p50 and p99
+delivery latency, CPU time per message and peak traced allocations::
+
+    python -m proxy_google_analytics.bench [capture.jsonl] [-n 5000]
+"""
+import argparse
+import json
+
+from proxy_google_analytics.bench.capture import load, synthesize, dump
+from proxy_google_analytics.bench.collector import Collector
+from proxy_google_analytics.bench.runner import ENGINES, MODES, Scenario, replay
+from proxy_google_analytics.utils import json_loads
+
+HEADER = '{:<8} {:<6} {:<9} {:>10} {:>9} {:>9} {:>12} {:>10} {:>7}'
+ROW = '{:<8} {:<6} {:<9} {:>10.0f} {:>9.2f} {:>9.2f} {:>12.1f} {:>10.0f} {:>7}'
+
+
+def engines():
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:
+        return ENGINES[:1]
+    return ENGINES
+
+
+def parse_args(argv):
+    ap = argparse.ArgumentParser(prog='python -m proxy_google_analytics.bench',
+                                 description='Replay benchmark of the reporting pipeline')
+    ap.add_argument('capture', nargs='?', help='JSONL capture to replay, synthetic messages when omitted')
+    ap.add_argument('-n', '--messages', type=int, default=5000, help='messages to replay')
+    ap.add_argument('--engine', action='append', choices=ENGINES, help='engines to run, all available by default')
+    ap.add_argument('--mode', action='append', choices=MODES, help='report modes to run, all by default')
+    ap.add_argument('--templates', choices=('on', 'off', 'both'), default='both')
+    ap.add_argument('--decoder', choices=('json', 'fast'), default='fast')
+    ap.add_argument('--inflight', type=int, default=200, help='unacknowledged messages at most')
+    ap.add_argument('--concurrency', type=int, default=10, help='connections to the collector')
+    ap.add_argument('--linger', type=float, default=0.05, help='batch linger in seconds')
+    ap.add_argument('--latency', type=float, default=0.0, help='collector response latency in seconds')
+    ap.add_argument('--warmup', type=int, default=500, help='messages replayed before measuring')
+    ap.add_argument('--alloc-messages', type=int, default=2000, help='messages replayed with allocation tracing')
+    ap.add_argument('--write-capture', metavar='PATH', help='write the replayed messages as a capture and exit')
+    return ap.parse_args(argv)
+
+
+def main(argv):
+    options = parse_args(argv)
+    if options.capture:
+        messages = load(options.capture, options.messages)
+    else:
+        messages = synthesize(options.messages)
+    if options.write_capture:
+        dump(messages, options.write_capture)
+        return
+    loads = json_loads if options.decoder == 'fast' else json.loads
+    templates = {'on': (True,), 'off': (False,), 'both': (False, True)}[options.templates]
+    scenarios = [Scenario(engine, mode, template)
+                 for engine in options.engine or engines()
+                 for mode in options.mode or MODES
+                 for template in templates]
+    print('{} messages, decoder {}, collector latency {:.0f} ms'.format(len(messages), options.decoder,
+                                                                     options.latency * 1000))
+    print(HEADER.format('engine', 'mode', 'templates', 'msgs/s', 'p50 ms', 'p99 ms', 'cpu us/msg', 'peak KiB',
+                        'failed'))
+    with Collector(options.latency) as collector:
+        for scenario in scenarios:
+            replay(scenario, messages[:options.warmup], options, collector, loads)
+            result = replay(scenario, messages, options, collector, loads)
+            traced = replay(scenario, messages[:options.alloc_messages], options, collector, loads, trace=True)
+            print(ROW.format(scenario.engine, scenario.mode, 'on' if scenario.templates else 'off', result.rate,
+                             result.p50 * 1000, result.p99 * 1000, result.cpu * 1000000, traced.peak / 1024,
+                             result.failed))
@@ -0,0 +1,5 @@
+import sys
+
+from proxy_google_analytics.bench import main
+
+main(sys.argv[1:])
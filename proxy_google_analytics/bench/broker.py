@@ -0,0 +1,326 @@
+"""In-process stand-in for RabbitMQ speaking the pika 0.13 callback API.
+
+``FakeBroker`` holds one queue; ``FakeConnection`` implements the part of
+``pika.SelectConnection`` and its channels ``Watcher`` uses, driven by a
+``FakeIOLoop`` with the same re-entrant ``start``/``stop`` semantics which
+any number of connections can share. Connections to hosts listed in
+``down`` fail to open and ``disconnect`` drops the open ones the way a
+broker restart does. The
+broker enforces the acknowledgement rules of RabbitMQ: unknown delivery
+tags close the channel with ``406 PRECONDITION_FAILED``, nacked messages
+are requeued as redelivered and so are messages left unacknowledged on
+a closed channel. Every message has an id, so a run can check that each
+one was acknowledged exactly once.
+"""
+import heapq
+import itertools
+import time
+from collections import Counter, deque, namedtuple
+from threading import Condition, Lock
+
+Deliver = namedtuple('Deliver', ['consumer_tag', 'delivery_tag', 'redelivered', 'exchange', 'routing_key'])
+Message = namedtuple('Message', ['id', 'routing_key', 'body'])
+
+PUMP_SIZE = 100
+
+
+class FakeIOLoop(object):
+
+    def __init__(self):
+        self._callbacks = deque()
+        self._timeouts = []
+        self._sequence = itertools.count()
+        self._cancelled = set()
+        self._condition = Condition()
+        self._stopping = False
+        self.idle = None
+
+    def add_callback_threadsafe(self, callback):
+        with self._condition:
+            self._callbacks.append(callback)
+            self._condition.notify()
+
+    def add_timeout(self, deadline, callback):
+        handle = next(self._sequence)
+        with self._condition:
+            heapq.heappush(self._timeouts, (time.monotonic() + deadline, handle, callback))
+            self._condition.notify()
+        return handle
+
+    def remove_timeout(self, handle):
+        with self._condition:
+            self._cancelled.add(handle)
+
+    def start(self):
+        self._stopping = False
+        while not self._stopping:
+            for callback in self.ready():
+                callback()
+                if self._stopping:
+                    return
+            if self.idle is not None:
+                self.idle()
+
+    def ready(self):
+        with self._condition:
+            if not self._callbacks:
+                timeout = None
+                if self._timeouts:
+                    timeout = max(self._timeouts[0][0] - time.monotonic(), 0)
+                if self.idle is not None:
+                    timeout = min(timeout, 0.01) if timeout is not None else 0.01
+                self._condition.wait(timeout)
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+            now = time.monotonic()
+            while self._timeouts and self._timeouts[0][0] <= now:
+                deadline, handle, callback = heapq.heappop(self._timeouts)
+                if handle in self._cancelled:
+                    self._cancelled.discard(handle)
+                else:
+                    callbacks.append(callback)
+        return callbacks
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+
+class FakeBroker(object):
+    """One queue with publish, delivery and settlement bookkeeping."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._ready = deque()
+        self._ids = itertools.count()
+        self.connections = []
+        self.down = set()
+        self.published = 0
+        self.acks = Counter()
+        self.nacked = 0
+        self.redelivered = 0
+        self.precondition_failures = 0
+
+    def publish(self, routing_key, body):
+        if isinstance(body, str):
+            body = body.encode('UTF-8')
+        with self._lock:
+            self._ready.append((Message(next(self._ids), routing_key, body), False))
+            self.published += 1
+
+    def take(self, count):
+        with self._lock:
+            return [self._ready.popleft() for _ in range(min(count, len(self._ready)))]
+
+    def requeue(self, messages):
+        with self._lock:
+            self.redelivered += len(messages)
+            self._ready.extendleft((message, True) for message in reversed(messages))
+
+    def ack(self, messages):
+        with self._lock:
+            self.acks.update(message.id for message in messages)
+
+    def depth(self):
+        with self._lock:
+            return len(self._ready)
+
+    def acked(self):
+        with self._lock:
+            return len(self.acks)
+
+    def duplicate_acks(self):
+        with self._lock:
+            return sum(count - 1 for count in self.acks.values() if count > 1)
+
+    def unacked(self):
+        return sum(len(channel.unacked) for connection in list(self.connections)
+                   for channel in list(connection.channels))
+
+    def ioloop_class(self):
+        ioloop = FakeIOLoop()
+        ioloop.idle = self.pump
+        return ioloop
+
+    def connection_class(self, parameters, on_open_callback=None, on_open_error_callback=None,
+                         stop_ioloop_on_close=False, custom_ioloop=None):
+        if custom_ioloop is None:
+            custom_ioloop = self.ioloop_class()
+        connection = FakeConnection(self, custom_ioloop)
+        if parameters.host in self.down:
+            connection.is_open = False
+            if on_open_error_callback is not None:
+                custom_ioloop.add_callback_threadsafe(
+                    lambda: on_open_error_callback(connection, 'Connection refused'))
+            return connection
+        self.connections.append(connection)
+        if on_open_callback is not None:
+            custom_ioloop.add_callback_threadsafe(lambda: on_open_callback(connection))
+        return connection
+
+    def disconnect(self):
+        """Drop every open connection, requeueing their unacknowledged messages."""
+        for connection in list(self.connections):
+            connection.ioloop.add_callback_threadsafe(
+                lambda connection=connection: connection.close(320, 'CONNECTION_FORCED - broker forced connection closure'))
+
+    def pump(self):
+        for connection in list(self.connections):
+            if connection.is_open:
+                connection.pump()
+
+
+class FakeConnection(object):
+
+    def __init__(self, broker, ioloop):
+        self.broker = broker
+        self.ioloop = ioloop
+        self.channels = []
+        self.is_open = True
+        self._close_callbacks = []
+        self._channel_numbers = itertools.count(1)
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def add_on_close_callback(self, callback):
+        self._close_callbacks.append(callback)
+
+    def add_timeout(self, deadline, callback):
+        return self.ioloop.add_timeout(deadline, callback)
+
+    def remove_timeout(self, handle):
+        self.ioloop.remove_timeout(handle)
+
+    def add_callback_threadsafe(self, callback):
+        self.ioloop.add_callback_threadsafe(callback)
+
+    def channel(self, on_open_callback=None):
+        channel = FakeChannel(self, next(self._channel_numbers))
+        self.channels.append(channel)
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(channel))
+        return channel
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        if not self.is_open:
+            return
+        for channel in list(self.channels):
+            channel.close(reply_code, reply_text)
+        self.is_open = False
+        for callback in self._close_callbacks:
+            self.ioloop.add_callback_threadsafe(lambda callback=callback: callback(self, reply_code, reply_text))
+
+    def pump(self):
+        for channel in list(self.channels):
+            channel.pump()
+
+
+class FakeChannel(object):
+
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self.is_open = True
+        self.prefetch_count = 0
+        self.unacked = {}
+        self._delivery_tags = itertools.count(1)
+        self._consumers = {}
+        self._consumer_tags = itertools.count(1)
+        self._close_callbacks = []
+        self._cancel_callbacks = []
+
+    def __int__(self):
+        return self.channel_number
+
+    __index__ = __int__
+
+    def _reply(self, callback):
+        if callback is not None:
+            self.connection.ioloop.add_callback_threadsafe(lambda: callback(None))
+
+    def add_on_close_callback(self, callback):
+        self._close_callbacks.append(callback)
+
+    def add_on_cancel_callback(self, callback):
+        self._cancel_callbacks.append(callback)
+
+    def basic_qos(self, callback=None, prefetch_size=0, prefetch_count=0, all_channels=False):
+        self.prefetch_count = prefetch_count
+        self._reply(callback)
+
+    def exchange_declare(self, callback=None, exchange=None, **kwargs):
+        self._reply(callback)
+
+    def queue_declare(self, callback=None, queue='', **kwargs):
+        self._reply(callback)
+
+    def queue_bind(self, callback=None, queue=None, exchange=None, routing_key=None, **kwargs):
+        self._reply(callback)
+
+    def basic_consume(self, consumer_callback, queue='', no_ack=False, **kwargs):
+        consumer_tag = 'ctag{}.{}'.format(self.channel_number, next(self._consumer_tags))
+        self._consumers[consumer_tag] = consumer_callback
+        return consumer_tag
+
+    def basic_cancel(self, callback=None, consumer_tag=''):
+        self._consumers.pop(consumer_tag, None)
+        self._reply(callback)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        messages = self.settle(delivery_tag, multiple)
+        if messages is not None:
+            self.broker.ack(messages)
+
+    def basic_nack(self, delivery_tag=None, multiple=False, requeue=True):
+        messages = self.settle(delivery_tag, multiple)
+        if messages is None:
+            return
+        self.broker.nacked += len(messages)
+        if requeue:
+            self.broker.requeue(messages)
+
+    def settle(self, delivery_tag, multiple):
+        if not self.is_open:
+            return None
+        if delivery_tag not in self.unacked:
+            self.broker.precondition_failures += 1
+            self.close(406, 'PRECONDITION_FAILED - unknown delivery tag {}'.format(delivery_tag))
+            return None
+        if not multiple:
+            return [self.unacked.pop(delivery_tag)]
+        tags = [tag for tag in self.unacked if tag <= delivery_tag]
+        return [self.unacked.pop(tag) for tag in tags]
+
+    def pump(self):
+        for _ in range(PUMP_SIZE):
+            if not self.is_open or not self._consumers:
+                return
+            if self.prefetch_count and len(self.unacked) >= self.prefetch_count:
+                return
+            taken = self.broker.take(1)
+            if not taken:
+                return
+            (message, redelivered), = taken
+            consumer_tag, callback = next(iter(self._consumers.items()))
+            delivery_tag = next(self._delivery_tags)
+            self.unacked[delivery_tag] = message
+            callback(self, Deliver(consumer_tag, delivery_tag, redelivered, '', message.routing_key), None,
+                     message.body)
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        if not self.is_open:
+            return
+        self.is_open = False
+        self._consumers.clear()
+        if self.unacked:
+            self.broker.requeue([self.unacked[tag] for tag in sorted(self.unacked)])
+            self.unacked.clear()
+        if self in self.connection.channels:
+            self.connection.channels.remove(self)
+        for callback in self._close_callbacks:
+            self.connection.ioloop.add_callback_threadsafe(
+                lambda callback=callback: callback(self, reply_code, reply_text))
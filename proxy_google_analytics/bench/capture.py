@@ -0,0 +1,50 @@
+"""Message captures replayed by the benchmark.
+
+A capture is a JSONL file with one AMQP message per line, either as an
+object ``{"routing_key": ..., "body": ...}`` or as a ``[routing_key,
+body]`` pair. Bodies may be JSON strings or already decoded objects.
+"""
+import json
+
+CLICK = {'account_id': 'D7628E04-6CA5-4E3F-9952-A89191429BFC', 'cid': '1484946532.1539338045',
+         'url': 'https://example.com/catalog/item?utm_source=yottos&utm_medium=cpc&utm_campaign=offer',
+         'referer': 'https://news.example.org/article/2018/10/12/some-long-article-slug',
+         'ip': '93.184.216.34',
+         'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                       'Chrome/69.0.3497.100 Safari/537.36'}
+GOAL = dict(CLICK, price='12.50', currency='UAH')
+
+
+def synthesize(count):
+    """Alternate click and goal messages with distinct client ids."""
+    messages = []
+    for i in range(count):
+        body = dict(GOAL if i % 2 else CLICK, cid='{}.{}'.format(1484946532 + i, 1539338045))
+        messages.append(('action.goal' if i % 2 else 'action.click', json.dumps(body)))
+    return messages
+
+
+def load(path, limit=None):
+    messages = []
+    with open(path, encoding='UTF-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict):
+                key, body = record.get('routing_key'), record.get('body')
+            else:
+                key, body = record
+            if not key or body is None:
+                raise ValueError('{}:{}: message needs a routing key and a body'.format(path, number))
+            messages.append((key, body if isinstance(body, str) else json.dumps(body)))
+            if limit and len(messages) >= limit:
+                break
+    return messages
+
+
+def dump(messages, path):
+    with open(path, 'w', encoding='UTF-8') as f:
+        for key, body in messages:
+            f.write(json.dumps({'routing_key': key, 'body': body}) + '\n')
@@ -0,0 +1,153 @@
+"""Local stand-in for the Google Analytics collector.
+
+``CollectorServer`` answers ``/collect`` and ``/batch`` after a fixed
+``latency`` plus up to ``jitter`` seconds, failing a share
+``error_rate`` of the requests with ``error_status``, and counts the
+requests, hits and injected errors it saw; ``GET /stats`` returns the
+counts as JSON. ``Collector`` runs it in a child process, so its CPU
+time does not count against the pipeline being measured, or in a thread
+of the current process with ``in_process``.
+"""
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing import Process, Pipe
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from proxy_google_analytics.google_measurement_protocol import Transport
+from proxy_google_analytics.google_measurement_protocol.report import TRACKING_URI
+
+GA_ORIGIN = '{0.scheme}://{0.netloc}'.format(urlsplit(TRACKING_URI))
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status = self.server.handle_hits(self.path, body)
+        self.reply(status, b'', 'image/gif')
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.reply(200, json.dumps(self.server.stats()).encode('UTF-8'), 'application/json')
+        else:
+            self.reply(404, b'', 'text/plain')
+
+    def reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CollectorServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), CollectorHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self._lock = Lock()
+        self.requests = 0
+        self.hits = 0
+        self.errors = 0
+
+    def handle_hits(self, path, body):
+        if path not in ('/collect', '/batch'):
+            return 404
+        with self._lock:
+            delay = self.latency + self.jitter * self.random.random()
+            failed = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+            elif path == '/batch':
+                self.hits += body.count(b'\n') + 1 if body else 0
+            else:
+                self.hits += 1
+        return self.error_status if failed else 200
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'hits': self.hits, 'errors': self.errors}
+
+
+def _serve(connection, options):
+    server = CollectorServer(**options)
+    connection.send(server.server_address[1])
+    server.serve_forever()
+
+
+class Collector(object):
+    """Context manager running a ``CollectorServer`` for the duration of a benchmark."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=None, in_process=False):
+        self.options = {'latency': latency, 'jitter': jitter, 'error_rate': error_rate,
+                        'error_status': error_status, 'seed': seed}
+        self.in_process = in_process
+        self.server = None
+        self.process = None
+        self.origin = None
+
+    def __enter__(self):
+        if self.in_process:
+            self.server = CollectorServer(**self.options)
+            thread = Thread(target=self.server.serve_forever, name='Collector')
+            thread.daemon = True
+            thread.start()
+            port = self.server.server_address[1]
+        else:
+            parent, child = Pipe()
+            self.process = Process(target=_serve, args=(child, self.options), daemon=True)
+            self.process.start()
+            port = parent.recv()
+        self.origin = 'http://127.0.0.1:{}'.format(port)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+
+    def stats(self):
+        if self.server is not None:
+            return self.server.stats()
+        with urlopen(self.origin + '/stats') as response:
+            return json.loads(response.read().decode('UTF-8'))
+
+    def url(self, url):
+        """Point a Google Analytics URL at the collector."""
+        if url.startswith(GA_ORIGIN):
+            return self.origin + url[len(GA_ORIGIN):]
+        return url
+
+
+class CollectorTransport(Transport):
+    """Transport sending every Google Analytics request to a ``Collector``."""
+    __slots__ = ['collector']
+
+    def __init__(self, collector, **kwargs):
+        super(CollectorTransport, self).__init__(**kwargs)
+        self.collector = collector
+
+    def post(self, url, data, headers=None):
+        return super(CollectorTransport, self).post(self.collector.url(url), data, headers)
@@ -0,0 +1,61 @@
+"""Memory held per message waiting in the worker queue.
+
+Fills a ``FlowControlQueue`` with a capture, or synthetic messages, once
+as the ``(routing_key, str body, [token])`` tuples the watcher queued
+before and once as ``Message`` records, and prints the bytes traced per
+queued message for both next to the estimate the queue exports as
+``pga_queue_memory_bytes``::
+
+    python -m proxy_google_analytics.bench.memory -n 100000
+"""
+import argparse
+import sys
+import tracemalloc
+
+from proxy_google_analytics.bench.capture import load, synthesize
+from proxy_google_analytics.flow import FlowControlQueue, Message
+
+
+def legacy(key, body, token):
+    return key, body.decode(encoding='UTF-8'), [token]
+
+
+def record(key, body, token):
+    return Message(key, body, (token,))
+
+
+def measure(build, messages):
+    """Traced bytes per message of a queue filled with ``messages``.
+
+    Keys and bodies are allocated per message as pika does for every
+    delivery.
+    """
+    queue = FlowControlQueue()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for tag, (key, body) in enumerate(messages, 1):
+            queue.put(build(key.encode('UTF-8').decode('UTF-8'), body.encode('UTF-8'), (1, tag)))
+        held = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return held / max(len(messages), 1), queue.memory / max(len(messages), 1)
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(prog='python -m proxy_google_analytics.bench.memory',
+                                 description='Memory per message waiting in the worker queue')
+    ap.add_argument('capture', nargs='?', help='JSONL capture to queue, synthetic messages when omitted')
+    ap.add_argument('-n', '--messages', type=int, default=100000, help='messages to queue')
+    options = ap.parse_args(argv)
+    messages = load(options.capture, options.messages) if options.capture else synthesize(options.messages)
+    body_bytes = sum(len(body.encode('UTF-8')) for key, body in messages) / max(len(messages), 1)
+    print('{} messages, {:.0f} body bytes per message'.format(len(messages), body_bytes))
+    for name, build in (('tuple', legacy), ('record', record)):
+        traced, estimated = measure(build, messages)
+        print('{:<8} {:>6.0f} bytes traced per message, {:>6.0f} estimated by the queue'.format(name, traced,
+                                                                                             estimated))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
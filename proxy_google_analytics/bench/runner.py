@@ -0,0 +1,120 @@
+"""Closed-loop replay of messages through a worker.
+
+Messages are put on the worker queue with an acknowledgement token each,
+at most ``inflight`` of them unresolved at a time, and the worker
+resolves the tokens once their hits were delivered, exactly as it does
+for AMQP deliveries. Latency is the time from the put to the
+resolution, throughput and CPU time cover the whole replay.
+"""
+import time
+import tracemalloc
+from collections import namedtuple
+from queue import Queue
+from threading import BoundedSemaphore, Event, Lock
+
+from proxy_google_analytics import worker as worker_module
+from proxy_google_analytics.bench.collector import CollectorTransport
+from proxy_google_analytics.flow import Message
+from proxy_google_analytics.worker import Worker
+
+Scenario = namedtuple('Scenario', ['engine', 'mode', 'templates'])
+Result = namedtuple('Result', ['messages', 'failed', 'rate', 'p50', 'p99', 'cpu', 'peak'])
+
+ENGINES = ('thread', 'asyncio')
+MODES = ('single', 'batch')
+
+
+class Recorder(object):
+    """Stand-in for the ``Acknowledger`` timing every delivery."""
+
+    def __init__(self, inflight, expected):
+        self.slots = BoundedSemaphore(inflight)
+        self.expected = expected
+        self.started = {}
+        self.latencies = []
+        self.failed = 0
+        self.done = Event()
+        self._lock = Lock()
+        if not expected:
+            self.done.set()
+
+    def received(self, index):
+        self.slots.acquire()
+        with self._lock:
+            self.started[index] = time.perf_counter()
+        return 0, index
+
+    def tracked(self, tokens):
+        """Replayed deliveries never lose their channel."""
+        return True
+
+    def resolve(self, tokens, delivered=True):
+        now = time.perf_counter()
+        with self._lock:
+            for generation, index in tokens:
+                self.latencies.append(now - self.started.pop(index))
+            if not delivered:
+                self.failed += len(tokens)
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+        for _ in tokens:
+            self.slots.release()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+
+def worker_class(engine, collector):
+    if engine == 'thread':
+        return Worker
+    from proxy_google_analytics.async_worker import AsyncWorker
+
+    class CollectorAsyncWorker(AsyncWorker):
+
+        def requests(self):
+            for url, data, headers, jobs in super(CollectorAsyncWorker, self).requests():
+                yield collector.url(url), data, headers, jobs
+
+    return CollectorAsyncWorker
+
+
+def config(scenario, options):
+    return {'analytics': {'default': 'UA-5703702-15'},
+            'report': {'mode': scenario.mode, 'templates': scenario.templates, 'batch_size': 20,
+                       'batch_bytes': 16384, 'batch_linger': options.linger},
+            'transport': {'pool_size': options.concurrency, 'retries': 0},
+            'engine': {'concurrency': options.concurrency, 'drain_size': 100}}
+
+
+def replay(scenario, messages, options, collector, loads, trace=False):
+    recorder = Recorder(options.inflight, len(messages))
+    queue = Queue()
+    transport = CollectorTransport(collector, pool_size=options.concurrency, retries=0)
+    original, worker_module.json_loads = worker_module.json_loads, loads
+    worker = worker_class(scenario.engine, collector)(queue, None, config(scenario, options), transport, recorder)
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        for index, (key, body) in enumerate(messages):
+            queue.put(Message(key, body.encode('UTF-8'), (recorder.received(index),)))
+        recorder.done.wait()
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu
+        peak = tracemalloc.get_traced_memory()[1] if trace else 0
+    finally:
+        if trace:
+            tracemalloc.stop()
+        worker.stop()
+        worker.join()
+        transport.close()
+        worker_module.json_loads = original
+    count = len(messages) or 1
+    return Result(messages=len(messages), failed=recorder.failed, rate=len(messages) / elapsed,
+                  p50=percentile(recorder.latencies, 0.5), p99=percentile(recorder.latencies, 0.99),
+                  cpu=cpu / count, peak=peak)
@@ -5,3 +5,7 @@ import pymongo
 def get_click_engine(config):
     safe_conn = mongo_proxy.MongoProxy(pymongo.MongoClient(config['mongo']['uri']))
     return safe_conn
+
+
+def get_collection(click_engine, name):
+    return click_engine.get_default_database()[name]
@@ -0,0 +1,71 @@
+import random
+from urllib.parse import urlsplit
+
+
+class Backoff(object):
+    """Jittered exponential delays between reconnection attempts.
+
+    The delay doubles from ``initial`` up to ``maximum`` seconds with
+    every failed attempt and each one is drawn from its upper half, so
+    consumers that lost the broker together do not come back in step.
+    """
+    __slots__ = ['initial', 'maximum', 'attempts']
+
+    def __init__(self, initial=1.0, maximum=30.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next(self):
+        delay = min(self.initial * 2 ** min(self.attempts, 32), self.maximum)
+        self.attempts += 1
+        return random.uniform(delay / 2, delay)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class ConsumerChannel(object):
+    """A channel consuming the queue and the acknowledger generation of its deliveries."""
+    __slots__ = ['slot', 'channel', 'consumer_tag', 'generation']
+
+    def __init__(self, slot, channel):
+        self.slot = slot
+        self.channel = channel
+        self.consumer_tag = None
+        self.generation = None
+
+
+class ConnectionSlot(object):
+    """One of the parallel broker connections with its failover state.
+
+    Slots start out on different ``urls`` when several are configured
+    and move on to the next one whenever a connection attempt fails or
+    an open connection is lost.
+    """
+    __slots__ = ['index', 'urls', 'backoff', 'connection', 'channels', 'timer', '_position']
+
+    def __init__(self, index, urls, backoff):
+        self.index = index
+        self.urls = urls
+        self.backoff = backoff
+        self.connection = None
+        self.channels = []
+        self.timer = None
+        self._position = index % len(urls)
+
+    @property
+    def url(self):
+        return self.urls[self._position]
+
+    @property
+    def host(self):
+        """Host and port of the current url, leaving out its credentials."""
+        return urlsplit(self.url).netloc.rpartition('@')[2]
+
+    def failed(self):
+        """Forget the connection and return the seconds to wait before trying the next url."""
+        self.connection = None
+        self.channels = []
+        self._position = (self._position + 1) % len(self.urls)
+        return self.backoff.next()
@@ -0,0 +1,58 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class DedupWindow(object):
+    """Time-bounded window of recently seen message identities.
+
+    A message is identified by its routing key and the configured body
+    fields, or by its raw body when no fields are configured. Only the
+    hash of the identity is kept, entries expire ``window`` seconds after
+    they were first seen and at most ``max_entries`` are held, oldest
+    evicted first, so memory use is fixed. Identities of messages that
+    could not be delivered are to be forgotten, so their redelivery is
+    not dropped as a duplicate.
+    """
+    __slots__ = ['window', 'max_entries', 'fields', '_seen', '_lock', 'hits', 'misses']
+
+    def __init__(self, window=10.0, max_entries=100000, fields=()):
+        self.window = window
+        self.max_entries = max_entries
+        self.fields = tuple(fields)
+        self._seen = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def identity(self, key, data, raw):
+        if not self.fields:
+            return hash((key, raw))
+        return hash((key,) + tuple(data.get(field) for field in self.fields))
+
+    def seen(self, identity):
+        """Return True when ``identity`` was already seen within the window."""
+        now = time.monotonic()
+        deadline = now - self.window
+        with self._lock:
+            seen = self._seen
+            while seen:
+                oldest, first_seen = next(iter(seen.items()))
+                if first_seen > deadline:
+                    break
+                seen.popitem(last=False)
+            if identity in seen:
+                self.hits += 1
+                return True
+            seen[identity] = now
+            if len(seen) > self.max_entries:
+                seen.popitem(last=False)
+            self.misses += 1
+            return False
+
+    def forget(self, identity):
+        with self._lock:
+            self._seen.pop(identity, None)
@@ -0,0 +1,103 @@
+from importlib import import_module
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:
+    entry_points = None
+
+ENTRY_POINT_GROUP = 'proxy_google_analytics.hit_builders'
+DEFAULT_ROUTES = {'action.click': 'pageview', 'action.goal': 'goal'}
+
+
+def _builder_entry_points():
+    if entry_points is None:
+        return ()
+    found = entry_points()
+    if hasattr(found, 'select'):
+        return found.select(group=ENTRY_POINT_GROUP)
+    return found.get(ENTRY_POINT_GROUP, ())
+
+
+def load_builder(name, builtins=None):
+    """Resolve a hit builder by built-in name, entry point name or ``module:attribute`` path."""
+    if builtins and name in builtins:
+        return builtins[name]
+    if ':' in name:
+        module, attribute = name.split(':', 1)
+        builder = import_module(module)
+        for part in attribute.split('.'):
+            builder = getattr(builder, part)
+        return builder
+    for entry_point in _builder_entry_points():
+        if entry_point.name == name:
+            return entry_point.load()
+    raise ValueError('Unknown hit builder {!r}'.format(name))
+
+
+def _first(one, other):
+    if one is None or (other is not None and other[0] < one[0]):
+        return other
+    return one
+
+
+class Dispatcher(object):
+    """Map AMQP routing keys to hit builders.
+
+    Patterns follow topic exchange bindings: words are separated by dots,
+    ``*`` matches exactly one word and ``#`` zero or more. Exact keys win
+    over patterns, of several matching patterns the one declared first
+    wins. Exact keys start out in the lookup table, wildcard patterns are
+    compiled into a trie of words which is walked once per new routing
+    key, and its result, a miss included, is cached in the table, so
+    dispatching a message is one dict lookup.
+
+    A builder is called with the worker and the decoded message and
+    returns False when the message could not be routed to a tracking id.
+    """
+    __slots__ = ['max_cached', '_table', '_trie']
+
+    def __init__(self, routes, max_cached=1024):
+        self.max_cached = max_cached
+        self._table = {}
+        self._trie = ({}, [None])
+        for index, (pattern, builder) in enumerate(routes):
+            words = pattern.split('.')
+            if '*' not in words and '#' not in words:
+                self._table.setdefault(pattern, builder)
+                continue
+            node = self._trie
+            for word in words:
+                node = node[0].setdefault(word, ({}, [None]))
+            node[1][0] = _first(node[1][0], (index, builder))
+
+    @classmethod
+    def from_config(cls, routes, builtins=None):
+        """Compile a mapping of patterns to builder names, the default routes when it is empty."""
+        return cls([(pattern, load_builder(name, builtins)) for pattern, name in (routes or DEFAULT_ROUTES).items()])
+
+    def resolve(self, key):
+        """Return the builder of a routing key, None when no pattern matches."""
+        try:
+            return self._table[key]
+        except KeyError:
+            pass
+        match = self.match(self._trie, key.split('.'), 0)
+        builder = match[1] if match is not None else None
+        if len(self._table) < self.max_cached:
+            self._table[key] = builder
+        return builder
+
+    def match(self, node, words, position):
+        """Return the first declared ``(index, builder)`` under ``node`` matching ``words[position:]``."""
+        children, terminal = node
+        best = terminal[0] if position == len(words) else None
+        if position < len(words):
+            for word in (words[position], '*'):
+                child = children.get(word)
+                if child is not None:
+                    best = _first(best, self.match(child, words, position + 1))
+        child = children.get('#')
+        if child is not None:
+            for skipped in range(position, len(words) + 1):
+                best = _first(best, self.match(child, words, skipped))
+        return best
@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from proxy_google_analytics.logger import logger, exception_message
+
+ITEM_PARAMS = frozenset(['in', 'iv', 'ic'])
+
+
+class Enricher(object):
+    """Fill Google Analytics parameters from click metadata stored in Mongo.
+
+    Documents are looked up by the value of the ``key`` message field in
+    the ``lookup_field`` document field; ``fields`` maps GA parameters to
+    document fields. Lookups of a whole drained batch go to Mongo as one
+    ``$in`` query through ``prefetch`` and results, misses included, stay
+    in a LRU cache of ``cache_size`` entries for ``ttl`` seconds. When a
+    query fails, Mongo is left alone for ``retry_delay`` seconds and
+    messages go out without enrichment meanwhile, so workers do not stall
+    on an unavailable replica set.
+    """
+    __slots__ = ['collection', 'key', 'lookup_field', 'fields', 'cache_size', 'ttl', 'retry_delay', '_cache',
+                 '_unavailable', '_lock', 'hits', 'misses']
+
+    def __init__(self, collection, key, lookup_field='_id', fields=None, cache_size=10000, ttl=600, retry_delay=30):
+        self.collection = collection
+        self.key = key
+        self.lookup_field = lookup_field
+        self.fields = dict(fields or {})
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.retry_delay = retry_delay
+        self._cache = OrderedDict()
+        self._unavailable = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def prefetch(self, messages):
+        """Load metadata of all messages missing from the cache with one query."""
+        keys = set(key for key in (message.get(self.key) for message in messages) if isinstance(key, (str, int)))
+        now = time.monotonic()
+        with self._lock:
+            missing = [key for key in keys if self.cached(key, now) is None]
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if not missing or now < self._unavailable:
+            return
+        found = dict.fromkeys(missing, {})
+        projection = dict.fromkeys(self.fields.values(), True)
+        projection[self.lookup_field] = True
+        try:
+            for document in self.collection.find({self.lookup_field: {'$in': missing}}, projection):
+                found[document.get(self.lookup_field)] = {
+                    param: str(document[field]) for param, field in self.fields.items()
+                    if document.get(field) not in (None, '')}
+        except Exception as e:
+            self._unavailable = time.monotonic() + self.retry_delay
+            logger.error(exception_message(exc=str(e), retry_delay=self.retry_delay))
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, params in found.items():
+                self._cache[key] = (expires, params)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def cached(self, key, now):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry[1]
+
+    def params(self, message):
+        """Return the prefetched GA parameters for a message, none when they could not be loaded."""
+        key = message.get(self.key)
+        if not isinstance(key, (str, int)):
+            return {}
+        with self._lock:
+            params = self.cached(key, time.monotonic())
+        return params or {}
+
+
+def split_params(params):
+    """Split enrichment parameters into item-only and all-hit ones."""
+    item = {}
+    common = {}
+    for param, value in params.items():
+        (item if param in ITEM_PARAMS else common)[param] = value
+    return item, common
@@ -0,0 +1,83 @@
+import sys
+import time
+from queue import Queue
+
+
+class Message(object):
+    """An AMQP delivery waiting for a worker.
+
+    Holds the raw body as received, decoded only by the worker, the
+    routing key interned so all messages of a key share one string, the
+    acknowledgement tokens of the delivery and the epoch time it was
+    received at.
+    """
+    __slots__ = ['key', 'body', 'tokens', 'received']
+
+    def __init__(self, key, body, tokens=(), received=None):
+        self.key = sys.intern(key)
+        self.body = body
+        self.tokens = tokens
+        self.received = time.time() if received is None else received
+
+    def footprint(self):
+        """Approximate bytes of memory held by the message, its interned key excluded."""
+        return (sys.getsizeof(self) + sys.getsizeof(self.body) + sys.getsizeof(self.tokens) +
+                sum(sys.getsizeof(token) for token in self.tokens) + sys.getsizeof(self.received))
+
+
+class FlowControlQueue(Queue):
+    """Worker queue bounded by message count and body bytes with watermarks.
+
+    Puts never block: once the queue holds ``max_messages`` messages or
+    ``max_bytes`` bytes of bodies ``on_high`` is called so the producer
+    can stop consuming, and ``on_low`` follows when workers have drained
+    it below ``low_watermark`` of both limits. Both callbacks run with the
+    queue mutex held and must not touch the queue. Besides body bytes the
+    queue keeps the approximate ``memory`` held by its messages.
+    """
+
+    def __init__(self, max_messages=0, max_bytes=0, low_watermark=0.5, on_high=None, on_low=None):
+        super(FlowControlQueue, self).__init__()
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.low_messages = int(max_messages * low_watermark)
+        self.low_bytes = int(max_bytes * low_watermark)
+        self.on_high = on_high
+        self.on_low = on_low
+        self.messages = 0
+        self.bytes = 0
+        self.memory = 0
+        self.paused = False
+
+    def _put(self, item):
+        super(FlowControlQueue, self)._put(item)
+        if not isinstance(item, Message):
+            return
+        self.messages += 1
+        self.bytes += len(item.body)
+        self.memory += item.footprint()
+        if not self.paused and self.over_high():
+            self.paused = True
+            if self.on_high is not None:
+                self.on_high()
+
+    def _get(self):
+        item = super(FlowControlQueue, self)._get()
+        if not isinstance(item, Message):
+            return item
+        self.messages -= 1
+        self.bytes -= len(item.body)
+        self.memory -= item.footprint()
+        if self.paused and self.under_low():
+            self.paused = False
+            if self.on_low is not None:
+                self.on_low()
+        return item
+
+    def over_high(self):
+        return ((self.max_messages and self.messages >= self.max_messages) or
+                (self.max_bytes and self.bytes >= self.max_bytes))
+
+    def under_low(self):
+        return ((not self.max_messages or self.messages <= self.low_messages) and
+                (not self.max_bytes or self.bytes <= self.low_bytes))
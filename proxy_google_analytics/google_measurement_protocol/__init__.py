@@ -1,9 +1,14 @@
+from .batch import BatchReporter
 from .enhanced_purchase import enhanced_item, enhanced_purchase
 from .event import event
+from .ga4 import hit_events, report_events
 from .pageview import pageview
-from .report import report
+from .report import report, report_batch, report_lines
+from .template import HitTemplate
 from .transaction import item, transaction
+from .transport import Transport
 
 __all__ = [
-    'enhanced_item', 'enhanced_purchase', 'event', 'pageview', 'report',
-    'item', 'transaction']
+    'BatchReporter', 'HitTemplate', 'enhanced_item', 'enhanced_purchase',
+    'event', 'hit_events', 'pageview', 'report', 'report_batch',
+    'report_events', 'report_lines', 'item', 'transaction', 'Transport']
@@ -0,0 +1,112 @@
+import time
+from typing import Callable, Dict, Iterable, List
+
+import requests
+
+from .report import (
+    BATCH_MAX_BYTES, BATCH_MAX_HITS, _encode_payloads, _finalize_payloads,
+    _make_batch_request)
+from .transport import Transport, is_healthy
+
+
+class BatchReporter(object):
+    """Accumulate hits across report calls and send them through /batch.
+
+    Hits of all reports are packed into one pending batch which is sent
+    as soon as it is full or, through ``flush_expired``, once its oldest
+    hit has waited ``linger`` seconds. Per-hit client data has to travel
+    in the payload (``ua``, ``uip``) since one batch request carries hits
+    of many clients.
+
+    When ``spill`` is given, the lines of a batch that fails with a
+    connection error, a 5xx or a 429 response are handed to it instead
+    of raising. ``flushed`` counts the batches sent or spilled, so a
+    caller can tell that every hit queued before a report went out.
+    """
+    __slots__ = ['max_hits', 'max_bytes', 'linger', 'extra_headers',
+                 'transport', 'spill', 'flushed', '_lines', '_size',
+                 '_started']
+
+    def __init__(
+            self, max_hits: int=BATCH_MAX_HITS,
+            max_bytes: int=BATCH_MAX_BYTES, linger: float=1.0,
+            extra_headers: Dict[str, str]=None, transport: Transport=None,
+            spill: Callable[[List[str]], None]=None):
+        self.max_hits = min(max_hits, BATCH_MAX_HITS)
+        self.max_bytes = min(max_bytes, BATCH_MAX_BYTES)
+        self.linger = linger
+        self.extra_headers = extra_headers
+        self.transport = transport
+        self.spill = spill
+        self.flushed = 0
+        self._lines = []
+        self._size = 0
+        self._started = None
+
+    def __len__(self):
+        return len(self._lines)
+
+    def report(
+            self, tracking_id: str, client_id: str, payloads: Iterable[Dict],
+            extra_headers: Dict[str, str]=None,
+            **extra_data) -> List[requests.Response]:
+        """Queue measurements, sending every batch that gets full."""
+        return self.report_lines(_encode_payloads(_finalize_payloads(
+            tracking_id, client_id, payloads, **extra_data)))
+
+    def report_lines(
+            self, lines: Iterable[str],
+            extra_headers: Dict[str, str]=None) -> List[requests.Response]:
+        """Queue already url-encoded hits."""
+        responses = []
+        for line in lines:
+            if self._lines and self._size + len(line) + 1 > self.max_bytes:
+                responses.append(self.flush())
+            self._add(line)
+            if len(self._lines) >= self.max_hits:
+                responses.append(self.flush())
+        return responses
+
+    def remaining(self) -> float:
+        """Seconds left before the pending batch has to be sent."""
+        if self._started is None:
+            return self.linger
+        return max(0.0, self._started + self.linger - time.monotonic())
+
+    def flush_expired(self) -> requests.Response:
+        if self._lines and self.remaining() <= 0:
+            return self.flush()
+
+    def flush(self) -> requests.Response:
+        if not self._lines:
+            return None
+        lines = self.take()
+        try:
+            response = _make_batch_request(
+                lines, self.extra_headers, self.transport)
+        except requests.RequestException:
+            if self.spill is None:
+                raise
+            self.spill(lines)
+            self.flushed += 1
+            return None
+        if (response is not None and self.spill is not None and
+                not is_healthy(response.status_code)):
+            self.spill(lines)
+            response = None
+        self.flushed += 1
+        return response
+
+    def take(self) -> List[str]:
+        """Remove and return the pending hits without sending them."""
+        lines = self._lines
+        self._lines = []
+        self._size = 0
+        self._started = None
+        return lines
+
+    def _add(self, line: str):
+        if self._started is None:
+            self._started = time.monotonic()
+        self._lines.append(line)
+        self._size += len(line) + 1
@@ -0,0 +1,110 @@
+import json
+import re
+from typing import Dict, Iterable, List, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+import requests
+
+from .report import EVENT_TIME, _post
+from .transport import Transport
+
+GA4_URI = 'https://www.google-analytics.com/mp/collect'
+GA4_MAX_EVENTS = 25
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Longest values, in characters, GA4 keeps of an event parameter.
+PARAM_LIMIT = 100
+PARAM_LIMITS = {'page_location': 1000, 'page_referrer': 420,
+                'page_title': 300}
+
+_INVALID_NAME = re.compile(r'[^0-9A-Za-z_]')
+
+
+def event_name(action: str) -> str:
+    """Turn a Universal Analytics event action into a valid GA4 name."""
+    name = _INVALID_NAME.sub('_', action or '')[:40]
+    return name if name[:1].isalpha() else 'event'
+
+
+def _params(**values) -> Dict:
+    params = {}
+    for name, value in values.items():
+        if value is None or value == '':
+            continue
+        if isinstance(value, str):
+            value = value[:PARAM_LIMITS.get(name, PARAM_LIMIT)]
+        params[name] = value
+    return params
+
+
+def _number(value: str):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def hit_events(
+        lines: Iterable[str]) -> List[Tuple[str, str, int, Dict]]:
+    """Translate url-encoded hits into GA4 events.
+
+    Returns ``(tracking_id, client_id, timestamp_micros, event)`` tuples,
+    the timestamp taken from the event time marker of the hit, None
+    without one. Pageviews become ``page_view``, events are named after
+    their action and a transaction becomes a ``purchase`` carrying the
+    item hits of the same transaction id that follow it. Other hit types
+    have no GA4 counterpart and are skipped.
+    """
+    events = []
+    purchases = {}
+    for line in lines:
+        head, marker, event_time = line.rpartition(EVENT_TIME)
+        if not marker:
+            head, event_time = line, None
+        hit = dict(parse_qsl(head))
+        timestamp = int(event_time) * 1000 if event_time else None
+        hit_type = hit.get('t')
+        if hit_type == 'pageview':
+            event = {'name': 'page_view', 'params': _params(
+                page_location=hit.get('dl'), page_referrer=hit.get('dr'),
+                page_title=hit.get('dt'))}
+        elif hit_type == 'event':
+            event = {'name': event_name(hit.get('ea')), 'params': _params(
+                event_category=hit.get('ec'), event_label=hit.get('el'),
+                value=_number(hit.get('ev')), page_location=hit.get('dl'))}
+        elif hit_type == 'transaction':
+            event = {'name': 'purchase', 'params': _params(
+                transaction_id=hit.get('ti'), value=_number(hit.get('tr')),
+                currency=hit.get('cu'), tax=_number(hit.get('tt')),
+                shipping=_number(hit.get('ts')),
+                affiliation=hit.get('ta'), page_location=hit.get('dl'))}
+            event['params']['items'] = []
+            purchases[hit.get('ti')] = event
+        elif hit_type == 'item':
+            purchase = purchases.get(hit.get('ti'))
+            if purchase is not None:
+                purchase['params']['items'].append(_params(
+                    item_id=hit.get('ic'), item_name=hit.get('in'),
+                    item_category=hit.get('iv'),
+                    price=_number(hit.get('ip')),
+                    quantity=int(_number(hit.get('iq')) or 1)))
+            continue
+        else:
+            continue
+        events.append((hit.get('tid'), hit.get('cid'), timestamp, event))
+    return events
+
+
+def report_events(
+        measurement_id: str, api_secret: str, client_id: str,
+        events: List[Dict], timestamp_micros: int=None,
+        transport: Transport=None) -> requests.Response:
+    """Post up to ``GA4_MAX_EVENTS`` events of a client to ``mp/collect``."""
+    body = {'client_id': client_id, 'events': events}
+    if timestamp_micros is not None:
+        body['timestamp_micros'] = timestamp_micros
+    uri = GA4_URI + '?' + urlencode(
+        [('measurement_id', measurement_id), ('api_secret', api_secret)])
+    return _post(uri, 'mp/collect', json.dumps(body), JSON_HEADERS,
+                 transport)
@@ -0,0 +1,47 @@
+import re
+from typing import Dict, Optional
+
+MAX_HIT_BYTES = 8 * 1024
+
+# Longest values, in UTF-8 bytes, Google Analytics keeps of a parameter.
+FIELD_LIMITS = {
+    'dl': 2048, 'dr': 2048, 'dp': 2048, 'dh': 100, 'dt': 1500, 'cd': 2048,
+    'ul': 20, 'cn': 100, 'cs': 100, 'cm': 50, 'ck': 500, 'cc': 500,
+    'ci': 100, 'ec': 150, 'ea': 500, 'el': 500, 'ti': 500, 'ta': 500,
+    'in': 500, 'ic': 500, 'iv': 500, 'cu': 10, 'tcc': 500, 'pal': 2048,
+    'uid': 256}
+DIMENSION_LIMIT = 150
+
+_DIMENSION = re.compile(r'cd\d+$')
+
+
+def field_limit(name: str) -> Optional[int]:
+    """Byte limit of a parameter, None when it is unbounded."""
+    limit = FIELD_LIMITS.get(name)
+    if limit is None and _DIMENSION.match(name):
+        return DIMENSION_LIMIT
+    return limit
+
+
+def truncate(value: str, limit: int) -> str:
+    """Cut ``value`` to ``limit`` UTF-8 bytes without splitting a character."""
+    if len(value) * 4 <= limit:
+        return value
+    encoded = value.encode('UTF-8')
+    if len(encoded) <= limit:
+        return value
+    return encoded[:limit].decode('UTF-8', 'ignore')
+
+
+def normalize_payload(payload: Dict) -> Dict:
+    """Drop empty parameters and truncate values past their limit."""
+    normalized = {}
+    for name, value in payload.items():
+        if value is None or value == '':
+            continue
+        if isinstance(value, str):
+            limit = field_limit(name)
+            if limit is not None:
+                value = truncate(value, limit)
+        normalized[name] = value
+    return normalized
@@ -1,24 +1,129 @@
-from typing import Dict, Generator, Iterable
+import time
+from typing import Dict, Generator, Iterable, List, Union
+from urllib.parse import urlencode
 
 import requests
 
+from .limits import MAX_HIT_BYTES, normalize_payload
+from .transport import Transport
+
 TRACKING_URI = 'https://ssl.google-analytics.com/collect'
+BATCH_URI = 'https://ssl.google-analytics.com/batch'
+
+BATCH_MAX_HITS = 20
+BATCH_MAX_BYTES = 16 * 1024
+
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+EVENT_TIME = '&_et='
+MAX_QUEUE_TIME = 4 * 60 * 60 * 1000
+QUEUE_TIME_BYTES = len('&qt=' + str(MAX_QUEUE_TIME))
+
+# Client data headers Google Analytics ignores when the hit carries the
+# matching parameter.
+CLIENT_HEADERS = {'User-Agent': 'ua', 'X-Forwarded-For': 'uip'}
+
+
+def _ignore(*args) -> None:
+    pass
+
+
+class ReportHooks(object):
+    """Callbacks told about requests and dropped hits.
+
+    ``request`` gets the endpoint, status code (or ``'error'``) and
+    seconds of every request, ``expired`` and ``oversized`` the number
+    of hits dropped for their age or size. They do nothing until an
+    application assigns them, e.g. to record metrics.
+    """
+    __slots__ = ['request', 'expired', 'oversized']
+
+    def __init__(self):
+        self.request = _ignore
+        self.expired = _ignore
+        self.oversized = _ignore
+
+
+HOOKS = ReportHooks()
 
 
 def report(
         tracking_id: str, client_id: str, payloads: Iterable[Dict],
-        extra_headers: Dict[str, str]=None,
+        extra_headers: Dict[str, str]=None, transport: Transport=None,
         **extra_data) -> Iterable[requests.Response]:
     """Actually report measurements to Google Analytics."""
+    headers = dict(extra_headers or {}, **FORM_HEADERS)
     return [
-        _make_request(data, extra_headers) for data in _finalize_payloads(
-            tracking_id, client_id, payloads, **extra_data)]
+        _make_request(line, _client_headers(headers, payload), transport)
+        for payload in _finalize_payloads(
+            tracking_id, client_id, payloads, **extra_data)
+        for line in _stamp_queue_time(_encode_payloads([payload]))]
+
+
+def report_batch(
+        tracking_id: str, client_id: str, payloads: Iterable[Dict],
+        extra_headers: Dict[str, str]=None, transport: Transport=None,
+        **extra_data) -> Iterable[requests.Response]:
+    """Report measurements to Google Analytics packed into batch requests."""
+    lines = _encode_payloads(_finalize_payloads(
+        tracking_id, client_id, payloads, **extra_data))
+    return [
+        _make_batch_request(batch, extra_headers, transport)
+        for batch in _batch_lines(lines)]
+
+
+def report_lines(
+        lines: Iterable[str], extra_headers: Dict[str, str]=None,
+        transport: Transport=None) -> Iterable[requests.Response]:
+    """Report already url-encoded hits to Google Analytics one by one."""
+    headers = dict(extra_headers or {}, **FORM_HEADERS)
+    return [_make_request(line, headers, transport)
+            for line in _stamp_queue_time(lines)]
+
+
+def _client_headers(
+        headers: Dict[str, str], payload: Dict) -> Dict[str, str]:
+    """Leave out headers duplicating client data the payload carries."""
+    if not any(header in headers and name in payload
+               for header, name in CLIENT_HEADERS.items()):
+        return headers
+    return {header: value for header, value in headers.items()
+            if CLIENT_HEADERS.get(header) not in payload}
 
 
 def _make_request(
-        data: Dict, extra_headers: Dict[str, str]) -> requests.Response:
-    return requests.post(
-        TRACKING_URI, data=data, headers=extra_headers, timeout=5.0)
+        data: Union[Dict, str], extra_headers: Dict[str, str],
+        transport: Transport=None) -> requests.Response:
+    return _post(TRACKING_URI, 'collect', data, extra_headers, transport)
+
+
+def _make_batch_request(
+        lines: List[str], extra_headers: Dict[str, str],
+        transport: Transport=None) -> requests.Response:
+    """Post a batch, None when all of its hits expired."""
+    data = '\n'.join(_stamp_queue_time(lines))
+    if not data:
+        return None
+    return _post(BATCH_URI, 'batch', data, extra_headers, transport)
+
+
+def _post(
+        uri: str, endpoint: str, data: Union[Dict, str],
+        extra_headers: Dict[str, str],
+        transport: Transport=None) -> requests.Response:
+    """Post to Google Analytics recording latency and status code."""
+    status = 'error'
+    started = time.perf_counter()
+    try:
+        if transport is not None:
+            response = transport.post(uri, data, extra_headers)
+        else:
+            response = requests.post(
+                uri, data=data, headers=extra_headers, timeout=5.0)
+        status = response.status_code
+        return response
+    finally:
+        HOOKS.request(endpoint, status, time.perf_counter() - started)
 
 
 def _finalize_payloads(
@@ -26,7 +131,8 @@ def _finalize_payloads(
         **extra_data) -> Generator[Dict, None, None]:
     """Get final data for API requests for Google Analytics.
 
-    Updates payloads setting required non-specific values on data.
+    Updates payloads setting required non-specific values on data,
+    drops empty parameters and truncates values to their byte limits.
     """
     extra_payload = {
         'v': '1', 'tid': tracking_id, 'cid': client_id, 'aip': '1'}
@@ -35,4 +141,81 @@ def _finalize_payloads(
         final_payload = dict(payload)
         final_payload.update(extra_payload)
         final_payload.update(extra_data)
-        yield final_payload
+        yield normalize_payload(final_payload)
+
+
+def _encode_payloads(
+        payloads: Iterable[Dict]) -> Generator[str, None, None]:
+    """Url-encode final payloads the way requests encodes form data.
+
+    Hits Google Analytics would reject for their size are dropped.
+    """
+    return _within_hit_limit(
+        urlencode([(key, value) for key, value in payload.items()
+                   if value is not None], doseq=True)
+        for payload in payloads)
+
+
+def _within_hit_limit(
+        lines: Iterable[str],
+        max_bytes: int=MAX_HIT_BYTES) -> Generator[str, None, None]:
+    """Drop and count encoded hits longer than ``max_bytes``.
+
+    Room is left for the ``qt`` parameter added when the hit is sent.
+    """
+    max_bytes -= QUEUE_TIME_BYTES
+    for line in lines:
+        if len(line.rpartition(EVENT_TIME)[0] or line) > max_bytes:
+            HOOKS.oversized(1)
+            continue
+        yield line
+
+
+def _stamp_queue_time(
+        lines: Iterable[str], now: float=None) -> List[str]:
+    """Replace the event time of encoded hits by their queue time.
+
+    Hits may carry the epoch milliseconds of their event after
+    ``EVENT_TIME`` as the last parameter until they are sent, so time
+    spent in buffers, batches, retries and the spill log all counts. It
+    becomes ``qt`` as of ``now``; hits older than the four hours Google
+    Analytics accepts are dropped and counted.
+    """
+    now = int((time.time() if now is None else now) * 1000)
+    stamped = []
+    expired = 0
+    for line in lines:
+        head, marker, event_time = line.rpartition(EVENT_TIME)
+        if not marker:
+            stamped.append(line)
+            continue
+        queue_time = max(now - int(event_time), 0)
+        if queue_time > MAX_QUEUE_TIME:
+            expired += 1
+            continue
+        stamped.append(head + '&qt=' + str(queue_time))
+    if expired:
+        HOOKS.expired(expired)
+    return stamped
+
+
+def _batch_lines(
+        lines: Iterable[str], max_hits: int=BATCH_MAX_HITS,
+        max_bytes: int=BATCH_MAX_BYTES) -> Generator[List[str], None, None]:
+    """Group encoded hits into batches within the protocol limits.
+
+    A batch holds at most ``max_hits`` hits and its body, hits joined by
+    newlines, is at most ``max_bytes`` long.
+    """
+    batch = []
+    size = 0
+    for line in lines:
+        if batch and (len(batch) >= max_hits or
+                      size + len(line) + 1 > max_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(line)
+        size += len(line) + 1
+    if batch:
+        yield batch
@@ -0,0 +1,65 @@
+from typing import Dict, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (500, 502, 503, 504)
+THROTTLE_STATUS = 429
+
+
+def is_healthy(status: int) -> bool:
+    """Whether a response status means the hit was accepted."""
+    return status < 500 and status != THROTTLE_STATUS
+
+
+class Transport(object):
+    """Keep-alive connection pool for Google Analytics requests.
+
+    Connections are reused between hits, so the TCP and TLS handshakes
+    are paid once per pooled connection instead of once per request.
+    Connection errors and 5xx responses are retried with exponential
+    backoff.
+
+    When ``concurrency`` is given, requests take one of its slots and
+    report whether they were healthy, so an adaptive limit shrinks while
+    Google Analytics throttles, fails or times out.
+    """
+    __slots__ = ['session', 'timeout', 'concurrency']
+
+    def __init__(
+            self, pool_size: int=10, connect_timeout: float=3.05,
+            read_timeout: float=5.0, retries: int=3,
+            backoff_factor: float=0.3, concurrency=None):
+        retry = Retry(
+            total=retries, connect=retries, read=retries, status=retries,
+            backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['POST']), raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry,
+            pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.concurrency = concurrency
+
+    def post(
+            self, url: str, data: Union[Dict, str],
+            headers: Dict[str, str]=None) -> requests.Response:
+        if self.concurrency is None:
+            return self.session.post(
+                url, data=data, headers=headers, timeout=self.timeout)
+        healthy = False
+        self.concurrency.acquire()
+        try:
+            response = self.session.post(
+                url, data=data, headers=headers, timeout=self.timeout)
+            healthy = is_healthy(response.status_code)
+            return response
+        finally:
+            self.concurrency.feedback(healthy)
+            self.concurrency.release()
+
+    def close(self):
+        self.session.close()
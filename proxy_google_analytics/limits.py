@@ -0,0 +1,117 @@
+import time
+from threading import Condition, Lock
+
+
+class TokenBucket(object):
+    """Hits per second allowance which may run into debt.
+
+    A hit is admitted while the bucket holds tokens; its cost is charged
+    once the hits were built, so a message whose hits outnumber the
+    remaining tokens leaves the bucket negative and the next one waits
+    for the debt to be paid back.
+    """
+    __slots__ = ['rate', 'burst', 'tokens', 'updated']
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now):
+        """Seconds before the bucket holds a token again."""
+        self.refill(now)
+        if self.tokens > 0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class RateLimiter(object):
+    """Token buckets keyed by tracking id.
+
+    Every tracking id gets its own bucket of ``rate`` hits per second
+    and ``burst`` hits, or the rate set for it in ``overrides``, so hits
+    of one property never spend the quota of another.
+    """
+    __slots__ = ['rate', 'burst', 'overrides', '_buckets', '_lock']
+
+    def __init__(self, rate, burst=100, overrides=None):
+        self.rate = rate
+        self.burst = burst
+        self.overrides = dict(overrides or {})
+        self._buckets = {}
+        self._lock = Lock()
+
+    def bucket(self, tracking_id):
+        bucket = self._buckets.get(tracking_id)
+        if bucket is None:
+            rate = self.overrides.get(tracking_id, self.rate)
+            bucket = self._buckets.setdefault(tracking_id, TokenBucket(rate, max(self.burst, rate)))
+        return bucket
+
+    def wait(self, tracking_id):
+        with self._lock:
+            return self.bucket(tracking_id).wait(time.monotonic())
+
+    def charge(self, tracking_id, hits):
+        with self._lock:
+            bucket = self.bucket(tracking_id)
+            bucket.refill(time.monotonic())
+            bucket.tokens -= hits
+
+
+class AdaptiveConcurrency(object):
+    """Limit of concurrent requests adjusted by AIMD.
+
+    Slots are taken with ``acquire`` or ``try_acquire`` and given back
+    with ``release``; the outcome of every request is reported through
+    ``feedback``. A healthy response raises the limit by ``1 / limit``,
+    so about one more slot per round of requests; a throttled, failed or
+    timed out request multiplies it by ``backoff``, at most once per
+    ``cooldown`` seconds so one burst of failures counts once. The limit
+    stays within ``minimum`` and ``maximum``.
+    """
+    __slots__ = ['minimum', 'maximum', 'backoff', 'cooldown', 'limit', 'inflight', '_decreased', '_condition']
+
+    def __init__(self, minimum=1, maximum=10, backoff=0.5, cooldown=1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.limit = float(maximum)
+        self.inflight = 0
+        self._decreased = 0.0
+        self._condition = Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            if self.inflight >= int(self.limit):
+                return False
+            self.inflight += 1
+            return True
+
+    def acquire(self):
+        with self._condition:
+            while self.inflight >= int(self.limit):
+                self._condition.wait()
+            self.inflight += 1
+
+    def release(self):
+        with self._condition:
+            self.inflight -= 1
+            self._condition.notify_all()
+
+    def feedback(self, healthy):
+        with self._condition:
+            if healthy:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self._decreased >= self.cooldown:
+                    self._decreased = now
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+            self._condition.notify_all()
@@ -1,26 +1,218 @@
-__all__ = ['logger', 'exception_message']
+__all__ = ['logger', 'exception_message', 'configure_logging', 'shutdown_logging']
+import atexit
 import linecache
 import sys
 import logging
 import os
 import json
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import Empty, Full, Queue
+from threading import Lock
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 logger = logging.getLogger('proxy_google_analytics')
 logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+QUEUE_SIZE = 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object per line."""
+
+    def format(self, record):
+        document = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                    'message': record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            document['exception'] = record.exc_text
+        return json.dumps(document, default=str)
+
+
+class RepeatFilter(logging.Filter):
+    """Pass at most ``burst`` warnings of a message per reporting interval.
+
+    A message is told apart by its call site and template, or for an
+    ``exception_message`` by where the exception was raised. Records past
+    the burst are counted instead of logged, so a storm of identical
+    failures costs a dict update each. Records below WARNING always pass.
+    ``drain`` hands the counts with the last suppressed record of every
+    message to the listener, which logs them as one summary line, and
+    opens the next interval.
+    """
+
+    def __init__(self, burst=10):
+        super(RepeatFilter, self).__init__()
+        self.burst = burst
+        self._passed = {}
+        self._suppressed = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+        if not self.burst or record.levelno < logging.WARNING:
+            return True
+        msg = record.msg
+        if isinstance(msg, ExceptionMessage):
+            template = (msg.filename, msg.lineno)
+        else:
+            template = msg if isinstance(msg, str) else type(msg)
+        site = (record.pathname, record.lineno, template)
+        with self._lock:
+            passed = self._passed.get(site, 0)
+            if passed < self.burst:
+                self._passed[site] = passed + 1
+                return True
+            suppressed = self._suppressed.get(site)
+            self._suppressed[site] = (record, suppressed[1] + 1 if suppressed else 1)
+        return False
+
+    def drain(self):
+        with self._lock:
+            suppressed = self._suppressed
+            self._passed = {}
+            self._suppressed = {}
+        return list(suppressed.values())
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hand records to the listener thread, dropping them when its queue is full.
+
+    Only the message arguments are merged in the logging thread, so a
+    mutable argument cannot change before the record is formatted;
+    formatting itself happens in the listener.
+    """
+
+    def __init__(self, queue):
+        super(NonBlockingQueueHandler, self).__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class LogListener(QueueListener):
+    """Emit queued records from a daemon thread, summarizing suppressed repeats every ``interval`` seconds."""
+
+    def __init__(self, queue, handler, source, repeats, interval=60.0):
+        super(LogListener, self).__init__(queue, handler, respect_handler_level=True)
+        self.source = source
+        self.repeats = repeats
+        self.interval = interval
+        self._report_at = time.monotonic() + interval
+
+    def dequeue(self, block):
+        while True:
+            now = time.monotonic()
+            if now >= self._report_at:
+                self._report_at = now + self.interval
+                self.report()
+            try:
+                return self.queue.get(timeout=self._report_at - now)
+            except Empty:
+                pass
+
+    def report(self):
+        for record, count in self.repeats.drain():
+            self.handle(logging.LogRecord(record.name, record.levelno, record.pathname, record.lineno,
+                                          '%s similar messages suppressed in %ss, last: %s',
+                                          (count, self.interval, record.getMessage()), None))
+        dropped, self.source.dropped = self.source.dropped, 0
+        if dropped:
+            self.handle(logging.LogRecord(logger.name, logging.WARNING, __file__, 0,
+                                          '%s log records dropped, the log queue was full', (dropped,), None))
+
+    def stop(self):
+        try:
+            self.queue.put_nowait(self._sentinel)
+        except Full:
+            self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+        self.report()
+
+
+formatter = logging.Formatter(TEXT_FORMAT)
 consoleHandler = logging.StreamHandler()
 consoleHandler.setFormatter(formatter)
 consoleHandler.setLevel(logging.INFO)
-logger.addHandler(consoleHandler)
+repeatFilter = RepeatFilter()
+queueHandler = NonBlockingQueueHandler(Queue(QUEUE_SIZE))
+queueHandler.addFilter(repeatFilter)
+logger.addHandler(queueHandler)
+_listener = None
+_interval = 60.0
+
+
+def _start_listener(queue_size=None):
+    global _listener
+    queueHandler.queue = Queue(queue_size or queueHandler.queue.maxsize)
+    _listener = LogListener(queueHandler.queue, consoleHandler, queueHandler, repeatFilter, _interval)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Emit the queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(config):
+    """Apply the ``logging`` config section, restarting the listener thread."""
+    global _interval
+    level = config.get('level', 'INFO')
+    logger.setLevel(level)
+    consoleHandler.setLevel(level)
+    consoleHandler.setFormatter(JsonFormatter() if config.get('format') == 'json' else formatter)
+    repeatFilter.burst = config.get('burst', 10)
+    _interval = config.get('interval', 60.0)
+    shutdown_logging()
+    _start_listener(config.get('queue_size', QUEUE_SIZE))
+
+
+_start_listener()
+atexit.register(shutdown_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_start_listener)
+
+
+class ExceptionMessage(object):
+    """Location and parameters of the exception being handled, formatted once the record is emitted."""
+    __slots__ = ['filename', 'lineno', 'module_globals', 'exc', 'args', 'kwargs']
+
+    def __init__(self, args, kwargs):
+        exc_type, exc_obj, tb = sys.exc_info()
+        self.filename = tb.tb_frame.f_code.co_filename if tb is not None else None
+        self.lineno = tb.tb_lineno if tb is not None else None
+        self.module_globals = tb.tb_frame.f_globals if tb is not None else None
+        self.exc = str(exc_obj)
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        line = ''
+        if self.filename is not None:
+            linecache.checkcache(self.filename)
+            line = linecache.getline(self.filename, self.lineno, self.module_globals)
+        params = json.dumps({'args': self.args, 'kwargs': self.kwargs})
+        return 'EXCEPTION IN ({}, LINE {} "{}"): {} PARAMS: {}'.format(self.filename, self.lineno, line.strip(),
+                                                                       self.exc, params)
 
 
 def exception_message(*args, **kwargs):
-    params = json.dumps({'args': args, 'kwargs': kwargs})
-    exc_type, exc_obj, tb = sys.exc_info()
-    f = tb.tb_frame
-    lineno = tb.tb_lineno
-    filename = f.f_code.co_filename
-    linecache.checkcache(filename)
-    line = linecache.getline(filename, lineno, f.f_globals)
-    return 'EXCEPTION IN ({}, LINE {} "{}"): {} PARAMS: {}'.format(filename, lineno, line.strip(), exc_obj, params)
+    return ExceptionMessage(args, kwargs)
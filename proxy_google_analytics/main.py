@@ -2,20 +2,27 @@ import argparse
 import os
 import sys
 import signal
+import time
 
-from trafaret_config import commandline
+from trafaret_config import commandline, read_and_validate, ConfigError
 
-from proxy_google_analytics.logger import logger, exception_message
+from proxy_google_analytics.logger import logger, exception_message, configure_logging, shutdown_logging
 from proxy_google_analytics.click_db import get_click_engine
+from proxy_google_analytics.metrics import MetricsServer
+from proxy_google_analytics.routing import ConfigReloader
 from proxy_google_analytics.utils import TRAFARET_CONF
 from proxy_google_analytics.watcher import Watcher
 
 
 class Daemonize(object):
-    __slots__ = ['watcher']
+    __slots__ = ['watcher', 'config_path', 'reload_interval', 'metrics', 'metrics_server']
 
-    def __init__(self, config):
+    def __init__(self, config, config_path=None):
         logger.info("Creating daemon.")
+        self.config_path = config_path
+        self.reload_interval = config.get('routing', {}).get('reload_interval', 10)
+        self.metrics = config.get('metrics', {})
+        self.metrics_server = None
         click_engine = get_click_engine(config)
         try:
             self.watcher = Watcher(config, click_engine)
@@ -26,6 +33,16 @@ class Daemonize(object):
     def start(self):
         logger.info("Add SIGTERM handler")
         signal.signal(signal.SIGTERM, self.sigterm)
+        if self.config_path:
+            logger.info("Add SIGHUP handler")
+            signal.signal(signal.SIGHUP, self.sighup)
+            if self.reload_interval:
+                ConfigReloader(self.config_path, self.reload, self.reload_interval)
+        if self.metrics.get('port'):
+            try:
+                self.metrics_server = MetricsServer(self.metrics.get('host', ''), self.metrics['port'])
+            except OSError as e:
+                logger.error('Cannot serve metrics on port %s: %s', self.metrics['port'], e)
         logger.info("Starting daemon.")
         self.action()
 
@@ -42,6 +59,107 @@ class Daemonize(object):
     def sigterm(self, signum, frame):
         self.watcher.stop()
 
+    def sighup(self, signum, frame):
+        self.reload()
+
+    def reload(self):
+        try:
+            config = read_and_validate(self.config_path, TRAFARET_CONF)
+        except (ConfigError, OSError) as e:
+            logger.error('Config %s is invalid, keeping the current one: %s', self.config_path, e)
+            return
+        self.watcher.reload(config)
+
+
+class Supervisor(object):
+    __slots__ = ['config', 'config_path', 'processes', 'children', 'stopping']
+
+    def __init__(self, config, config_path=None):
+        self.config = config
+        self.config_path = config_path
+        self.processes = config.get('engine', {}).get('processes', 1)
+        self.children = {}
+        self.stopping = False
+
+    def start(self):
+        logger.info("Add SIGTERM handler")
+        signal.signal(signal.SIGTERM, self.sigterm)
+        signal.signal(signal.SIGHUP, self.sighup)
+        logger.info("Starting supervisor with %s processes.", self.processes)
+        for index in range(self.processes):
+            self.spawn(index)
+        self.action()
+
+    def process_config(self, index):
+        config = dict(self.config)
+        spill = config.get('spill', {})
+        if spill.get('path'):
+            config['spill'] = dict(spill, path=os.path.join(spill['path'], str(index)))
+        sinks = config.get('sinks', {})
+        if sinks.get('file', {}).get('path'):
+            path = sinks['file']['path']
+            config['sinks'] = dict(sinks, file=dict(sinks['file'], path='{}.{}'.format(path, index)))
+        metrics = config.get('metrics', {})
+        if metrics.get('port'):
+            config['metrics'] = dict(metrics, port=metrics['port'] + index)
+        return config
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            code = 0
+            try:
+                daemon = Daemonize(config=self.process_config(index), config_path=self.config_path)
+                daemon.start()
+            except SystemExit as e:
+                code = e.code
+            except BaseException as e:
+                logger.error(exception_message(exc=str(e)))
+                code = 1
+            finally:
+                shutdown_logging()
+                os._exit(code or 0)
+        logger.info("Started consumer process %s", pid)
+        self.children[pid] = index
+
+    def action(self):
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except KeyboardInterrupt:
+                self.stop()
+                continue
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if self.stopping or index is None:
+                continue
+            logger.warning("Consumer process %s exited with status %s, restarting", pid, status)
+            time.sleep(1)
+            if not self.stopping:
+                self.spawn(index)
+        logger.warning("Stopping supervisor.")
+
+    def stop(self):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def sigterm(self, signum, frame):
+        self.stop()
+
+    def sighup(self, signum, frame):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
 
 def main(argv):
     dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -50,7 +168,11 @@ def main(argv):
                                           default_config=dir_path + '/../conf.yaml')
     options = ap.parse_args(argv)
     config = commandline.config_from_options(options, TRAFARET_CONF)
-    daemon = Daemonize(config=config)
+    configure_logging(config.get('logging', {}))
+    if config['engine']['processes'] > 1:
+        daemon = Supervisor(config=config, config_path=options.config)
+    else:
+        daemon = Daemonize(config=config, config_path=options.config)
     daemon.start()
 
 
@@ -0,0 +1,275 @@
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+
+from proxy_google_analytics.google_measurement_protocol.report import HOOKS
+from proxy_google_analytics.logger import logger
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                                           .replace('\n', r'\n'))
+                          for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(ABC):
+    """A named family of samples, one child per combination of label values."""
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = Lock()
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self.child())
+        return child
+
+    @abstractmethod
+    def child(self):
+        """A new child holding the samples of one combination of label values."""
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            for suffix, extra, value in child.samples():
+                yield self.name + suffix, _format_labels(self.label_names, values, extra), value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+        for name, labels, value in self.samples():
+            lines.append('{}{} {}'.format(name, labels, _format_value(value)))
+        return '\n'.join(lines)
+
+
+class _Value(object):
+    __slots__ = ['value', '_lock']
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield '', (), self.value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _FunctionValue(object):
+    __slots__ = ['function']
+
+    def __init__(self, function):
+        self.function = function
+
+    def samples(self):
+        try:
+            yield '', (), self.function()
+        except Exception as e:
+            logger.warning('Failed to collect a gauge: %s', e)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function, *values):
+        """Read the gauge from ``function`` whenever the registry is rendered."""
+        with self._lock:
+            self._children[tuple(str(value) for value in values)] = _FunctionValue(function)
+
+
+class _Buckets(object):
+    __slots__ = ['bounds', 'counts', 'sum', '_lock']
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            cumulative += count
+            yield '_bucket', (('le', _format_value(bound)),), cumulative
+        yield '_sum', (), total
+        yield '_count', (), cumulative
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Registry(object):
+    """Metrics of the process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+MESSAGES_CONSUMED = REGISTRY.counter('pga_messages_consumed_total', 'AMQP deliveries received.', ['routing_key'])
+MESSAGES_ACKED = REGISTRY.counter('pga_messages_acked_total', 'AMQP deliveries acknowledged.', ['routing_key'])
+MESSAGES_NACKED = REGISTRY.counter('pga_messages_nacked_total', 'AMQP deliveries rejected.', ['routing_key'])
+MESSAGES_DROPPED = REGISTRY.counter('pga_messages_dropped_total', 'Messages not reported to Google Analytics.',
+                                    ['reason'])
+MESSAGES_THROTTLED = REGISTRY.counter('pga_messages_throttled_total',
+                                      'Messages over the rate limit of their tracking id by action taken.',
+                                      ['action'])
+QUEUE_DEPTH = REGISTRY.gauge('pga_queue_messages', 'Messages waiting in the worker queue.')
+QUEUE_BYTES = REGISTRY.gauge('pga_queue_bytes', 'Body bytes of messages waiting in the worker queue.')
+QUEUE_MEMORY = REGISTRY.gauge('pga_queue_memory_bytes', 'Approximate memory held by messages in the worker queue.')
+BUFFER_FLUSH_SIZE = REGISTRY.histogram('pga_buffer_flush_size', 'Messages moved to the worker queue per flush.',
+                                       buckets=SIZE_BUCKETS)
+GA_REQUEST_SECONDS = REGISTRY.histogram('pga_ga_request_seconds', 'Latency of Google Analytics requests.',
+                                        ['endpoint'])
+GA_RESPONSES = REGISTRY.counter('pga_ga_responses_total', 'Google Analytics responses by status code.',
+                                ['endpoint', 'status'])
+GA_CONCURRENCY_LIMIT = REGISTRY.gauge('pga_ga_concurrency_limit', 'Adaptive limit of concurrent requests.',
+                                      ['owner'])
+HITS_EXPIRED = REGISTRY.counter('pga_hits_expired_total',
+                                'Hits dropped when sent for being older than Google Analytics accepts.')
+HITS_OVERSIZED = REGISTRY.counter('pga_hits_oversized_total',
+                                  'Hits dropped for exceeding the 8 KB Google Analytics accepts.')
+HITS_SPILLED = REGISTRY.counter('pga_hits_spilled_total', 'Hits written to the spill log.')
+SINK_HITS = REGISTRY.counter('pga_sink_hits_total', 'Hits written to additional sinks.', ['sink'])
+SINK_DROPPED = REGISTRY.counter('pga_sink_dropped_total', 'Hits, or GA4 events, dropped by additional sinks.',
+                                ['sink', 'reason'])
+SINK_FAILURES = REGISTRY.counter('pga_sink_failures_total', 'Failed writes and requests of additional sinks.',
+                                 ['sink'])
+WORKER_BUSY_SECONDS = REGISTRY.counter('pga_worker_busy_seconds_total', 'Time workers spent processing messages.',
+                                       ['worker'])
+
+
+def record_request(endpoint, status, seconds):
+    GA_REQUEST_SECONDS.labels(endpoint).observe(seconds)
+    GA_RESPONSES.labels(endpoint, status).inc()
+
+
+# Requests and dropped hits of the reporting functions are recorded here,
+# so google_measurement_protocol stays free of the daemon.
+HOOKS.request = record_request
+HOOKS.expired = HITS_EXPIRED.inc
+HOOKS.oversized = HITS_OVERSIZED.inc
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request from %s: ' + format, self.address_string(), *args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """HTTP server exposing a registry on ``/metrics`` from a daemon thread."""
+    daemon_threads = True
+
+    def __init__(self, host='', port=9100, registry=REGISTRY):
+        HTTPServer.__init__(self, (host, port), MetricsHandler)
+        self.registry = registry
+        thread = Thread(target=self.serve_forever, name='MetricsServer')
+        thread.daemon = True
+        thread.start()
+        logger.info('Serving metrics on %s:%s/metrics', host or '*', self.server_address[1])
+
+
+class Timer(object):
+    """Context manager adding the time spent inside it to a counter or histogram."""
+    __slots__ = ['record', 'started']
+
+    def __init__(self, record):
+        self.record = record
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.record(time.perf_counter() - self.started)
@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+from threading import Lock, Thread
+
+from proxy_google_analytics.logger import logger, exception_message
+
+RETRY_DELAY = 10.0
+
+
+class AccountRouter(object):
+    """Resolve advertiser accounts to Google Analytics tracking ids.
+
+    The table is built once from the ``analytics`` config section with
+    lower-cased account keys and interned tracking ids, ``default`` being
+    the fallback. When a Mongo collection is given, its account map is
+    merged under the configured one. It is loaded right away, so no
+    message is routed to the default for an account only Mongo knows,
+    and then refreshed in the background every ``ttl`` seconds, or after
+    ``RETRY_DELAY`` seconds when loading failed. Tables are swapped in as
+    a whole, so readers never see a partially loaded one.
+    """
+    __slots__ = ['collection', 'account_field', 'tracking_field', 'ttl', '_analytics', '_accounts', '_routes',
+                 '_expires', '_lock']
+
+    def __init__(self, analytics, collection=None, account_field='account_id', tracking_field='tracking_id', ttl=300):
+        self.collection = collection
+        self.account_field = account_field
+        self.tracking_field = tracking_field
+        self.ttl = ttl
+        self._analytics = {}
+        self._accounts = {}
+        self._routes = ({}, None)
+        self._expires = 0
+        self._lock = Lock()
+        self.load(analytics)
+        if collection is not None:
+            with self._lock:
+                self.load_accounts()
+
+    def __len__(self):
+        return len(self._routes[0])
+
+    def load(self, analytics):
+        """Rebuild the table from an ``analytics`` config section."""
+        self._analytics = self.normalize(analytics.items())
+        self.rebuild()
+
+    def configure(self, collection=None, account_field='account_id', tracking_field='tracking_id', ttl=300):
+        """Switch the account collection and its fields, refreshing the account map in the background."""
+        self.account_field = account_field
+        self.tracking_field = tracking_field
+        self.ttl = ttl
+        self.collection = collection
+        if collection is None:
+            self._accounts = {}
+            self.rebuild()
+        self._expires = 0
+
+    def rebuild(self):
+        table = dict(self._accounts)
+        table.update(self._analytics)
+        default = table.pop('default', None)
+        self._routes = (table, default)
+
+    @staticmethod
+    def normalize(items):
+        return {sys.intern(str(account).lower()): sys.intern(str(tracking_id))
+                for account, tracking_id in items if account and tracking_id}
+
+    def resolve(self, account_id):
+        """Return the tracking id of an account, numeric ids looked up as strings and other values as missing."""
+        if self.collection is not None and time.monotonic() >= self._expires:
+            self.schedule_refresh()
+        table, default = self._routes
+        if isinstance(account_id, int) and not isinstance(account_id, bool):
+            account_id = str(account_id)
+        elif not isinstance(account_id, str):
+            return default
+        if not account_id:
+            return default
+        return table.get(account_id.lower(), default)
+
+    def schedule_refresh(self):
+        if not self._lock.acquire(blocking=False):
+            return
+        self._expires = time.monotonic() + self.ttl
+        thread = Thread(target=self.refresh)
+        thread.daemon = True
+        thread.start()
+
+    def refresh(self):
+        try:
+            self.load_accounts()
+        finally:
+            self._lock.release()
+
+    def load_accounts(self):
+        """Load the account map of the collection, the caller holding the lock."""
+        self._expires = time.monotonic() + self.ttl
+        try:
+            documents = self.collection.find({}, {self.account_field: True, self.tracking_field: True, '_id': False})
+            self._accounts = self.normalize((document.get(self.account_field), document.get(self.tracking_field))
+                                            for document in documents)
+            self.rebuild()
+            logger.info('Loaded %s account routes', len(self._accounts))
+        except Exception as e:
+            self._expires = time.monotonic() + min(self.ttl, RETRY_DELAY)
+            logger.error(exception_message(exc=str(e)))
+
+
+class ConfigReloader(Thread):
+    """Call ``callback`` whenever the config file changes on disk."""
+
+    def __init__(self, path, callback, interval=10.0):
+        super(ConfigReloader, self).__init__()
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self.mtime = self.modified()
+        self.setDaemon(True)
+        self.start()
+
+    def modified(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            mtime = self.modified()
+            if mtime is not None and mtime != self.mtime:
+                self.mtime = mtime
+                self.callback()
@@ -0,0 +1,122 @@
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+DEFAULT_AGGREGATED_KEYS = ('action.click', 'action.goal')
+
+
+class SamplingPolicy(object):
+    """Per account sample rates and aggregation switches.
+
+    ``accounts`` maps account ids, ``default`` being the fallback, to a
+    ``sample_rate`` in percent of visitors kept and an ``aggregate``
+    flag. Visitors are picked by the CRC32 of their client id rather than
+    at random, so a visitor is either kept with all of its hits or
+    dropped in every worker and process, and the sessions reported stay
+    complete, as with the ``sampleRate`` field of analytics.js. Messages
+    without a client id are always kept.
+    """
+    __slots__ = ['_policies', '_default']
+
+    def __init__(self, accounts):
+        policies = {sys.intern(str(account).lower()): (float(policy.get('sample_rate', 100)),
+                                                       bool(policy.get('aggregate', False)))
+                    for account, policy in accounts.items()}
+        self._default = policies.pop('default', (100.0, False))
+        self._policies = policies
+
+    def __len__(self):
+        return len(self._policies)
+
+    def policy(self, account_id):
+        """Return the policy of an account, numeric ids looked up as strings and other values as missing."""
+        if isinstance(account_id, int) and not isinstance(account_id, bool):
+            account_id = str(account_id)
+        elif not isinstance(account_id, str):
+            return self._default
+        if not account_id:
+            return self._default
+        return self._policies.get(account_id.lower(), self._default)
+
+    def aggregating(self):
+        """Return True when any account has aggregation enabled."""
+        return self._default[1] or any(aggregate for rate, aggregate in self._policies.values())
+
+    def sampled(self, account_id, client_id):
+        """Return True when the hits of ``client_id`` are to be reported."""
+        rate = self.policy(account_id)[0]
+        if rate >= 100 or not client_id:
+            return True
+        return zlib.crc32(str(client_id).encode('UTF-8')) % 10000 < rate * 100
+
+    def aggregated(self, account_id):
+        return self.policy(account_id)[1]
+
+
+class Aggregator(object):
+    """Collapse repeated messages of a visitor within ``window`` seconds.
+
+    Only messages of the routing ``keys`` are aggregated. Jobs with the
+    same routing key, account, client id, url and currency are merged
+    into the first one: messages carrying a ``price``, such as goals, add
+    it up, so one set of hits carries the summed event value and revenue,
+    and repeated clicks are reported once. The merged job carries the
+    delivery tokens of all of them and is released once the window of its
+    first message closes, or earlier when more than ``max_entries`` jobs
+    are held.
+    """
+    __slots__ = ['window', 'max_entries', 'keys', '_held']
+
+    def __init__(self, window=5.0, max_entries=10000, keys=DEFAULT_AGGREGATED_KEYS):
+        self.window = window
+        self.max_entries = max_entries
+        self.keys = frozenset(keys)
+        self._held = OrderedDict()
+
+    def __len__(self):
+        return len(self._held)
+
+    @staticmethod
+    def identity(key, decoded):
+        account_id = decoded.get('account_id')
+        return (key, account_id.lower() if isinstance(account_id, str) else account_id, decoded.get('cid'),
+                decoded.get('url'), decoded.get('currency'))
+
+    def add(self, job):
+        """Hold ``job``, returning True when it was merged into a held one."""
+        key, data, tokens, decoded = job[:4]
+        identity = self.identity(key, decoded)
+        held = self._held.get(identity)
+        if held is None:
+            self._held[identity] = [time.monotonic() + self.window, job]
+            return False
+        held_job = held[1]
+        held_decoded = held_job[3]
+        if 'price' in held_decoded:
+            try:
+                held_decoded['price'] = str(Decimal(str(held_decoded.get('price') or 0)) +
+                                            Decimal(str(decoded.get('price') or 0)))
+            except InvalidOperation:
+                pass
+        held[1] = held_job[:2] + (list(held_job[2]) + list(tokens),) + held_job[3:]
+        return True
+
+    def remaining(self):
+        """Seconds before the oldest held job is due, None when nothing is held."""
+        if not self._held:
+            return None
+        deadline, job = next(iter(self._held.values()))
+        return max(deadline - time.monotonic(), 0)
+
+    def expired(self, force=False):
+        """Yield held jobs whose window closed, or all of them when forced."""
+        now = time.monotonic()
+        held = self._held
+        while held:
+            deadline, job = next(iter(held.values()))
+            if not force and deadline > now and len(held) <= self.max_entries:
+                break
+            held.popitem(last=False)
+            yield job
@@ -0,0 +1,191 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+
+from requests import RequestException
+
+from proxy_google_analytics.google_measurement_protocol import Transport
+from proxy_google_analytics.google_measurement_protocol.ga4 import GA4_MAX_EVENTS, hit_events, report_events
+from proxy_google_analytics.google_measurement_protocol.report import _stamp_queue_time
+from proxy_google_analytics.google_measurement_protocol.transport import is_healthy
+from proxy_google_analytics.logger import logger, exception_message
+from proxy_google_analytics.metrics import SINK_DROPPED, SINK_FAILURES, SINK_HITS
+
+
+class Sink(ABC):
+    """Hand the hits reported to Google Analytics to one more destination.
+
+    Workers ``submit`` the encoded hits of every message, already built
+    once for the primary report, without waiting: they are queued and,
+    when ``queue_size`` sends are waiting, dropped and counted. ``workers``
+    threads take them off the queue, collect up to ``batch_size`` hits or
+    whatever arrived within ``linger`` seconds and ``write`` them. A sink
+    failing or falling behind never holds up or fails the primary report
+    and the acknowledgement of messages.
+    """
+    name = 'sink'
+
+    def __init__(self, batch_size=100, linger=1.0, workers=1, queue_size=10000):
+        self.batch_size = batch_size
+        self.linger = linger
+        self._queue = Queue(queue_size)
+        self._exit = Event()
+        self._threads = [Thread(target=self.run, name='{}Sink-{}'.format(self.name, index), daemon=True)
+                         for index in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, lines):
+        try:
+            self._queue.put_nowait(lines)
+        except Full:
+            SINK_DROPPED.labels(self.name, 'full').inc(len(lines))
+
+    def run(self):
+        logger.info('Starting %s sink', self.name)
+        while not (self._exit.is_set() and self._queue.empty()):
+            batch = self.collect()
+            if batch:
+                self.deliver(batch)
+        logger.info('Stopping %s sink', self.name)
+
+    def collect(self):
+        """Wait for hits, returning up to ``batch_size`` of them once full or lingered."""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if self._exit.is_set():
+                timeout = 0
+            elif deadline is None:
+                timeout = self.linger
+            else:
+                timeout = max(deadline - time.monotonic(), 0)
+            try:
+                lines = self._queue.get(timeout=timeout)
+            except Empty:
+                break
+            batch.extend(lines)
+            if deadline is None:
+                deadline = time.monotonic() + self.linger
+        return batch
+
+    def deliver(self, batch):
+        try:
+            self.write(batch)
+            SINK_HITS.labels(self.name).inc(len(batch))
+        except Exception as e:
+            SINK_FAILURES.labels(self.name).inc()
+            logger.error(exception_message(exc=str(e), sink=self.name))
+
+    @abstractmethod
+    def write(self, lines):
+        """Write a batch of encoded hits, raising when they were not written."""
+
+    def close(self, timeout=None):
+        """Write what is queued and stop, waiting at most ``timeout`` seconds."""
+        self._exit.set()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0) if deadline is not None else None)
+
+
+class GA4Sink(Sink):
+    """Report hits as events to the GA4 Measurement Protocol.
+
+    ``streams`` maps Universal Analytics tracking ids, ``default`` being
+    the fallback, to the ``measurement_id`` and ``api_secret`` of a GA4
+    data stream; hits of tracking ids without a stream or client id are
+    dropped and counted. The events of a client are sent in requests of
+    up to 25, each event stamped with its own time, and the requests of
+    a batch are posted ``concurrency`` at a time over a connection pool
+    of the sink's own. Events of failed requests are counted as dropped.
+    """
+    name = 'ga4'
+
+    def __init__(self, streams, transport=None, concurrency=4, **kwargs):
+        self.streams = {tracking_id.upper(): (stream['measurement_id'], stream['api_secret'])
+                        for tracking_id, stream in streams.items()}
+        self.default = self.streams.pop('DEFAULT', None)
+        self.transport = transport if transport is not None else Transport()
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix='ga4Sink-post')
+        super(GA4Sink, self).__init__(**kwargs)
+
+    def write(self, lines):
+        clients = {}
+        unrouted = 0
+        for tracking_id, client_id, timestamp, event in hit_events(lines):
+            stream = self.streams.get((tracking_id or '').upper(), self.default)
+            if stream is None or not client_id:
+                unrouted += 1
+                continue
+            if timestamp is not None:
+                event['timestamp_micros'] = timestamp
+            clients.setdefault((stream, client_id), []).append(event)
+        if unrouted:
+            SINK_DROPPED.labels(self.name, 'unrouted').inc(unrouted)
+        posts = [self._executor.submit(self.post, stream, client_id, events[start:start + GA4_MAX_EVENTS])
+                 for (stream, client_id), events in clients.items()
+                 for start in range(0, len(events), GA4_MAX_EVENTS)]
+        for post in posts:
+            post.result()
+
+    def post(self, stream, client_id, events):
+        try:
+            response = report_events(stream[0], stream[1], client_id, events, transport=self.transport)
+        except RequestException as e:
+            logger.warning('GA4 request failed: %s', e)
+        else:
+            if is_healthy(response.status_code):
+                return
+            logger.warning('GA4 responded %s', response.status_code)
+        SINK_FAILURES.labels(self.name).inc()
+        SINK_DROPPED.labels(self.name, 'undelivered').inc(len(events))
+
+    def close(self, timeout=None):
+        super(GA4Sink, self).close(timeout)
+        self._executor.shutdown(wait=False)
+        self.transport.close()
+
+
+class FileSink(Sink):
+    """Append hits to a local file, one url-encoded hit per line with its queue time."""
+    name = 'file'
+
+    def __init__(self, path, **kwargs):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = Lock()
+        self._file = open(path, 'a', encoding='UTF-8')
+        super(FileSink, self).__init__(**kwargs)
+
+    def write(self, lines):
+        data = ''.join(line + '\n' for line in _stamp_queue_time(lines))
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+
+    def close(self, timeout=None):
+        super(FileSink, self).close(timeout)
+        with self._lock:
+            self._file.close()
+
+
+def build_sinks(config):
+    """Create the sinks enabled in the ``sinks`` config section."""
+    sinks = []
+    ga4 = config.get('ga4', {})
+    if ga4.get('streams'):
+        sinks.append(GA4Sink(ga4['streams'], transport=Transport(**ga4.get('transport', {})),
+                             concurrency=ga4.get('concurrency', 4), batch_size=ga4.get('batch_size', 100),
+                             linger=ga4.get('linger', 1.0), workers=ga4.get('workers', 2),
+                             queue_size=ga4.get('queue_size', 10000)))
+    local = config.get('file', {})
+    if local.get('path'):
+        sinks.append(FileSink(local['path'], batch_size=local.get('batch_size', 1000),
+                              linger=local.get('linger', 1.0), queue_size=local.get('queue_size', 10000)))
+    return sinks
@@ -0,0 +1,188 @@
+import os
+import time
+from threading import Event, Lock, Thread
+
+from requests import RequestException
+
+from proxy_google_analytics.google_measurement_protocol.report import BATCH_MAX_BYTES, BATCH_MAX_HITS, _make_batch_request
+from proxy_google_analytics.google_measurement_protocol.transport import is_healthy
+from proxy_google_analytics.logger import logger, exception_message
+from proxy_google_analytics.metrics import HITS_SPILLED
+
+SEGMENT_SUFFIX = '.log'
+CHECKPOINT = 'checkpoint'
+
+
+class SpillLog(object):
+    """Append-only, segmented on-disk log of encoded hits.
+
+    Hits are appended as url-encoded lines to the newest segment file,
+    segments roll over at ``segment_bytes``. Writes are fsynced at most
+    every ``fsync_interval`` seconds. The read position is persisted in a
+    checkpoint file on ``commit``, which also removes fully read segments,
+    so after a restart reading resumes where it stopped.
+    """
+    __slots__ = ['path', 'segment_bytes', 'fsync_interval', '_lock', '_writer', '_write_segment', '_synced',
+                 '_read_segment', '_read_offset', 'appended']
+
+    def __init__(self, path, segment_bytes=16 * 1024 * 1024, fsync_interval=1.0):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self._lock = Lock()
+        self._writer = None
+        self._synced = time.monotonic()
+        self.appended = Event()
+        os.makedirs(path, exist_ok=True)
+        segments = self.segments()
+        self._write_segment = segments[-1] if segments else 0
+        self._read_segment, self._read_offset = self.load_checkpoint(segments)
+        if self.pending():
+            self.appended.set()
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, '{:020d}{}'.format(segment, SEGMENT_SUFFIX))
+
+    def segments(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.path)
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def load_checkpoint(self, segments):
+        try:
+            with open(os.path.join(self.path, CHECKPOINT)) as f:
+                segment, offset = (int(value) for value in f.read().split())
+        except (OSError, ValueError):
+            segment, offset = (segments[0] if segments else 0), 0
+        if segments and segment < segments[0]:
+            segment, offset = segments[0], 0
+        return segment, offset
+
+    def append(self, lines):
+        data = ''.join(line + '\n' for line in lines).encode('UTF-8')
+        if not data:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = open(self.segment_path(self._write_segment), 'ab')
+            elif self._writer.tell() >= self.segment_bytes:
+                self.sync()
+                self._writer.close()
+                self._write_segment += 1
+                self._writer = open(self.segment_path(self._write_segment), 'ab')
+            self._writer.write(data)
+            self._writer.flush()
+            if time.monotonic() - self._synced >= self.fsync_interval:
+                self.sync()
+        HITS_SPILLED.inc(data.count(b'\n'))
+        self.appended.set()
+
+    def sync(self):
+        if self._writer is not None:
+            os.fsync(self._writer.fileno())
+        self._synced = time.monotonic()
+
+    def pending(self):
+        return self._read_segment < self._write_segment or (
+            os.path.exists(self.segment_path(self._read_segment)) and
+            os.path.getsize(self.segment_path(self._read_segment)) > self._read_offset)
+
+    def read(self, max_lines=BATCH_MAX_HITS, max_bytes=BATCH_MAX_BYTES):
+        """Return the hits after the read position and the position after them.
+
+        At most ``max_lines`` hits are returned and, joined by newlines,
+        they take at most ``max_bytes``, so they fit in one /batch request.
+        A single hit longer than that is still returned on its own.
+        """
+        segment, offset = self._read_segment, self._read_offset
+        lines = []
+        size = 0
+        full = False
+        while not full:
+            try:
+                with open(self.segment_path(segment), 'rb') as f:
+                    f.seek(offset)
+                    for raw in f:
+                        if not raw.endswith(b'\n'):
+                            break
+                        if lines and size + len(raw) > max_bytes:
+                            full = True
+                            break
+                        offset += len(raw)
+                        size += len(raw)
+                        lines.append(raw[:-1].decode('UTF-8'))
+                        if len(lines) >= max_lines:
+                            full = True
+                            break
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                if full or segment >= self._write_segment:
+                    break
+            segment, offset = segment + 1, 0
+        return lines, (segment, offset)
+
+    def commit(self, position):
+        """Persist the read position and remove segments read completely."""
+        self._read_segment, self._read_offset = position
+        checkpoint = os.path.join(self.path, CHECKPOINT)
+        with open(checkpoint + '.tmp', 'w') as f:
+            f.write('{} {}'.format(*position))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(checkpoint + '.tmp', checkpoint)
+        for segment in self.segments():
+            if segment >= self._read_segment:
+                break
+            os.remove(self.segment_path(segment))
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self.sync()
+                self._writer.close()
+                self._writer = None
+
+
+class SpillReplayer(Thread):
+    """Deliver spilled hits through /batch at a limited rate."""
+
+    def __init__(self, spill, transport, rate=100, backoff=5.0):
+        super(SpillReplayer, self).__init__()
+        self.spill = spill
+        self.transport = transport
+        self.interval = BATCH_MAX_HITS / float(rate)
+        self.backoff = backoff
+        self._exit = Event()
+        self.setDaemon(True)
+        self.start()
+
+    def run(self):
+        logger.info('Starting SpillReplayer')
+        while not self._exit.is_set():
+            self.spill.appended.wait(self.backoff)
+            self.spill.appended.clear()
+            while not self._exit.is_set() and self.replay():
+                self._exit.wait(self.interval)
+        logger.info('Stopping SpillReplayer')
+
+    def replay(self):
+        lines, position = self.spill.read()
+        if not lines:
+            return False
+        try:
+            response = _make_batch_request(lines, None, self.transport)
+            if response is not None and not is_healthy(response.status_code):
+                logger.warning('Replaying spilled hits failed, Google Analytics responded %s', response.status_code)
+                self._exit.wait(self.backoff)
+                return True
+        except RequestException as e:
+            logger.warning(exception_message(exc=str(e)))
+            self._exit.wait(self.backoff)
+            return True
+        self.spill.commit(position)
+        logger.debug('Replayed %s spilled hits', len(lines))
+        return True
+
+    def stop(self):
+        self._exit.set()
+        self.spill.appended.set()
@@ -0,0 +1,60 @@
+class FakeIOLoop(object):
+    """Collect callbacks until ``run``, as the connection ioloop would."""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.append(callback)
+
+    def run(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class ImmediateIOLoop(object):
+    """Run callbacks right away in the calling thread."""
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+
+class FakeChannel(object):
+    def __init__(self):
+        self.is_open = True
+        self.acks = []
+        self.nacks = []
+
+    def basic_ack(self, tag, multiple=False):
+        self.acks.append((tag, multiple))
+
+    def basic_nack(self, tag, requeue=True):
+        self.nacks.append((tag, requeue))
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeTransport(object):
+    """Answer posts with the given status codes, then with 200."""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.posted = []
+
+    def post(self, uri, data, extra_headers=None):
+        self.posted.append(data)
+        return FakeResponse(self.statuses.pop(0) if self.statuses else 200)
+
+
+class RecordingSink(object):
+    """Keep the hits submitted to it."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, lines):
+        self.submitted.append(lines)
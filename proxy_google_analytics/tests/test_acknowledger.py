@@ -0,0 +1,105 @@
+import json
+import unittest
+from queue import Queue
+
+from proxy_google_analytics.acknowledger import Acknowledger
+from proxy_google_analytics.flow import Message
+from proxy_google_analytics.tests.fakes import FakeChannel, FakeIOLoop, FakeTransport, ImmediateIOLoop
+from proxy_google_analytics.worker import Worker
+
+
+class AcknowledgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ioloop = FakeIOLoop()
+        self.channel = FakeChannel()
+        self.acker = Acknowledger()
+        self.generation = self.acker.track(self.ioloop, self.channel)
+        self.tokens = [self.acker.received(self.generation, tag) for tag in range(1, 6)]
+
+    def test_acks_highest_contiguous_tag(self):
+        self.acker.resolve([self.tokens[0], self.tokens[1], self.tokens[3]])
+        self.ioloop.run()
+        self.assertEqual(self.channel.acks, [(2, True)])
+        self.assertEqual(len(self.acker), 3)
+
+        self.acker.resolve([self.tokens[2]])
+        self.ioloop.run()
+        self.assertEqual(self.channel.acks, [(2, True), (4, True)])
+        self.assertEqual(len(self.acker), 1)
+
+    def test_failed_tags_are_nacked_and_skipped(self):
+        self.acker.resolve([self.tokens[0]], delivered=False)
+        self.acker.resolve([self.tokens[1], self.tokens[2]])
+        self.ioloop.run()
+        self.assertEqual(self.channel.nacks, [(1, True)])
+        self.assertEqual(self.channel.acks, [(3, True)])
+        self.assertEqual(len(self.acker), 2)
+
+    def test_settles_once_per_scheduled_batch(self):
+        self.acker.resolve([self.tokens[0]])
+        self.acker.resolve([self.tokens[1]])
+        self.assertEqual(len(self.ioloop.callbacks), 1)
+        self.ioloop.run()
+        self.assertEqual(self.channel.acks, [(2, True)])
+
+    def test_closed_channel_is_not_settled(self):
+        self.channel.is_open = False
+        self.acker.resolve(self.tokens)
+        self.ioloop.run()
+        self.assertEqual(self.channel.acks, [])
+        self.assertEqual(self.channel.nacks, [])
+
+    def test_released_generation_is_ignored(self):
+        self.acker.resolve(self.tokens[:2])
+        self.acker.release(self.generation)
+        self.ioloop.run()
+        self.assertFalse(self.acker.tracked(self.tokens[:1]))
+        self.acker.received(self.generation, 6)
+        self.acker.resolve(self.tokens)
+        self.ioloop.run()
+        self.assertEqual(self.channel.acks, [])
+        self.assertEqual(len(self.acker), 0)
+
+    def test_channels_are_tracked_apart(self):
+        channel = FakeChannel()
+        generation = self.acker.track(self.ioloop, channel)
+        token = self.acker.received(generation, 1)
+        self.acker.release(self.generation)
+        self.assertTrue(self.acker.tracked([self.tokens[0], token]))
+        self.acker.resolve([self.tokens[0], token])
+        self.ioloop.run()
+        self.assertEqual(channel.acks, [(1, True)])
+        self.assertEqual(self.channel.acks, [])
+
+    def test_abandon_nacks_outstanding_deliveries(self):
+        self.acker.resolve(self.tokens[1:2])
+        self.assertEqual(self.acker.abandon(), 4)
+        self.assertEqual(self.channel.nacks, [(1, True), (3, True), (4, True), (5, True)])
+        self.assertEqual(self.channel.acks, [(2, False)])
+        self.assertFalse(self.acker.tracked(self.tokens))
+
+
+class WorkerStaleDeliveryTest(unittest.TestCase):
+
+    def test_jobs_of_released_channel_are_dropped(self):
+        acker = Acknowledger()
+        channels = [FakeChannel(), FakeChannel()]
+        generations = [acker.track(ImmediateIOLoop(), channel) for channel in channels]
+        transport = FakeTransport()
+        queue = Queue()
+        body = json.dumps({'account_id': 'a', 'cid': '1', 'url': 'http://example.com/'}).encode()
+        for generation in generations:
+            queue.put(Message('action.click', body, (acker.received(generation, 1),)))
+        acker.release(generations[0])
+        worker = Worker(queue, None, {'analytics': {'default': 'UA-1-1'}}, transport=transport, acker=acker)
+        worker.stop()
+        worker.join(5)
+
+        self.assertEqual(len(transport.posted), 1)
+        self.assertEqual(channels[0].acks, [])
+        self.assertEqual(channels[1].acks, [(1, True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
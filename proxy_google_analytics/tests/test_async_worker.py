@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+from queue import Queue
+
+from proxy_google_analytics.acknowledger import Acknowledger
+from proxy_google_analytics.async_worker import AsyncWorker
+from proxy_google_analytics.tests.fakes import FakeChannel, ImmediateIOLoop, RecordingSink
+
+
+class ForgettingDedup(object):
+    def __init__(self):
+        self.forgotten = []
+
+    def forget(self, identity):
+        self.forgotten.append(identity)
+
+
+async def outcome(delivered):
+    return delivered
+
+
+class SettleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.channel = FakeChannel()
+        self.acker = Acknowledger()
+        generation = self.acker.track(ImmediateIOLoop(), self.channel)
+        self.jobs = [('action.click', (self.acker.received(generation, tag),)) for tag in range(1, 5)]
+        self.dedup = ForgettingDedup()
+        self.sink = RecordingSink()
+        self.worker = AsyncWorker(Queue(), None, {}, acker=self.acker, dedup=self.dedup, sinks=[self.sink])
+        self.addCleanup(self.worker.join, 5)
+        self.addCleanup(self.worker.stop)
+
+    def settle(self, results, owners):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        sends = [loop.create_task(outcome(delivered)) for delivered in results]
+        identities = ['id-{}'.format(index) for index in range(len(self.jobs))]
+        sink_lines = [['hit-{}'.format(index)] for index in range(len(self.jobs))]
+        loop.run_until_complete(self.worker.settle(sends, owners, self.jobs, identities, sink_lines))
+
+    def test_failed_requests_nack_only_the_jobs_they_carry(self):
+        # Batches shared by several jobs: the failed one carries jobs 1 and 2.
+        self.settle([True, False, True], [{0, 1}, {1, 2}, {3}])
+        self.assertEqual(self.channel.acks, [(1, True), (4, True)])
+        self.assertEqual(self.channel.nacks, [(2, True), (3, True)])
+        self.assertEqual(self.dedup.forgotten, ['id-1', 'id-2'])
+        self.assertEqual(self.sink.submitted, [['hit-0'], ['hit-3']])
+
+    def test_delivered_requests_ack_every_job(self):
+        self.settle([True, True], [{0, 1}, {2, 3}])
+        self.assertEqual(self.channel.acks, [(4, True)])
+        self.assertEqual(self.channel.nacks, [])
+        self.assertEqual(self.dedup.forgotten, [])
+        self.assertEqual(len(self.sink.submitted), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import time
+import unittest
+
+from proxy_google_analytics.google_measurement_protocol import BatchReporter
+from proxy_google_analytics.google_measurement_protocol.report import BATCH_MAX_BYTES, BATCH_MAX_HITS
+from proxy_google_analytics.tests.fakes import FakeTransport
+
+
+def hits(count, size=20):
+    return ['v=1&t=event&ea=' + str(index).rjust(size - 15, 'x') for index in range(count)]
+
+
+class BatchReporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = FakeTransport()
+
+    def test_batches_hold_at_most_20_hits(self):
+        batch = BatchReporter(max_hits=50, linger=60, transport=self.transport)
+        self.assertEqual(batch.max_hits, BATCH_MAX_HITS)
+        self.assertEqual(len(batch.report_lines(hits(45))), 2)
+        self.assertEqual([len(body.split('\n')) for body in self.transport.posted], [20, 20])
+        self.assertEqual(len(batch), 5)
+        self.assertEqual(batch.flushed, 2)
+
+    def test_batches_hold_at_most_16_kb(self):
+        batch = BatchReporter(max_bytes=10 ** 6, linger=60, transport=self.transport)
+        self.assertEqual(batch.max_bytes, BATCH_MAX_BYTES)
+        batch.report_lines(hits(19, 1000))
+        batch.flush()
+        self.assertEqual([len(body.split('\n')) for body in self.transport.posted], [16, 3])
+        self.assertTrue(all(len(body) <= BATCH_MAX_BYTES for body in self.transport.posted))
+
+    def test_pending_batch_is_sent_once_lingered(self):
+        batch = BatchReporter(linger=0.05, transport=self.transport)
+        batch.report_lines(hits(3))
+        self.assertIsNone(batch.flush_expired())
+        self.assertEqual(self.transport.posted, [])
+        time.sleep(0.06)
+        self.assertEqual(batch.remaining(), 0)
+        self.assertEqual(batch.flush_expired().status_code, 200)
+        self.assertEqual(len(self.transport.posted[0].split('\n')), 3)
+        self.assertEqual(len(batch), 0)
+
+    def test_failed_batch_is_spilled(self):
+        spilled = []
+        self.transport.statuses = [503]
+        batch = BatchReporter(linger=60, transport=self.transport, spill=spilled.append)
+        batch.report_lines(hits(3))
+        self.assertIsNone(batch.flush())
+        self.assertEqual(spilled, [hits(3)])
+        self.assertEqual(batch.flushed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+from threading import Thread
+
+from proxy_google_analytics.bench import engines, parse_args
+from proxy_google_analytics.bench.capture import synthesize
+from proxy_google_analytics.bench.collector import Collector
+from proxy_google_analytics.bench.runner import MODES, Scenario, replay
+from proxy_google_analytics.utils import json_loads
+
+
+class ReplayTest(unittest.TestCase):
+    """Replay a few messages through every scenario, so a worker change breaking the bench fails here."""
+
+    def replay(self, scenario, messages, options, collector):
+        results = []
+        thread = Thread(target=lambda: results.append(replay(scenario, messages, options, collector, json_loads)))
+        thread.daemon = True
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), 'replay of {} hung'.format(scenario))
+        return results[0]
+
+    def test_replay(self):
+        messages = synthesize(20)
+        options = parse_args(['-n', '20', '--linger', '0.01'])
+        with Collector(in_process=True) as collector:
+            for engine in engines():
+                for mode in MODES:
+                    for templates in (False, True):
+                        scenario = Scenario(engine, mode, templates)
+                        result = self.replay(scenario, messages, options, collector)
+                        self.assertEqual((result.messages, result.failed), (20, 0), scenario)
+
+
+if __name__ == '__main__':
+    unittest.main()
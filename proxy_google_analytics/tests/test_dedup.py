@@ -0,0 +1,90 @@
+import json
+import time
+import unittest
+from queue import Queue
+from unittest import mock
+
+from proxy_google_analytics.acknowledger import Acknowledger
+from proxy_google_analytics.dedup import DedupWindow
+from proxy_google_analytics.flow import Message
+from proxy_google_analytics.tests.fakes import FakeChannel, FakeTransport, ImmediateIOLoop
+from proxy_google_analytics.worker import Worker
+
+
+class DedupWindowTest(unittest.TestCase):
+
+    def test_second_sighting_is_a_duplicate(self):
+        dedup = DedupWindow()
+        identity = dedup.identity('action.click', {}, b'{}')
+        self.assertFalse(dedup.seen(identity))
+        self.assertTrue(dedup.seen(identity))
+        self.assertEqual((dedup.hits, dedup.misses), (1, 1))
+
+    def test_identity_by_fields(self):
+        dedup = DedupWindow(fields=['cid'])
+        self.assertEqual(dedup.identity('action.click', {'cid': '1', 'url': 'a'}, b'a'),
+                         dedup.identity('action.click', {'cid': '1', 'url': 'b'}, b'b'))
+        self.assertNotEqual(dedup.identity('action.click', {'cid': '1'}, b''),
+                            dedup.identity('action.goal', {'cid': '1'}, b''))
+
+    def test_forgotten_identity_is_not_a_duplicate(self):
+        dedup = DedupWindow()
+        identity = dedup.identity('action.click', {}, b'{}')
+        dedup.seen(identity)
+        dedup.forget(identity)
+        self.assertFalse(dedup.seen(identity))
+
+    def test_entries_expire(self):
+        dedup = DedupWindow(window=10.0)
+        with mock.patch('proxy_google_analytics.dedup.time.monotonic', return_value=100.0):
+            dedup.seen(1)
+        with mock.patch('proxy_google_analytics.dedup.time.monotonic', return_value=111.0):
+            self.assertFalse(dedup.seen(1))
+
+    def test_oldest_entries_are_evicted(self):
+        dedup = DedupWindow(max_entries=2)
+        for identity in (1, 2, 3):
+            dedup.seen(identity)
+        self.assertEqual(len(dedup), 2)
+        self.assertFalse(dedup.seen(1))
+
+
+class WorkerRedeliveryTest(unittest.TestCase):
+    body = json.dumps({'account_id': 'a', 'cid': '1', 'url': 'http://example.com/'}).encode()
+
+    def setUp(self):
+        self.channel = FakeChannel()
+        self.acker = Acknowledger()
+        self.generation = self.acker.track(ImmediateIOLoop(), self.channel)
+        self.transport = FakeTransport([500])
+        self.queue = Queue()
+
+    def deliver(self, tag):
+        self.queue.put(Message('action.click', self.body, (self.acker.received(self.generation, tag),)))
+
+    def run_worker(self, report):
+        worker = Worker(self.queue, None, {'analytics': {'default': 'UA-1-1'}, 'report': report},
+                        transport=self.transport, acker=self.acker, dedup=DedupWindow())
+        self.deliver(1)
+        deadline = time.monotonic() + 5
+        while not self.channel.nacks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.deliver(2)
+        worker.stop()
+        worker.join(5)
+
+    def test_nacked_message_is_delivered_on_redelivery(self):
+        self.run_worker({})
+        self.assertEqual(len(self.transport.posted), 2)
+        self.assertEqual(self.channel.nacks, [(1, True)])
+        self.assertEqual(self.channel.acks, [(2, True)])
+
+    def test_message_of_failed_batch_is_delivered_on_redelivery(self):
+        self.run_worker({'mode': 'batch', 'batch_linger': 0})
+        self.assertEqual(len(self.transport.posted), 2)
+        self.assertEqual(self.channel.nacks, [(1, True)])
+        self.assertEqual(self.channel.acks, [(2, True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from proxy_google_analytics.dispatch import Dispatcher, load_builder
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def test_exact_key_wins_over_earlier_pattern(self):
+        dispatcher = Dispatcher([('action.*', 'pattern'), ('action.click', 'exact')])
+        self.assertEqual(dispatcher.resolve('action.click'), 'exact')
+        self.assertEqual(dispatcher.resolve('action.goal'), 'pattern')
+
+    def test_first_declared_pattern_wins(self):
+        dispatcher = Dispatcher([('#.goal', 'first'), ('action.*', 'second'), ('action.#', 'third')])
+        self.assertEqual(dispatcher.resolve('action.goal'), 'first')
+        self.assertEqual(dispatcher.resolve('action.click'), 'second')
+        self.assertEqual(dispatcher.resolve('action.click.offer'), 'third')
+
+        dispatcher = Dispatcher([('action.#', 'first'), ('#.goal', 'second')])
+        self.assertEqual(dispatcher.resolve('action.goal'), 'first')
+
+    def test_star_matches_exactly_one_word(self):
+        dispatcher = Dispatcher([('action.*', 'builder')])
+        self.assertEqual(dispatcher.resolve('action.click'), 'builder')
+        self.assertIsNone(dispatcher.resolve('action'))
+        self.assertIsNone(dispatcher.resolve('action.click.offer'))
+
+    def test_hash_matches_zero_or_more_words(self):
+        dispatcher = Dispatcher([('action.#', 'builder'), ('#.goal.#', 'goal')])
+        self.assertEqual(dispatcher.resolve('action'), 'builder')
+        self.assertEqual(dispatcher.resolve('action.click.offer'), 'builder')
+        self.assertEqual(dispatcher.resolve('goal'), 'goal')
+        self.assertEqual(dispatcher.resolve('offer.goal.done'), 'goal')
+        self.assertIsNone(dispatcher.resolve('offer.click'))
+
+    def test_misses_are_cached(self):
+        dispatcher = Dispatcher([('action.*', 'builder')], max_cached=2)
+        self.assertIsNone(dispatcher.resolve('offer.click'))
+        self.assertIn('offer.click', dispatcher._table)
+        dispatcher.resolve('action.click')
+        dispatcher.resolve('action.goal')
+        self.assertNotIn('action.goal', dispatcher._table)
+        self.assertEqual(dispatcher.resolve('action.goal'), 'builder')
+
+    def test_builders_by_name_and_path(self):
+        self.assertEqual(load_builder('pageview', {'pageview': 'builtin'}), 'builtin')
+        self.assertIs(load_builder('proxy_google_analytics.dispatch:Dispatcher.resolve'), Dispatcher.resolve)
+        with self.assertRaises(ValueError):
+            load_builder('missing', {})
+
+
+if __name__ == '__main__':
+    unittest.main()
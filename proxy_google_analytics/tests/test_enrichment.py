@@ -0,0 +1,56 @@
+import unittest
+
+from proxy_google_analytics.enrichment import Enricher, split_params
+
+
+class FakeCollection(object):
+    def __init__(self, documents, error=None):
+        self.documents = documents
+        self.error = error
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        if self.error is not None:
+            raise self.error
+        keys = query['_id']['$in']
+        return [document for document in self.documents if document['_id'] in keys]
+
+
+class EnricherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = FakeCollection([{'_id': 'a', 'source': 'mail'}, {'_id': 'b', 'source': ''}])
+        self.enricher = Enricher(self.collection, 'click_id', fields={'cs': 'source'})
+
+    def test_prefetches_batch_with_one_query(self):
+        messages = [{'click_id': key} for key in ('a', 'b', 'c', 'a')]
+        self.enricher.prefetch(messages)
+        self.assertEqual(len(self.collection.queries), 1)
+        self.assertEqual([self.enricher.params(message) for message in messages],
+                         [{'cs': 'mail'}, {}, {}, {'cs': 'mail'}])
+        self.enricher.prefetch(messages)
+        self.assertEqual(len(self.collection.queries), 1)
+
+    def test_params_do_not_query(self):
+        self.assertEqual(self.enricher.params({'click_id': 'a'}), {})
+        self.assertEqual(self.collection.queries, [])
+
+    def test_failed_query_pauses_lookups(self):
+        self.collection.error = RuntimeError('no primary')
+        self.enricher.prefetch([{'click_id': 'a'}])
+        self.enricher.prefetch([{'click_id': 'b'}])
+        self.assertEqual(len(self.collection.queries), 1)
+        self.assertEqual(self.enricher.params({'click_id': 'a'}), {})
+
+        self.collection.error = None
+        self.enricher._unavailable = 0
+        self.enricher.prefetch([{'click_id': 'a'}])
+        self.assertEqual(self.enricher.params({'click_id': 'a'}), {'cs': 'mail'})
+
+    def test_split_params(self):
+        self.assertEqual(split_params({'in': 'offer', 'cs': 'mail'}), ({'in': 'offer'}, {'cs': 'mail'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from proxy_google_analytics.flow import FlowControlQueue, Message
+from proxy_google_analytics.worker import STOP
+
+
+class FlowControlQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.queue = FlowControlQueue(max_messages=4, max_bytes=100, low_watermark=0.5,
+                                      on_high=lambda: self.events.append('high'),
+                                      on_low=lambda: self.events.append('low'))
+
+    def put(self, count, size=1):
+        for index in range(count):
+            self.queue.put(Message('action.click', b'x' * size))
+
+    def get(self, count):
+        for index in range(count):
+            self.queue.get_nowait()
+
+    def test_pauses_at_high_and_resumes_at_low_message_watermark(self):
+        self.put(3)
+        self.assertEqual(self.events, [])
+        self.put(1)
+        self.assertEqual((self.events, self.queue.paused), (['high'], True))
+        self.put(2)
+        self.get(3)
+        self.assertEqual(self.events, ['high'])
+        self.get(1)
+        self.assertEqual((self.events, self.queue.paused), (['high', 'low'], False))
+
+    def test_pauses_at_high_byte_watermark(self):
+        self.put(2, 50)
+        self.assertEqual(self.events, ['high'])
+        self.get(1)
+        self.assertEqual(self.events, ['high', 'low'])
+        self.assertEqual((self.queue.messages, self.queue.bytes), (1, 50))
+
+    def test_sentinels_are_not_counted(self):
+        self.put(2)
+        self.queue.put(STOP)
+        self.assertEqual(self.queue.messages, 2)
+        self.get(3)
+        self.assertEqual((self.queue.messages, self.queue.bytes, self.queue.memory), (0, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
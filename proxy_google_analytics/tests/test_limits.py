@@ -0,0 +1,46 @@
+import unittest
+
+from proxy_google_analytics.google_measurement_protocol.limits import (DIMENSION_LIMIT, field_limit,
+                                                                       normalize_payload, truncate)
+
+
+class TruncateTest(unittest.TestCase):
+
+    def test_short_values_are_kept(self):
+        self.assertEqual(truncate('abc', 3), 'abc')
+        self.assertEqual(truncate('ёж', 4), 'ёж')
+
+    def test_ascii_is_cut_at_limit(self):
+        self.assertEqual(truncate('abcdef', 4), 'abcd')
+
+    def test_multibyte_character_is_not_split(self):
+        # 'ё' takes two bytes, '€' three and '😀' four.
+        self.assertEqual(truncate('aёb', 2), 'a')
+        self.assertEqual(truncate('aёb', 3), 'aё')
+        self.assertEqual(truncate('€€', 5), '€')
+        self.assertEqual(truncate('😀x', 3), '')
+        self.assertEqual(truncate('😀x', 4), '😀')
+
+    def test_result_fits_limit(self):
+        value = 'зонтик€😀' * 100
+        for limit in range(0, 60):
+            self.assertLessEqual(len(truncate(value, limit).encode('UTF-8')), limit)
+
+
+class NormalizePayloadTest(unittest.TestCase):
+
+    def test_limits(self):
+        self.assertEqual(field_limit('dl'), 2048)
+        self.assertEqual(field_limit('cd12'), DIMENSION_LIMIT)
+        self.assertIsNone(field_limit('cid'))
+
+    def test_empty_values_are_dropped(self):
+        self.assertEqual(normalize_payload({'v': '1', 'dr': '', 'dt': None, 'ev': 0}), {'v': '1', 'ev': 0})
+
+    def test_values_are_truncated(self):
+        payload = normalize_payload({'ul': 'ё' * 20, 'cd3': 'x' * 200, 'cid': 'x' * 200})
+        self.assertEqual(payload, {'ul': 'ё' * 10, 'cd3': 'x' * DIMENSION_LIMIT, 'cid': 'x' * 200})
+
+
+if __name__ == '__main__':
+    unittest.main()
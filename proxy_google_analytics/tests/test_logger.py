@@ -0,0 +1,93 @@
+import logging
+import unittest
+from queue import Queue
+
+from proxy_google_analytics.logger import RepeatFilter, exception_message, logger
+from proxy_google_analytics.tests.fakes import FakeTransport
+from proxy_google_analytics.worker import Worker
+
+
+def record(msg, level=logging.ERROR, lineno=10, args=()):
+    return logging.LogRecord('test', level, __file__, lineno, msg, args, None)
+
+
+def failure(message):
+    try:
+        raise ValueError(message)
+    except ValueError:
+        return exception_message(key='value')
+
+
+def other_failure(message):
+    try:
+        raise KeyError(message)
+    except KeyError:
+        return exception_message(key='value')
+
+
+class RepeatFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repeats = RepeatFilter(burst=2)
+
+    def passed(self, *records):
+        return [self.repeats.filter(item) for item in records]
+
+    def test_repeats_past_burst_are_counted(self):
+        self.assertEqual(self.passed(*[record('failed %s', args=(index,)) for index in range(5)]),
+                         [True, True, False, False, False])
+        (last, count), = self.repeats.drain()
+        self.assertEqual((last.getMessage(), count), ('failed 4', 3))
+        self.assertEqual(self.passed(record('failed %s', args=(5,))), [True])
+
+    def test_records_below_warning_always_pass(self):
+        self.assertTrue(all(self.passed(*[record('started', logging.INFO) for index in range(5)])))
+        self.assertEqual(self.repeats.drain(), [])
+
+    def test_templates_of_a_call_site_are_told_apart(self):
+        self.assertEqual(self.passed(record('one'), record('one'), record('two'), record('one')),
+                         [True, True, True, False])
+
+    def test_exceptions_are_told_apart_by_origin(self):
+        self.assertEqual(self.passed(*[record(failure(str(index))) for index in range(3)]), [True, True, False])
+        self.assertEqual(self.passed(record(other_failure('0'))), [True])
+
+    def test_disabled_without_burst(self):
+        self.repeats.burst = 0
+        self.assertTrue(all(self.passed(*[record('failed') for index in range(5)])))
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        if record.levelno >= logging.WARNING:
+            self.records.append(record)
+
+
+class UnknownRoutingKeyTest(unittest.TestCase):
+
+    def test_repeated_unknown_keys_are_suppressed(self):
+        handler = ListHandler()
+        repeats = RepeatFilter(burst=2)
+        handler.addFilter(repeats)
+        # Ahead of the queue handler, which merges the arguments into the message.
+        logger.handlers.insert(0, handler)
+        self.addCleanup(logger.removeHandler, handler)
+        worker = Worker(Queue(), None, {}, transport=FakeTransport())
+        for key in ('offer.view', 'offer.view', 'offer.view', 'offer.hide', 'offer.view'):
+            self.assertTrue(worker.message_processing(key, b'{}'))
+        worker.stop()
+        worker.join(5)
+
+        self.assertEqual(len(handler.records), 2)
+        self.assertIn('offer.view', handler.records[0].getMessage())
+        (last, count), = repeats.drain()
+        self.assertEqual(count, 3)
+        self.assertIn('offer.view', last.getMessage())
+
+
+if __name__ == '__main__':
+    unittest.main()
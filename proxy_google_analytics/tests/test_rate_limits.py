@@ -0,0 +1,64 @@
+import time
+import unittest
+
+from proxy_google_analytics.limits import AdaptiveConcurrency, RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter(rate=10, burst=20, overrides={'UA-2-1': 100})
+
+    def test_burst_is_admitted_then_debt_is_waited_for(self):
+        self.assertEqual(self.limiter.wait('UA-1-1'), 0)
+        self.limiter.charge('UA-1-1', 25)
+        # Five hits of debt and one more token take 0.6 seconds at 10 hits per second.
+        self.assertAlmostEqual(self.limiter.wait('UA-1-1'), 0.6, places=1)
+
+    def test_buckets_refill_at_their_rate(self):
+        self.limiter.charge('UA-1-1', 20)
+        time.sleep(0.15)
+        self.assertEqual(self.limiter.wait('UA-1-1'), 0)
+        self.assertLess(self.limiter.bucket('UA-1-1').tokens, 20)
+
+    def test_tracking_ids_have_their_own_buckets(self):
+        self.limiter.charge('UA-1-1', 25)
+        self.assertEqual(self.limiter.wait('UA-1-2'), 0)
+        self.assertEqual(self.limiter.bucket('UA-2-1').burst, 100)
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gate = AdaptiveConcurrency(minimum=2, maximum=10, backoff=0.5, cooldown=60)
+
+    def test_failures_halve_the_limit_once_per_cooldown(self):
+        self.gate.feedback(False)
+        self.gate.feedback(False)
+        self.assertEqual(self.gate.limit, 5)
+        self.gate._decreased -= 60
+        self.gate.feedback(False)
+        self.assertEqual(self.gate.limit, 2.5)
+        self.gate._decreased -= 60
+        self.gate.feedback(False)
+        self.assertEqual(self.gate.limit, 2)
+
+    def test_healthy_responses_raise_the_limit_up_to_maximum(self):
+        self.gate.feedback(False)
+        # About one more slot per round of as many healthy requests as the limit.
+        for index in range(6):
+            self.gate.feedback(True)
+        self.assertEqual(int(self.gate.limit), 6)
+        for index in range(100):
+            self.gate.feedback(True)
+        self.assertEqual(self.gate.limit, 10)
+
+    def test_slots_are_bounded_by_the_limit(self):
+        self.gate.feedback(False)
+        self.assertEqual([self.gate.try_acquire() for index in range(6)], [True] * 5 + [False])
+        self.gate.release()
+        self.assertTrue(self.gate.try_acquire())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+import unittest
+
+from proxy_google_analytics.google_measurement_protocol.report import (
+    EVENT_TIME, MAX_QUEUE_TIME, _stamp_queue_time, _within_hit_limit)
+from proxy_google_analytics.metrics import HITS_EXPIRED, HITS_OVERSIZED
+
+
+class ReportHooksTest(unittest.TestCase):
+
+    def test_package_does_not_import_the_daemon(self):
+        code = ('import sys, proxy_google_analytics.google_measurement_protocol; '
+                'sys.exit("proxy_google_analytics.metrics" in sys.modules)')
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
+    def test_dropped_hits_are_counted(self):
+        before = HITS_EXPIRED.labels().value, HITS_OVERSIZED.labels().value
+        _stamp_queue_time(['v=1' + EVENT_TIME + '0'], now=(MAX_QUEUE_TIME + 1) / 1000)
+        list(_within_hit_limit(['v=1&dl=' + 'a' * 9000]))
+        self.assertEqual((HITS_EXPIRED.labels().value - before[0], HITS_OVERSIZED.labels().value - before[1]),
+                         (1, 1))
+
+
+class StampQueueTimeTest(unittest.TestCase):
+
+    def test_event_time_becomes_queue_time(self):
+        self.assertEqual(_stamp_queue_time(['v=1&t=pageview' + EVENT_TIME + '1000000'], now=1001.5),
+                         ['v=1&t=pageview&qt=1500'])
+
+    def test_hits_past_four_hours_are_dropped(self):
+        lines = ['v=1&cid=' + str(index) + EVENT_TIME + str(event_time)
+                 for index, event_time in enumerate([0, 1, 2])]
+        now = (MAX_QUEUE_TIME + 1) / 1000
+        self.assertEqual(_stamp_queue_time(lines, now=now), ['v=1&cid=1&qt=' + str(MAX_QUEUE_TIME),
+                                                             'v=1&cid=2&qt=' + str(MAX_QUEUE_TIME - 1)])
+
+    def test_hits_without_event_time_and_from_the_future_are_kept(self):
+        self.assertEqual(_stamp_queue_time(['v=1', 'v=1' + EVENT_TIME + '2000'], now=1),
+                         ['v=1', 'v=1&qt=0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import json
+import time
+import unittest
+from queue import Queue
+
+from proxy_google_analytics.acknowledger import Acknowledger
+from proxy_google_analytics.flow import Message
+from proxy_google_analytics.routing import AccountRouter
+from proxy_google_analytics.tests.fakes import FakeChannel, FakeTransport, ImmediateIOLoop
+from proxy_google_analytics.worker import Worker
+
+
+class AccountRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = AccountRouter({'default': 'UA-1-1', 'ABC': 'UA-1-2', 123: 'UA-1-3'})
+
+    def test_accounts_are_case_insensitive(self):
+        self.assertEqual(self.router.resolve('abc'), 'UA-1-2')
+        self.assertEqual(self.router.resolve('AbC'), 'UA-1-2')
+
+    def test_unknown_and_missing_accounts_fall_back_to_default(self):
+        self.assertEqual(self.router.resolve('other'), 'UA-1-1')
+        self.assertEqual(self.router.resolve(''), 'UA-1-1')
+        self.assertEqual(self.router.resolve(None), 'UA-1-1')
+
+    def test_numeric_accounts_are_looked_up_as_strings(self):
+        self.assertEqual(self.router.resolve(123), 'UA-1-3')
+        self.assertEqual(self.router.resolve('123'), 'UA-1-3')
+
+    def test_other_accounts_count_as_missing(self):
+        for account_id in (True, 1.5, ['abc'], {'id': 'abc'}):
+            self.assertEqual(self.router.resolve(account_id), 'UA-1-1')
+
+
+class FakeCollection(object):
+    def __init__(self, documents, error=None):
+        self.documents = documents
+        self.error = error
+        self.queries = 0
+
+    def find(self, query, projection=None):
+        self.queries += 1
+        if self.error is not None:
+            raise self.error
+        return list(self.documents)
+
+
+class MongoAccountRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = FakeCollection([{'account_id': 'Mongo', 'tracking_id': 'UA-2-1'},
+                                          {'account_id': 'abc', 'tracking_id': 'UA-2-2'}])
+
+    def test_accounts_are_loaded_before_the_first_message(self):
+        router = AccountRouter({'default': 'UA-1-1', 'abc': 'UA-1-2'}, self.collection)
+        self.assertEqual(router.resolve('mongo'), 'UA-2-1')
+        self.assertEqual(router.resolve('abc'), 'UA-1-2')
+        self.assertEqual(self.collection.queries, 1)
+
+    def test_failed_load_is_retried_soon(self):
+        self.collection.error = RuntimeError('no primary')
+        router = AccountRouter({'default': 'UA-1-1'}, self.collection, ttl=300)
+        self.assertEqual(router.resolve('mongo'), 'UA-1-1')
+        self.assertLessEqual(router._expires - time.monotonic(), 10)
+
+    def test_configure_switches_collection_and_fields(self):
+        router = AccountRouter({'default': 'UA-1-1'}, self.collection)
+        collection = FakeCollection([{'account': 'other', 'property': 'UA-3-1'}])
+        router.configure(collection, account_field='account', tracking_field='property')
+        router.resolve('other')
+        deadline = time.monotonic() + 5
+        while router.resolve('other') != 'UA-3-1' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(router.resolve('other'), 'UA-3-1')
+        self.assertEqual(router.resolve('mongo'), 'UA-1-1')
+
+        router.configure(None)
+        self.assertEqual(router.resolve('other'), 'UA-1-1')
+
+
+class FailingRouter(AccountRouter):
+    __slots__ = []
+
+    def resolve(self, account_id):
+        if account_id == 'broken':
+            raise ValueError('broken account')
+        return super(FailingRouter, self).resolve(account_id)
+
+
+class IdleLimiter(object):
+    def wait(self, tracking_id):
+        return 0
+
+    def charge(self, tracking_id, hits):
+        pass
+
+
+class WorkerPrepareTest(unittest.TestCase):
+
+    def test_failing_message_is_settled_and_worker_keeps_running(self):
+        channel = FakeChannel()
+        acker = Acknowledger()
+        generation = acker.track(ImmediateIOLoop(), channel)
+        transport = FakeTransport()
+        queue = Queue()
+        worker = Worker(queue, None, {}, transport=transport, acker=acker,
+                        router=FailingRouter({'default': 'UA-1-1'}), limiter=IdleLimiter())
+        for tag, account_id in enumerate(['broken', 'a'], 1):
+            body = json.dumps({'account_id': account_id, 'cid': '1', 'url': 'http://example.com/'}).encode()
+            queue.put(Message('action.click', body, (acker.received(generation, tag),)))
+        worker.stop()
+        worker.join(5)
+
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(len(transport.posted), 1)
+        self.assertEqual(channel.acks[-1], (2, True))
+        self.assertEqual(channel.nacks, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
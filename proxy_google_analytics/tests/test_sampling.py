@@ -0,0 +1,58 @@
+import unittest
+
+from proxy_google_analytics.sampling import Aggregator, SamplingPolicy
+
+
+class SamplingPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = SamplingPolicy({'default': {'sample_rate': 50}, 'ABC': {'aggregate': True},
+                                      123: {'sample_rate': 10}})
+
+    def test_accounts_are_case_insensitive(self):
+        self.assertEqual(self.policy.policy('abc'), (100.0, True))
+        self.assertEqual(self.policy.policy('other'), (50.0, False))
+
+    def test_numeric_accounts_are_looked_up_as_strings(self):
+        self.assertEqual(self.policy.policy(123), (10.0, False))
+
+    def test_other_accounts_count_as_missing(self):
+        for account_id in (None, '', True, 1.5, ['abc'], {'id': 'abc'}):
+            self.assertEqual(self.policy.policy(account_id), (50.0, False))
+            self.assertFalse(self.policy.aggregated(account_id))
+
+    def test_visitors_are_sampled_consistently(self):
+        kept = [client_id for client_id in range(1000) if self.policy.sampled('other', client_id)]
+        self.assertEqual(kept, [client_id for client_id in range(1000) if self.policy.sampled(None, client_id)])
+        self.assertTrue(300 < len(kept) < 700)
+        self.assertTrue(self.policy.sampled('other', None))
+        self.assertTrue(all(self.policy.sampled('abc', client_id) for client_id in range(100)))
+
+
+class AggregatorTest(unittest.TestCase):
+
+    def job(self, key, tokens, **decoded):
+        return key, b'', tokens, dict({'account_id': 'abc', 'cid': '1', 'url': 'u'}, **decoded)
+
+    def test_prices_add_up(self):
+        aggregator = Aggregator()
+        self.assertFalse(aggregator.add(self.job('action.goal', [1], price='1.5')))
+        self.assertTrue(aggregator.add(self.job('action.goal', [2], price='2')))
+        job, = aggregator.expired(force=True)
+        self.assertEqual(job[2], [1, 2])
+        self.assertEqual(job[3]['price'], '3.5')
+
+    def test_messages_without_price_are_merged_as_is(self):
+        aggregator = Aggregator()
+        aggregator.add(self.job('action.click', [1]))
+        aggregator.add(self.job('action.click', [2]))
+        job, = aggregator.expired(force=True)
+        self.assertNotIn('price', job[3])
+
+    def test_keys_are_configurable(self):
+        self.assertEqual(Aggregator().keys, frozenset(['action.click', 'action.goal']))
+        self.assertEqual(Aggregator(keys=['offer.view']).keys, frozenset(['offer.view']))
+
+
+if __name__ == '__main__':
+    unittest.main()
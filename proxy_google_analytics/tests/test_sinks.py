@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from urllib.parse import parse_qsl, urlsplit
+
+from proxy_google_analytics.google_measurement_protocol.report import EVENT_TIME
+from proxy_google_analytics.metrics import SINK_DROPPED, SINK_FAILURES
+from proxy_google_analytics.sinks import FileSink, GA4Sink
+from proxy_google_analytics.tests.fakes import FakeResponse, FakeTransport
+
+
+def pageview(tracking_id, client_id, event_time):
+    return 'v=1&t=pageview&tid={}&cid={}&dl=http%3A%2F%2Fexample.com%2F{}{}'.format(
+        tracking_id, client_id, EVENT_TIME, event_time)
+
+
+class RecordingTransport(FakeTransport):
+    """Record the measurement id and decoded body of every request."""
+
+    def post(self, uri, data, extra_headers=None):
+        self.posted.append((dict(parse_qsl(urlsplit(uri).query))['measurement_id'], json.loads(data)))
+        return FakeResponse(self.statuses.pop(0) if self.statuses else 200)
+
+    def close(self):
+        pass
+
+
+class GA4SinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = RecordingTransport()
+        self.sink = GA4Sink({'UA-1-1': {'measurement_id': 'G-1', 'api_secret': 's'}}, self.transport,
+                            batch_size=1000, linger=0.01)
+        self.addCleanup(self.sink.close)
+
+    def test_events_of_a_client_share_requests(self):
+        lines = [pageview('UA-1-1', 'a', 1000 + index) for index in range(30)]
+        lines.append(pageview('UA-1-1', 'b', 2000))
+        self.sink.write(lines)
+
+        bodies = sorted((body['client_id'], len(body['events'])) for stream, body in self.transport.posted)
+        self.assertEqual(bodies, [('a', 5), ('a', 25), ('b', 1)])
+        events = [event for stream, body in self.transport.posted for event in body['events']
+                  if body['client_id'] == 'a']
+        self.assertEqual(sorted(event['timestamp_micros'] for event in events),
+                         [(1000 + index) * 1000 for index in range(30)])
+        self.assertTrue(all('timestamp_micros' not in body for stream, body in self.transport.posted))
+
+    def test_unrouted_events_are_counted(self):
+        sink = GA4Sink({}, self.transport, linger=0.01)
+        self.addCleanup(sink.close)
+        dropped = SINK_DROPPED.labels('ga4', 'unrouted')
+        before = dropped.value
+        sink.write([pageview('UA-1-1', 'a', 1000), pageview('UA-1-1', 'b', 1000)])
+        self.assertEqual(self.transport.posted, [])
+        self.assertEqual(dropped.value - before, 2)
+
+    def test_failed_requests_are_counted(self):
+        self.transport.statuses = [503]
+        dropped = SINK_DROPPED.labels('ga4', 'undelivered')
+        failures = SINK_FAILURES.labels('ga4')
+        before = dropped.value, failures.value
+        self.sink.write([pageview('UA-1-1', 'a', 1000 + index) for index in range(3)])
+        self.assertEqual((dropped.value - before[0], failures.value - before[1]), (3, 1))
+
+
+class FileSinkTest(unittest.TestCase):
+
+    def test_hits_are_appended_with_queue_time(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        sink = FileSink(os.path.join(path, 'hits', 'hits.log'), linger=0.01)
+        sink.submit([pageview('UA-1-1', 'a', int(time.time() * 1000))])
+        sink.close(5)
+        with open(os.path.join(path, 'hits', 'hits.log')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertNotIn(EVENT_TIME, lines[0])
+        self.assertIn('&qt=', lines[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
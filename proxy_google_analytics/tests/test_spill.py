@@ -0,0 +1,77 @@
+import shutil
+import tempfile
+import unittest
+
+from proxy_google_analytics.spill import SpillLog
+
+
+def hits(count, start=0, size=10):
+    return ['v=1&t=pageview&cid={}&dp={}'.format(index, 'x' * size) for index in range(start, start + count)]
+
+
+class SpillLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_read_is_bounded_by_lines(self):
+        spill = SpillLog(self.path)
+        spill.append(hits(30))
+        lines, position = spill.read(max_lines=20)
+        self.assertEqual(lines, hits(20))
+        spill.commit(position)
+        lines, position = spill.read(max_lines=20)
+        self.assertEqual(lines, hits(10, start=20))
+        spill.close()
+
+    def test_read_is_bounded_by_bytes(self):
+        spill = SpillLog(self.path)
+        spill.append(hits(20, size=2000))
+        lines, position = spill.read(max_bytes=16 * 1024)
+        self.assertEqual(len(lines), 8)
+        self.assertLessEqual(len('\n'.join(lines)), 16 * 1024)
+        spill.close()
+
+    def test_oversized_hit_is_read_alone(self):
+        spill = SpillLog(self.path)
+        spill.append(hits(2, size=100))
+        lines, position = spill.read(max_bytes=50)
+        self.assertEqual(lines, hits(1, size=100))
+        spill.close()
+
+    def test_resumes_from_checkpoint(self):
+        spill = SpillLog(self.path)
+        spill.append(hits(5))
+        lines, position = spill.read(max_lines=3)
+        spill.commit(position)
+        spill.close()
+
+        spill = SpillLog(self.path)
+        self.assertTrue(spill.pending())
+        lines, position = spill.read()
+        self.assertEqual(lines, hits(2, start=3))
+        spill.commit(position)
+        self.assertFalse(spill.pending())
+        spill.close()
+
+    def test_commit_removes_read_segments(self):
+        spill = SpillLog(self.path, segment_bytes=100)
+        for start in range(0, 12, 3):
+            spill.append(hits(3, start=start))
+        self.assertEqual(len(spill.segments()), 4)
+
+        lines, position = spill.read(max_lines=7)
+        spill.commit(position)
+        self.assertEqual(spill.segments(), [2, 3])
+
+        lines, position = spill.read()
+        self.assertEqual(lines, hits(5, start=7))
+        spill.commit(position)
+        self.assertEqual(spill.segments(), [3])
+        self.assertFalse(spill.pending())
+        spill.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
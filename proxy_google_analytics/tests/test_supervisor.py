@@ -0,0 +1,38 @@
+import unittest
+
+from proxy_google_analytics.main import Supervisor
+
+
+class SupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {'engine': {'processes': 3},
+                       'spill': {'path': '/var/spool/pga', 'max_bytes': 1024},
+                       'sinks': {'file': {'path': '/var/log/pga/hits.log'}},
+                       'metrics': {'port': 9100}}
+        self.supervisor = Supervisor(self.config)
+
+    def test_children_get_their_own_spill_sink_and_metrics(self):
+        configs = [self.supervisor.process_config(index) for index in range(3)]
+        self.assertEqual([config['spill']['path'] for config in configs],
+                         ['/var/spool/pga/0', '/var/spool/pga/1', '/var/spool/pga/2'])
+        self.assertEqual([config['sinks']['file']['path'] for config in configs],
+                         ['/var/log/pga/hits.log.0', '/var/log/pga/hits.log.1', '/var/log/pga/hits.log.2'])
+        self.assertEqual([config['metrics']['port'] for config in configs], [9100, 9101, 9102])
+        self.assertTrue(all(config['spill']['max_bytes'] == 1024 for config in configs))
+
+    def test_shared_config_is_left_alone(self):
+        self.supervisor.process_config(1)
+        self.assertEqual(self.config['spill']['path'], '/var/spool/pga')
+        self.assertEqual(self.config['sinks']['file']['path'], '/var/log/pga/hits.log')
+        self.assertEqual(self.config['metrics']['port'], 9100)
+
+    def test_unset_paths_and_port_are_not_assigned(self):
+        config = Supervisor({'engine': {'processes': 2}, 'spill': {}, 'metrics': {'port': 0}}).process_config(1)
+        self.assertEqual(config['spill'], {})
+        self.assertEqual(config['metrics'], {'port': 0})
+        self.assertNotIn('sinks', config)
+
+
+if __name__ == '__main__':
+    unittest.main()
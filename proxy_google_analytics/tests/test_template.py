@@ -0,0 +1,41 @@
+import json
+import unittest
+from queue import Queue
+from urllib.parse import parse_qsl
+
+from proxy_google_analytics.tests.fakes import FakeTransport
+from proxy_google_analytics.worker import Worker
+
+MESSAGES = [
+    ('action.click', {'account_id': 'a', 'cid': '1', 'url': 'http://example.com/?q=a b&c=d',
+                      'referer': 'http://example.org/', 'ip': '10.0.0.1', 'user_agent': 'Mozilla/5.0 (X11)'}),
+    ('action.click', {'account_id': 'a', 'cid': '2', 'url': 'http://example.com/' + 'é' * 5000, 'referer': ''}),
+    ('action.goal', {'account_id': 'a', 'cid': '3', 'url': 'http://example.com/', 'ip': '10.0.0.2',
+                     'user_agent': 'curl/7.0', 'price': '12.30', 'currency': 'EUR'}),
+    ('action.goal', {'account_id': 'a', 'cid': '4', 'url': 'http://example.com/', 'price': '1', 'currency': 'USD'}),
+]
+
+
+def hits(templates):
+    transport = FakeTransport()
+    worker = Worker(Queue(), None, {'analytics': {'default': 'UA-1-1'}, 'report': {'templates': templates}},
+                    transport=transport)
+    for key, data in MESSAGES:
+        worker.message_processing(key, json.dumps(data).encode())
+    worker.stop()
+    worker.join(5)
+    # Transaction ids are random and the queue time depends on when the hit was sent.
+    return [sorted((name, 'id' if name == 'ti' else value) for name, value in parse_qsl(line) if name != 'qt')
+            for line in transport.posted]
+
+
+class HitTemplateTest(unittest.TestCase):
+
+    def test_templates_render_the_hits_of_the_builders(self):
+        built = hits(templates=False)
+        self.assertEqual(len(built), 10)
+        self.assertEqual(hits(templates=True), built)
+
+
+if __name__ == '__main__':
+    unittest.main()
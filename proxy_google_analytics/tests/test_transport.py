@@ -0,0 +1,75 @@
+import socket
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+from requests import ConnectionError
+
+from proxy_google_analytics.google_measurement_protocol import Transport
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """Answer posts with the statuses queued on the server, then with 200."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.posts += 1
+        self.send_response(self.server.statuses.pop(0) if self.server.statuses else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StatusHandler)
+        self.server.statuses = []
+        self.server.posts = 0
+        self.addCleanup(self.server.server_close)
+        thread = Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/collect'.format(self.server.server_port)
+
+    def transport(self, **options):
+        transport = Transport(backoff_factor=0, **options)
+        self.addCleanup(transport.close)
+        return transport
+
+    def test_server_errors_are_retried(self):
+        self.server.statuses = [503, 500]
+        response = self.transport(retries=3).post(self.url, 'v=1')
+        self.assertEqual((response.status_code, self.server.posts), (200, 3))
+
+    def test_last_server_error_is_returned_once_retries_run_out(self):
+        self.server.statuses = [503, 503, 503]
+        response = self.transport(retries=2).post(self.url, 'v=1')
+        self.assertEqual((response.status_code, self.server.posts), (503, 3))
+
+    def test_client_errors_are_not_retried(self):
+        self.server.statuses = [400]
+        response = self.transport(retries=3).post(self.url, 'v=1')
+        self.assertEqual((response.status_code, self.server.posts), (400, 1))
+
+    def test_connection_errors_are_retried_then_raised(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        with self.assertRaises(ConnectionError) as raised:
+            self.transport(retries=2).post('http://127.0.0.1:{}/collect'.format(port), 'v=1')
+        self.assertIn('Max retries exceeded', str(raised.exception))
+
+    def test_backoff_grows_exponentially(self):
+        transport = Transport(backoff_factor=0.3)
+        self.addCleanup(transport.close)
+        retry = transport.session.get_adapter(self.url).max_retries
+        retry = retry.increment('POST', self.url).increment('POST', self.url).increment('POST', self.url)
+        self.assertEqual(retry.get_backoff_time(), 1.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
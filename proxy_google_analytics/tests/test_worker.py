@@ -0,0 +1,139 @@
+import json
+import time
+import unittest
+from queue import Queue
+from threading import Event
+from urllib.parse import parse_qsl
+
+from proxy_google_analytics.acknowledger import Acknowledger
+from proxy_google_analytics.flow import Message
+from proxy_google_analytics.tests.fakes import FakeChannel, FakeTransport, ImmediateIOLoop, RecordingSink
+from proxy_google_analytics.worker import STOP, Worker
+
+CLICK = json.dumps({'account_id': 'a', 'cid': '1', 'url': 'http://example.com/'}).encode()
+GOAL = json.dumps({'account_id': 'a', 'cid': '1', 'url': 'http://example.com/', 'price': '2.5',
+                   'currency': 'USD'}).encode()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class BlockingTransport(FakeTransport):
+    """Hold every post until ``proceed`` is set."""
+
+    def __init__(self):
+        super(BlockingTransport, self).__init__()
+        self.posting = Event()
+        self.proceed = Event()
+
+    def post(self, uri, data, extra_headers=None):
+        self.posting.set()
+        self.proceed.wait(5)
+        return super(BlockingTransport, self).post(uri, data, extra_headers)
+
+
+class WorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.channel = FakeChannel()
+        self.acker = Acknowledger()
+        self.generation = self.acker.track(ImmediateIOLoop(), self.channel)
+        self.transport = FakeTransport()
+        self.queue = Queue()
+
+    def worker(self, sinks=(), **config):
+        worker = Worker(self.queue, None, dict({'analytics': {'default': 'UA-1-1'}}, **config),
+                        transport=self.transport, acker=self.acker, sinks=sinks)
+        self.addCleanup(worker.join, 5)
+        self.addCleanup(worker.stop)
+        return worker
+
+    def deliver(self, tag, key='action.goal', body=GOAL):
+        self.queue.put(Message(key, body, (self.acker.received(self.generation, tag),)))
+
+    def test_batched_messages_are_acked_once_their_batches_are_sent(self):
+        # Goals report four hits, so batches of three never leave the buffer empty.
+        self.worker(report={'mode': 'batch', 'batch_size': 3, 'batch_linger': 60})
+        self.deliver(1)
+        self.deliver(2)
+        self.assertTrue(wait_for(lambda: self.channel.acks))
+        self.assertEqual(self.channel.acks, [(1, True)])
+        self.assertEqual(len(self.transport.posted), 2)
+
+    def test_dequeue_drains_up_to_drain_size_and_stops_at_stop(self):
+        worker = self.worker(engine={'drain_size': 3})
+        worker.stop()
+        worker.join(5)
+        for tag in range(1, 6):
+            self.deliver(tag)
+        self.assertEqual([job.tokens[0][1] for job in worker.dequeue()], [1, 2, 3])
+        self.queue.put(STOP)
+        self.queue.put(STOP)
+        self.assertEqual(len(worker.dequeue()), 3)
+        self.assertEqual(self.queue.qsize(), 1)
+
+    def test_pending_batch_is_sent_without_further_messages(self):
+        self.worker(report={'mode': 'batch', 'batch_linger': 0.05})
+        self.deliver(1, 'action.click', CLICK)
+        self.assertTrue(wait_for(lambda: self.channel.acks))
+        self.assertEqual(len(self.transport.posted), 1)
+
+    def test_messages_left_at_the_drain_deadline_are_requeued(self):
+        self.transport = BlockingTransport()
+        worker = self.worker()
+        self.deliver(1, 'action.click', CLICK)
+        self.assertTrue(self.transport.posting.wait(5))
+        self.deliver(2, 'action.click', CLICK)
+        self.deliver(3, 'action.click', CLICK)
+        worker.stop(time.monotonic())
+        self.transport.proceed.set()
+        worker.join(5)
+        self.assertEqual(self.channel.acks, [(1, True)])
+        self.assertEqual(self.channel.nacks, [(2, True), (3, True)])
+        self.assertEqual(len(self.transport.posted), 1)
+
+    def test_pending_batch_is_abandoned_at_the_drain_deadline(self):
+        worker = self.worker(report={'mode': 'batch', 'batch_linger': 60})
+        self.deliver(1, 'action.click', CLICK)
+        self.assertTrue(wait_for(lambda: len(worker.batch)))
+        worker.stop(time.monotonic())
+        worker.join(5)
+        self.assertEqual(self.channel.nacks, [(1, True)])
+        self.assertEqual(self.transport.posted, [])
+
+    def test_queue_time_counts_from_receipt(self):
+        self.worker()
+        self.queue.put(Message('action.click', CLICK, (self.acker.received(self.generation, 1),),
+                               received=time.time() - 10))
+        self.assertTrue(wait_for(lambda: self.channel.acks))
+        queue_time = int(dict(parse_qsl(self.transport.posted[0]))['qt'])
+        self.assertTrue(10000 <= queue_time < 15000, queue_time)
+
+    def test_hits_are_sunk_once_their_message_is_delivered(self):
+        sink = RecordingSink()
+        self.transport.statuses = [500]
+        self.worker(sinks=[sink])
+        self.deliver(1, 'action.click', CLICK)
+        self.assertTrue(wait_for(lambda: self.channel.nacks))
+        self.assertEqual(sink.submitted, [])
+
+        self.deliver(2, 'action.click', CLICK)
+        self.assertTrue(wait_for(lambda: self.channel.acks))
+        self.assertEqual(len(sink.submitted), 1)
+
+    def test_hits_are_sunk_without_acknowledgements(self):
+        sink = RecordingSink()
+        worker = Worker(self.queue, None, {'analytics': {'default': 'UA-1-1'}}, transport=self.transport,
+                        sinks=[sink])
+        self.queue.put(Message('action.click', CLICK, ()))
+        worker.stop()
+        worker.join(5)
+        self.assertEqual(len(sink.submitted), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,145 @@
+import json
+
 import trafaret as t
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson is not None else json.loads
+
+TRANSPORT_CONF = t.Dict({
+    t.Key('pool_size', default=10): t.Int(gte=1),
+    t.Key('connect_timeout', default=3.05): t.Float(gt=0),
+    t.Key('read_timeout', default=5.0): t.Float(gt=0),
+    t.Key('retries', default=3): t.Int(gte=0),
+    t.Key('backoff_factor', default=0.3): t.Float(gte=0),
+})
+
 TRAFARET_CONF = t.Dict({
     t.Key('mongo'): t.Dict({
         t.Key('uri'): t.String(),
     }),
     t.Key('amqp'): t.Dict({
-        t.Key('broker_url'): t.String(),
+        t.Key('broker_url'): t.String() | t.List(t.String(), min_length=1),
         t.Key('queue'): t.String(),
         t.Key('exchange'): t.String(),
         t.Key('exchange_type'): t.String(),
         t.Key('routing_key'): t.String(),
         t.Key('durable'): t.Bool(),
         t.Key('auto_delete'): t.Bool(),
+        t.Key('ack', default='immediate'): t.Enum('immediate', 'delivered'),
+        t.Key('prefetch_count', default=0): t.Int(gte=0),
+        t.Key('connections', default=1): t.Int(gte=1),
+        t.Key('channels', default=1): t.Int(gte=1),
+        t.Key('reconnect_delay', default=1.0): t.Float(gt=0),
+        t.Key('reconnect_max_delay', default=30.0): t.Float(gt=0),
     }),
     t.Key('analytics'): t.Dict().allow_extra('*'),
+    t.Key('dispatch', default={}): t.Mapping(t.String(), t.String()),
+    t.Key('report', default={}): t.Dict({
+        t.Key('mode', default='single'): t.Enum('single', 'batch'),
+        t.Key('batch_size', default=20): t.Int(gte=1, lte=20),
+        t.Key('batch_bytes', default=16384): t.Int(gte=1, lte=16384),
+        t.Key('batch_linger', default=1.0): t.Float(gte=0),
+        t.Key('templates', default=False): t.Bool(),
+        t.Key('time_field', default=''): t.String(allow_blank=True),
+    }),
+    t.Key('transport', default={}): TRANSPORT_CONF,
+    t.Key('buffer', default={}): t.Dict({
+        t.Key('flush_size', default=10): t.Int(gte=1),
+        t.Key('flush_interval', default=10): t.Float(gt=0),
+        t.Key('max_messages', default=0): t.Int(gte=0),
+        t.Key('max_bytes', default=0): t.Int(gte=0),
+        t.Key('low_watermark', default=0.5): t.Float(gte=0, lte=1),
+    }),
+    t.Key('spill', default={}): t.Dict({
+        t.Key('path', default=''): t.String(allow_blank=True),
+        t.Key('segment_bytes', default=16 * 1024 * 1024): t.Int(gte=1),
+        t.Key('fsync_interval', default=1.0): t.Float(gte=0),
+        t.Key('replay_rate', default=100): t.Float(gt=0),
+        t.Key('replay_backoff', default=5.0): t.Float(gt=0),
+    }),
+    t.Key('routing', default={}): t.Dict({
+        t.Key('collection', default=''): t.String(allow_blank=True),
+        t.Key('account_field', default='account_id'): t.String(),
+        t.Key('tracking_field', default='tracking_id'): t.String(),
+        t.Key('ttl', default=300): t.Float(gt=0),
+        t.Key('reload_interval', default=10): t.Float(gte=0),
+    }),
+    t.Key('dedup', default={}): t.Dict({
+        t.Key('window', default=10.0): t.Float(gte=0),
+        t.Key('max_entries', default=100000): t.Int(gte=1),
+        t.Key('fields', default=[]): t.List(t.String()),
+    }),
+    t.Key('enrichment', default={}): t.Dict({
+        t.Key('collection', default=''): t.String(allow_blank=True),
+        t.Key('key', default='click_id'): t.String(),
+        t.Key('lookup_field', default='_id'): t.String(),
+        t.Key('fields', default={}): t.Dict().allow_extra('*'),
+        t.Key('cache_size', default=10000): t.Int(gte=1),
+        t.Key('ttl', default=600): t.Float(gt=0),
+        t.Key('retry_delay', default=30): t.Float(gt=0),
+    }),
+    t.Key('limits', default={}): t.Dict({
+        t.Key('rate', default=0): t.Float(gte=0),
+        t.Key('burst', default=100): t.Float(gt=0),
+        t.Key('overrides', default={}): t.Mapping(t.String(), t.Float(gt=0)),
+        t.Key('max_pending', default=100): t.Int(gte=0),
+        t.Key('adaptive', default=False): t.Bool(),
+        t.Key('min_concurrency', default=1): t.Int(gte=1),
+        t.Key('backoff', default=0.5): t.Float(gt=0, lte=1),
+        t.Key('cooldown', default=1.0): t.Float(gte=0),
+    }),
+    t.Key('sampling', default={}): t.Dict({
+        t.Key('window', default=5.0): t.Float(gt=0),
+        t.Key('max_entries', default=10000): t.Int(gte=1),
+        t.Key('keys', default=['action.click', 'action.goal']): t.List(t.String()),
+        t.Key('accounts', default={}): t.Mapping(t.String(), t.Dict({
+            t.Key('sample_rate', default=100): t.Float(gt=0, lte=100),
+            t.Key('aggregate', default=False): t.Bool(),
+        })),
+    }),
+    t.Key('sinks', default={}): t.Dict({
+        t.Key('ga4', default={}): t.Dict({
+            t.Key('streams', default={}): t.Mapping(t.String(), t.Dict({
+                t.Key('measurement_id'): t.String(),
+                t.Key('api_secret'): t.String(),
+            })),
+            t.Key('batch_size', default=100): t.Int(gte=1),
+            t.Key('linger', default=1.0): t.Float(gte=0),
+            t.Key('workers', default=2): t.Int(gte=1),
+            t.Key('concurrency', default=4): t.Int(gte=1),
+            t.Key('queue_size', default=10000): t.Int(gte=1),
+            t.Key('transport', default={}): TRANSPORT_CONF,
+        }),
+        t.Key('file', default={}): t.Dict({
+            t.Key('path', default=''): t.String(allow_blank=True),
+            t.Key('batch_size', default=1000): t.Int(gte=1),
+            t.Key('linger', default=1.0): t.Float(gte=0),
+            t.Key('queue_size', default=10000): t.Int(gte=1),
+        }),
+    }),
+    t.Key('shutdown', default={}): t.Dict({
+        t.Key('deadline', default=20.0): t.Float(gte=0),
+    }),
+    t.Key('logging', default={}): t.Dict({
+        t.Key('level', default='INFO'): t.Enum('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
+        t.Key('format', default='text'): t.Enum('text', 'json'),
+        t.Key('queue_size', default=10000): t.Int(gte=1),
+        t.Key('burst', default=10): t.Int(gte=0),
+        t.Key('interval', default=60.0): t.Float(gt=0),
+    }),
+    t.Key('metrics', default={}): t.Dict({
+        t.Key('host', default=''): t.String(allow_blank=True),
+        t.Key('port', default=0): t.Int(gte=0, lte=65535),
+    }),
+    t.Key('engine', default={}): t.Dict({
+        t.Key('mode', default='thread'): t.Enum('thread', 'asyncio'),
+        t.Key('concurrency', default=100): t.Int(gte=1),
+        t.Key('workers', default=1): t.Int(gte=1),
+        t.Key('drain_size', default=100): t.Int(gte=1),
+        t.Key('processes', default=1): t.Int(gte=1),
+    }),
 })
@@ -3,158 +3,348 @@ from __future__ import absolute_import, unicode_literals
 
 __author__ = 'kuzmenko-pavel'
 import socket
+import time
 from datetime import datetime
-from queue import Queue
+from functools import partial
 import pika
-
+from pika.adapters.select_connection import IOLoop
+
+from proxy_google_analytics.acknowledger import Acknowledger
+from proxy_google_analytics.dedup import DedupWindow
+from proxy_google_analytics.dispatch import Dispatcher
+from proxy_google_analytics.enrichment import Enricher
+from proxy_google_analytics.flow import FlowControlQueue, Message
+from proxy_google_analytics.click_db import get_collection
+from proxy_google_analytics.consumer import Backoff, ConnectionSlot, ConsumerChannel
+from proxy_google_analytics.google_measurement_protocol import Transport
+from proxy_google_analytics.limits import AdaptiveConcurrency, RateLimiter
 from proxy_google_analytics.logger import logger, exception_message
-from proxy_google_analytics.worker import Worker
+from proxy_google_analytics.metrics import (MESSAGES_CONSUMED, MESSAGES_ACKED, MESSAGES_NACKED, QUEUE_DEPTH, QUEUE_BYTES,
+                                            QUEUE_MEMORY, BUFFER_FLUSH_SIZE, GA_CONCURRENCY_LIMIT)
+from proxy_google_analytics.routing import AccountRouter
+from proxy_google_analytics.sampling import SamplingPolicy
+from proxy_google_analytics.sinks import build_sinks
+from proxy_google_analytics.spill import SpillLog, SpillReplayer
+from proxy_google_analytics.worker import Worker, BUILDERS
+
+DRAIN_POLL_INTERVAL = 0.05
 
 server_name = socket.gethostname()
 server_time = datetime.now()
 
 
 class Watcher(object):
-    __slots__ = ['_connection', '_channel', '_closing', '_consumer_tag', '_url', 'queue_name', 'exchange', '_queue',
-                 'exchange_type', 'routing_key', 'durable', 'auto_delete', '_messages', '_worker', '_buffer',
-                 '_buffer_threshold_length', '_buffer_threshold_time', 'amqp']
-
-    def __init__(self, config, db_click):
+    __slots__ = ['_ioloop', '_slots', 'channels_per_connection', '_closing', 'queue_name', 'exchange',
+                 'exchange_type', 'routing_key', 'durable', 'auto_delete', '_messages', '_workers', '_buffer',
+                 '_buffer_threshold_length', '_buffer_threshold_time', 'amqp', '_transport', '_acker',
+                 'prefetch_count', '_spill', '_replayer', '_dedup', '_router',
+                 '_enricher', '_connection_class', '_limiter', '_sampler', 'drain_deadline', '_deadline',
+                 '_dispatcher', '_drained', '_sinks', '_db_click']
+
+    def __init__(self, config, db_click, connection_class=pika.SelectConnection, transport=None, ioloop_class=IOLoop):
         amqp = config.get('amqp', '')
-        self._connection = None
-        self._channel = None
+        self._connection_class = connection_class
+        self._db_click = db_click
+        self._ioloop = ioloop_class()
         self._closing = False
-        self._consumer_tag = None
-        self._url = amqp.get('broker_url', '')
-        self._queue = None
+        self._drained = False
+        urls = amqp.get('broker_url', '')
+        urls = [urls] if isinstance(urls, str) else list(urls)
+        self._slots = [ConnectionSlot(index, urls, Backoff(amqp.get('reconnect_delay', 1.0),
+                                                           amqp.get('reconnect_max_delay', 30.0)))
+                       for index in range(amqp.get('connections', 1))]
+        self.channels_per_connection = amqp.get('channels', 1)
         self.queue_name = amqp.get('queue', 'test')
         self.exchange = amqp.get('exchange', 'test')
         self.exchange_type = amqp.get('exchange_type', 'topic')
         self.routing_key = amqp.get('routing_key', '*')
         self.durable = amqp.get('durable', True)
         self.auto_delete = amqp.get('auto_delete', False)
-        self._buffer = set()
-        self._buffer_threshold_length = 10
-        self._buffer_threshold_time = 10
-        self._messages = Queue()
-        self._worker = Worker(self._messages, db_click, config)
-
-    def connect(self):
-        logger.debug('Connecting to %s', self._url)
-        return pika.SelectConnection(pika.URLParameters(self._url),
-                                     self.on_connection_open,
-                                     stop_ioloop_on_close=False)
-
-    def on_connection_open(self, unused_connection):
-
-        logger.debug('Connection opened')
-        self.add_on_connection_close_callback()
-        self.open_channel()
-        self.timer_buffer_processing()
+        self.prefetch_count = amqp.get('prefetch_count', 0)
+        self._acker = Acknowledger() if amqp.get('ack') == 'delivered' else None
+        self.drain_deadline = config.get('shutdown', {}).get('deadline', 20.0)
+        self._deadline = None
+        self._buffer = []
+        buffer = config.get('buffer', {})
+        self._buffer_threshold_length = buffer.get('flush_size', 10)
+        self._buffer_threshold_time = buffer.get('flush_interval', 10)
+        self._messages = FlowControlQueue(max_messages=buffer.get('max_messages', 0),
+                                          max_bytes=buffer.get('max_bytes', 0),
+                                          low_watermark=buffer.get('low_watermark', 0.5),
+                                          on_high=self.pause_consuming,
+                                          on_low=self.schedule_resume_consuming)
+        QUEUE_DEPTH.set_function(lambda: self._messages.messages)
+        QUEUE_BYTES.set_function(lambda: self._messages.bytes)
+        QUEUE_MEMORY.set_function(lambda: self._messages.memory)
+        engine = config.get('engine', {})
+        limits = config.get('limits', {})
+        self._limiter = None
+        if limits.get('rate'):
+            self._limiter = RateLimiter(limits['rate'], burst=limits.get('burst', 100),
+                                        overrides=limits.get('overrides', {}))
+        if transport is None:
+            concurrency = None
+            if limits.get('adaptive'):
+                pool_size = config.get('transport', {}).get('pool_size', 10)
+                concurrency = AdaptiveConcurrency(minimum=min(limits.get('min_concurrency', 1), pool_size),
+                                                  maximum=pool_size, backoff=limits.get('backoff', 0.5),
+                                                  cooldown=limits.get('cooldown', 1.0))
+                GA_CONCURRENCY_LIMIT.set_function(lambda: concurrency.limit, 'transport')
+            transport = Transport(concurrency=concurrency, **config.get('transport', {}))
+        self._transport = transport
+        spill = config.get('spill', {})
+        self._spill = None
+        self._replayer = None
+        if spill.get('path'):
+            self._spill = SpillLog(spill['path'], segment_bytes=spill.get('segment_bytes', 16 * 1024 * 1024),
+                                   fsync_interval=spill.get('fsync_interval', 1.0))
+            self._replayer = SpillReplayer(self._spill, self._transport, rate=spill.get('replay_rate', 100),
+                                           backoff=spill.get('replay_backoff', 5.0))
+        dedup = config.get('dedup', {})
+        self._dedup = None
+        if dedup.get('window'):
+            self._dedup = DedupWindow(window=dedup['window'], max_entries=dedup.get('max_entries', 100000),
+                                      fields=dedup.get('fields', ()))
+        routing = config.get('routing', {})
+        collection = None
+        if routing.get('collection'):
+            collection = get_collection(db_click, routing['collection'])
+        self._router = AccountRouter(config.get('analytics', {}), collection,
+                                     account_field=routing.get('account_field', 'account_id'),
+                                     tracking_field=routing.get('tracking_field', 'tracking_id'),
+                                     ttl=routing.get('ttl', 300))
+        enrichment = config.get('enrichment', {})
+        self._enricher = None
+        if enrichment.get('collection'):
+            self._enricher = Enricher(get_collection(db_click, enrichment['collection']),
+                                      enrichment.get('key', 'click_id'),
+                                      lookup_field=enrichment.get('lookup_field', '_id'),
+                                      fields=enrichment.get('fields', {}),
+                                      cache_size=enrichment.get('cache_size', 10000),
+                                      ttl=enrichment.get('ttl', 600),
+                                      retry_delay=enrichment.get('retry_delay', 30))
+        sampling = config.get('sampling', {})
+        self._sampler = None
+        if sampling.get('accounts'):
+            self._sampler = SamplingPolicy(sampling['accounts'])
+        self._dispatcher = Dispatcher.from_config(config.get('dispatch'), BUILDERS)
+        self._sinks = build_sinks(config.get('sinks', {}))
+        worker_class = self.worker_class(engine.get('mode', 'thread'))
+        self._workers = [worker_class(self._messages, db_click, config, self._transport, self._acker,
+                                      self._spill, self._dedup, self._router, self._enricher,
+                                      self._limiter, self._sampler, self._dispatcher, self._sinks)
+                         for _ in range(engine.get('workers', 1))]
+
+    def worker_class(self, mode):
+        if mode == 'asyncio':
+            from proxy_google_analytics.async_worker import AsyncWorker
+            return AsyncWorker
+        return Worker
+
+    def reload(self, config):
+        """Apply the ``analytics`` and ``routing`` sections of a changed config."""
+        logger.info('Reloading account routes')
+        routing = config.get('routing', {})
+        collection = None
+        if routing.get('collection'):
+            collection = get_collection(self._db_click, routing['collection'])
+        self._router.configure(collection, account_field=routing.get('account_field', 'account_id'),
+                               tracking_field=routing.get('tracking_field', 'tracking_id'),
+                               ttl=routing.get('ttl', 300))
+        self._router.load(config.get('analytics', {}))
+
+    def connect(self, slot):
+        slot.timer = None
+        if self._closing:
+            return
+        logger.debug('Connecting to %s', slot.host)
+        try:
+            slot.connection = self._connection_class(pika.URLParameters(slot.url),
+                                                     partial(self.on_connection_open, slot),
+                                                     on_open_error_callback=partial(self.on_connection_error, slot),
+                                                     stop_ioloop_on_close=False, custom_ioloop=self._ioloop)
+        except Exception as e:
+            logger.error(exception_message(exc=str(e)))
+            self.schedule_reconnect(slot)
 
-    def add_on_connection_close_callback(self):
+    def on_connection_open(self, slot, connection):
 
-        logger.debug('Adding connection close callback')
-        self._connection.add_on_close_callback(self.on_connection_closed)
+        logger.debug('Connection to %s opened', slot.host)
+        connection.add_on_close_callback(partial(self.on_connection_closed, slot))
+        if self._closing:
+            connection.close()
+            return
+        slot.backoff.reset()
+        for _ in range(self.channels_per_connection):
+            self.open_channel(slot)
 
-    def on_connection_closed(self, connection, reply_code, reply_text):
+    def on_connection_error(self, slot, connection, error):
 
-        self._channel = None
         if self._closing:
-            self._connection.ioloop.stop()
+            self.connection_gone(slot)
+            return
+        logger.warning('Cannot connect to %s: %s', slot.host, error)
+        self.schedule_reconnect(slot)
+
+    def on_connection_closed(self, slot, connection, reply_code, reply_text):
+
+        if self._acker is not None:
+            for consumer in slot.channels:
+                self._acker.release(consumer.generation)
+        if self._closing:
+            self.connection_gone(slot)
         else:
-            logger.warning('Connection closed, reopening in 5 seconds: (%s) %s',
-                           reply_code, reply_text)
-            self._connection.add_timeout(5, self.reconnect)
+            logger.warning('Connection to %s closed: (%s) %s', slot.host, reply_code, reply_text)
+            self.schedule_reconnect(slot)
 
-    def reconnect(self):
-        self._connection.ioloop.stop()
+    def schedule_reconnect(self, slot):
+        """Try the next broker url of ``slot`` after a jittered backoff, from the running ioloop."""
+        delay = slot.failed()
+        logger.warning('Connecting to %s in %.2f seconds', slot.host, delay)
+        slot.timer = self._ioloop.add_timeout(delay, partial(self.connect, slot))
 
-        if not self._closing:
-            # Create a new connection
-            self._connection = self.connect()
+    def connection_gone(self, slot):
+        slot.connection = None
+        slot.channels = []
+        if self._drained and all(slot.connection is None for slot in self._slots):
+            self._ioloop.stop()
 
-            # There is now a new connection, needs a new ioloop to run
-            self._connection.ioloop.start()
+    def consumers(self):
+        return [consumer for slot in self._slots for consumer in slot.channels]
 
-    def open_channel(self):
+    def open_channel(self, slot):
 
         logger.debug('Creating a new channel')
-        self._connection.channel(on_open_callback=self.on_channel_open)
+        slot.connection.channel(on_open_callback=partial(self.on_channel_open, slot))
 
-    def on_channel_open(self, channel):
+    def on_channel_open(self, slot, channel):
 
         logger.debug('Channel opened')
-        self._channel = channel
-        self.add_on_channel_close_callback()
-        self.setup_exchange(self.exchange)
-
-    def add_on_channel_close_callback(self):
-
-        logger.debug('Adding channel close callback')
-        self._channel.add_on_close_callback(self.on_channel_closed)
-
-    def on_channel_closed(self, channel, reply_code, reply_text):
-
-        logger.warning('Channel %i was closed: (%s) %s',
-                       channel, reply_code, reply_text)
-        self._connection.close()
-
-    def setup_exchange(self, exchange_name):
-
-        logger.debug('Declaring exchange %s', exchange_name)
-        self._channel.exchange_declare(callback=self.on_exchange_declareok, exchange=exchange_name,
-                                       exchange_type=self.exchange_type, durable=self.durable,
-                                       auto_delete=self.auto_delete, passive=False)
-
-    def on_exchange_declareok(self, unused_frame):
+        consumer = ConsumerChannel(slot, channel)
+        slot.channels.append(consumer)
+        channel.add_on_close_callback(partial(self.on_channel_closed, consumer))
+        if self._acker is not None:
+            consumer.generation = self._acker.track(self._ioloop, channel)
+        if self.prefetch_count:
+            logger.debug('Setting prefetch count %s', self.prefetch_count)
+            channel.basic_qos(callback=self.dummy, prefetch_count=self.prefetch_count)
+        self.setup_exchange(consumer)
+
+    def on_channel_closed(self, consumer, channel, reply_code, reply_text):
+
+        slot = consumer.slot
+        if consumer in slot.channels:
+            slot.channels.remove(consumer)
+        if self._acker is not None:
+            self._acker.release(consumer.generation)
+        if self._closing or slot.connection is None or not slot.connection.is_open:
+            return
+        delay = slot.backoff.next()
+        logger.warning('Channel %i was closed, reopening in %.2f seconds: (%s) %s',
+                       channel, delay, reply_code, reply_text)
+        self._ioloop.add_timeout(delay, partial(self.reopen_channel, slot, slot.connection))
+
+    def reopen_channel(self, slot, connection):
+        if not self._closing and slot.connection is connection and connection.is_open:
+            self.open_channel(slot)
+
+    def setup_exchange(self, consumer):
+
+        logger.debug('Declaring exchange %s', self.exchange)
+        consumer.channel.exchange_declare(callback=partial(self.on_exchange_declareok, consumer),
+                                          exchange=self.exchange, exchange_type=self.exchange_type,
+                                          durable=self.durable, auto_delete=self.auto_delete, passive=False)
+
+    def on_exchange_declareok(self, consumer, unused_frame):
 
         logger.debug('Exchange declared')
-        self.setup_queue(self.queue_name)
-        self.start_consuming()
+        self.setup_queue(consumer.channel, self.queue_name)
+        self.start_consuming(consumer)
 
     def dummy(self, *args, **kwargs):
         pass
 
-    def setup_queue(self, queue):
+    def setup_queue(self, channel, queue):
         logger.debug('Declaring queue %s', queue)
-        self._queue = self._channel.queue_declare(callback=self.dummy, queue=queue, durable=self.durable,
-                                                  auto_delete=self.auto_delete)
+        channel.queue_declare(callback=self.dummy, queue=queue, durable=self.durable, auto_delete=self.auto_delete)
         logger.debug('Binding %s to %s with %s ', self.exchange, queue, self.routing_key)
-        self._channel.queue_bind(callback=self.dummy, queue=queue, exchange=self.exchange, routing_key=self.routing_key)
+        channel.queue_bind(callback=self.dummy, queue=queue, exchange=self.exchange, routing_key=self.routing_key)
 
-    def start_consuming(self):
+    def start_consuming(self, consumer):
 
         logger.debug('Issuing consumer related RPC commands')
-        self.add_on_cancel_callback()
-        self._consumer_tag = self._channel.basic_consume(self.on_message, self.queue_name)
-
-    def add_on_cancel_callback(self):
-
-        logger.debug('Adding consumer cancellation callback')
-        self._channel.add_on_cancel_callback(self.on_consumer_cancelled)
-
-    def on_consumer_cancelled(self, method_frame):
-
-        logger.debug('Consumer was cancelled remotely, shutting down: %r',
+        consumer.channel.add_on_cancel_callback(partial(self.on_consumer_cancelled, consumer))
+        consumer.consumer_tag = None
+        if not self._messages.paused and not self._closing:
+            consumer.consumer_tag = consumer.channel.basic_consume(partial(self.on_message, consumer),
+                                                                   self.queue_name)
+
+    def cancel_consuming(self):
+        """Cancel the consumers of every channel, returning how many were consuming."""
+        cancelled = 0
+        for consumer in self.consumers():
+            if consumer.consumer_tag and consumer.channel.is_open:
+                consumer.channel.basic_cancel(self.dummy, consumer.consumer_tag)
+                cancelled += 1
+            consumer.consumer_tag = None
+        return cancelled
+
+    def pause_consuming(self):
+        if self.cancel_consuming():
+            logger.warning('Buffer is full (%s messages, %s bytes), pausing consumption',
+                           self._messages.messages, self._messages.bytes)
+
+    def schedule_resume_consuming(self):
+        self._ioloop.add_callback_threadsafe(self.resume_consuming)
+
+    def resume_consuming(self):
+        if self._closing or self._messages.paused:
+            return
+        resumed = 0
+        for consumer in self.consumers():
+            if consumer.consumer_tag is None and consumer.channel.is_open:
+                consumer.consumer_tag = consumer.channel.basic_consume(partial(self.on_message, consumer),
+                                                                       self.queue_name)
+                resumed += 1
+        if resumed:
+            logger.info('Buffer drained, resuming consumption')
+
+    def on_consumer_cancelled(self, consumer, method_frame):
+
+        logger.debug('Consumer was cancelled remotely, reopening its channel: %r',
                      method_frame)
-        if self._channel:
-            self._channel.close()
+        if consumer.channel.is_open:
+            consumer.channel.close()
 
-    def on_message(self, unused_channel, basic_deliver, properties, body):
-        if self.message_processing(unused_channel, basic_deliver, properties, body):
-            self.acknowledge_message(basic_deliver.delivery_tag)
+    def on_message(self, consumer, channel, basic_deliver, properties, body):
+        key = basic_deliver.routing_key
+        MESSAGES_CONSUMED.labels(key).inc()
+        if self._closing:
+            MESSAGES_NACKED.labels(key).inc()
+            self.nacknowledge_message(channel, basic_deliver.delivery_tag)
+            return
+        if self._acker is not None:
+            token = self._acker.received(consumer.generation, basic_deliver.delivery_tag)
+            if not self.message_processing(channel, basic_deliver, properties, body, token):
+                MESSAGES_NACKED.labels(key).inc()
+                self._acker.resolve([token], False)
+        elif self.message_processing(channel, basic_deliver, properties, body):
+            MESSAGES_ACKED.labels(key).inc()
+            self.acknowledge_message(channel, basic_deliver.delivery_tag)
         else:
-            self.nacknowledge_message(basic_deliver.delivery_tag)
+            MESSAGES_NACKED.labels(key).inc()
+            self.nacknowledge_message(channel, basic_deliver.delivery_tag)
 
-    def message_processing(self, unused_channel, basic_deliver, properties, body):
+    def message_processing(self, unused_channel, basic_deliver, properties, body, token=None):
         try:
             key = basic_deliver.routing_key
             if body:
-                msg = body.decode(encoding='UTF-8')
-                self._buffer.add((key, msg))
+                self._buffer.append(Message(key, body, (token,) if token is not None else ()))
                 if len(self._buffer) > self._buffer_threshold_length:
                     self.buffer_processing()
+            elif token is not None:
+                MESSAGES_ACKED.labels(key).inc()
+                self._acker.resolve([token])
             return True
         except Exception as e:
             logger.error(exception_message(exc=str(e)))
@@ -163,51 +353,96 @@ class Watcher(object):
     def timer_buffer_processing(self):
         logger.debug('Start timer buffer processing')
         self.buffer_processing()
-        self._connection.add_timeout(self._buffer_threshold_time, self.timer_buffer_processing)
+        self._ioloop.add_timeout(self._buffer_threshold_time, self.timer_buffer_processing)
 
     def buffer_processing(self):
         logger.debug('Start buffer processing')
-        while self._buffer:
-            self._messages.put(self._buffer.pop())
+        buffer = self._buffer
+        self._buffer = []
+        if buffer:
+            BUFFER_FLUSH_SIZE.observe(len(buffer))
+        for job in buffer:
+            self._messages.put(job)
         logger.debug('Stop buffer processing')
 
-    def acknowledge_message(self, delivery_tag):
+    def acknowledge_message(self, channel, delivery_tag):
         logger.debug('Acknowledging message %s', delivery_tag)
-        self._channel.basic_ack(delivery_tag)
+        channel.basic_ack(delivery_tag)
 
-    def nacknowledge_message(self, delivery_tag):
+    def nacknowledge_message(self, channel, delivery_tag):
         logger.debug('Acknowledging message %s', delivery_tag)
-        self._channel.basic_nack(delivery_tag)
+        channel.basic_nack(delivery_tag)
 
     def stop_consuming(self):
-        if self._channel:
-            logger.debug('Sending a Basic.Cancel RPC command to RabbitMQ')
-            self._channel.basic_cancel(self.on_cancelok, self._consumer_tag)
-
-    def on_cancelok(self, unused_frame):
-        logger.debug('RabbitMQ acknowledged the cancellation of the consumer')
-        self.close_channel()
-
-    def close_channel(self):
-
-        logger.debug('Closing the channel')
-        self._channel.close()
+        """Close every connection, stopping the ioloop once all of them are gone."""
+        self._drained = True
+        for slot in self._slots:
+            if slot.timer is not None:
+                self._ioloop.remove_timeout(slot.timer)
+                slot.timer = None
+            if slot.connection is not None and slot.connection.is_open:
+                self.close_connection(slot)
+            elif slot.connection is not None and slot.connection.is_closed:
+                slot.connection = None
+        if all(slot.connection is None for slot in self._slots):
+            self._ioloop.stop()
 
     def run(self):
-        logger.info('Starting Listening AMQP')
-        self._connection = self.connect()
-        self._connection.ioloop.start()
+        """Consume until stopped, reconnecting lost connections from the one ioloop."""
+        logger.info('Starting Listening AMQP with %s connections of %s channels',
+                    len(self._slots), self.channels_per_connection)
+        for slot in self._slots:
+            self.connect(slot)
+        self.timer_buffer_processing()
+        self._ioloop.start()
 
     def stop(self):
-        logger.info('Stopping Listening AMQP')
-        self.buffer_processing()
+        """Drain and close, giving up on undelivered messages after ``shutdown.deadline`` seconds.
+
+        Consumption stops first, then the buffer goes to the workers and
+        every worker finishes its queue and pending batch concurrently
+        while the ioloop keeps settling deliveries. Past the deadline the
+        workers requeue what is left, or spill it when acknowledgements
+        are immediate, and deliveries still outstanding are nacked back to
+        RabbitMQ before the connections close.
+        """
+        if self._closing:
+            return
+        logger.info('Stopping Listening AMQP, draining for at most %ss', self.drain_deadline)
         self._closing = True
-        self._worker.need_exit = True
-        self._worker.join()
-        self.stop_consuming()
-        self._connection.ioloop.start()
+        self._deadline = time.monotonic() + self.drain_deadline
+        self.cancel_consuming()
+        self.buffer_processing()
+        for worker in self._workers:
+            worker.stop(self._deadline)
+        self.check_drained()
+        self._ioloop.start()
         logger.info('Stopped Listening AMQP')
 
-    def close_connection(self):
-        logger.debug('Closing connection')
-        self._connection.close()
+    def check_drained(self):
+        if any(worker.is_alive() for worker in self._workers) and time.monotonic() < self._deadline:
+            self._ioloop.add_timeout(DRAIN_POLL_INTERVAL, self.check_drained)
+            return
+        stuck = [worker.name for worker in self._workers if worker.is_alive()]
+        if stuck:
+            logger.error('%s did not drain in %ss', ', '.join(stuck), self.drain_deadline)
+        if self._acker is not None:
+            nacked = self._acker.abandon()
+            if nacked:
+                logger.warning('Requeued %s undelivered messages', nacked)
+        if self._replayer is not None:
+            self._replayer.stop()
+            self._replayer.join(max(self._deadline - time.monotonic(), 0))
+            self._spill.close()
+        self._transport.close()
+        for sink in self._sinks:
+            sink.close(max(self._deadline - time.monotonic(), 0))
+        if self._dedup is not None:
+            logger.info('Dropped %s duplicate messages of %s', self._dedup.hits, self._dedup.hits + self._dedup.misses)
+        if self._enricher is not None:
+            logger.info('Enrichment cache hit ratio %.2f', self._enricher.ratio())
+        self.stop_consuming()
+
+    def close_connection(self, slot):
+        logger.debug('Closing connection to %s', slot.host)
+        slot.connection.close()
@@ -1,65 +1,495 @@
 import time
+from collections import OrderedDict, deque
+from functools import partial
+from urllib.parse import urlencode
+from itertools import chain
+from queue import Empty
 from threading import Thread
+from datetime import datetime
+from decimal import Decimal
 from uuid import uuid4
-import json
 from prices import Money
+from requests import RequestException
 
-from proxy_google_analytics.google_measurement_protocol import pageview, report, event, transaction, item
+from proxy_google_analytics.google_measurement_protocol import (pageview, report_lines, event, transaction, item,
+                                                                BatchReporter, HitTemplate, Transport)
+from proxy_google_analytics.google_measurement_protocol.report import (_finalize_payloads, _encode_payloads,
+                                                                       _within_hit_limit, EVENT_TIME, MAX_QUEUE_TIME)
+from proxy_google_analytics.google_measurement_protocol.transport import is_healthy
+from proxy_google_analytics.dispatch import Dispatcher
+from proxy_google_analytics.enrichment import split_params
 from proxy_google_analytics.logger import logger, exception_message
+from proxy_google_analytics.metrics import (MESSAGES_ACKED, MESSAGES_NACKED, MESSAGES_DROPPED, MESSAGES_THROTTLED,
+                                            WORKER_BUSY_SECONDS, Timer)
+from proxy_google_analytics.routing import AccountRouter
+from proxy_google_analytics.sampling import Aggregator, DEFAULT_AGGREGATED_KEYS
+from proxy_google_analytics.utils import json_loads
+
+STOP = object()
+
+PAGEVIEW = HitTemplate([('t', 'pageview')], ['dl', 'dr', 'uip', 'ua'])
+EVENT = HitTemplate([('t', 'event'), ('ec', 'click'), ('ea', 'click'), ('el', 'click')], ['ev', 'uip', 'dl', 'ua'])
+TRANSACTION = HitTemplate([('t', 'transaction'), ('tt', '0'), ('pa', 'purchase')],
+                          ['ti', 'tr', 'cu', 'uip', 'dl', 'ua'])
+ITEM = HitTemplate([('t', 'item'), ('iq', '1')], ['in', 'ip', 'cu', 'ti', 'iv', 'ic'])
+
+
+class DeliveryError(Exception):
+    pass
 
 
 class Worker(Thread):
-    def __init__(self, queue, db_click, config):
+    def __init__(self, queue, db_click, config, transport=None, acker=None, spill=None, dedup=None, router=None,
+                 enricher=None, limiter=None, sampler=None, dispatcher=None, sinks=()):
         super(Worker, self).__init__()
         self.__queue = queue
-        self.need_exit = False
+        self.acker = acker
+        self.spill = spill
+        self.dedup = dedup
+        if router is None:
+            router = AccountRouter(config.get('analytics', {}))
+        self.router = router
+        if dispatcher is None:
+            dispatcher = Dispatcher.from_config(config.get('dispatch'), BUILDERS)
+        self.dispatcher = dispatcher
+        self.sinks = sinks
+        self.enricher = enricher
+        self.limiter = limiter
+        self.max_pending = config.get('limits', {}).get('max_pending', 100)
+        self._deferred = OrderedDict()
+        self.sampler = sampler
+        self.aggregator = None
+        if sampler is not None and sampler.aggregating():
+            sampling = config.get('sampling', {})
+            self.aggregator = Aggregator(window=sampling.get('window', 5.0),
+                                         max_entries=sampling.get('max_entries', 10000),
+                                         keys=sampling.get('keys', DEFAULT_AGGREGATED_KEYS))
+        self._spilling = False
+        self._event_time = None
+        self._identity = None
+        self._sink_lines = []
+        self._unacked = []
+        self._identities = []
+        self._pending_lines = []
+        self.deadline = None
+        self.drain_size = config.get('engine', {}).get('drain_size', 100)
         self.session = db_click
         self.config = config
+        self.batch = None
+        self.templates = config.get('report', {}).get('templates', False)
+        self.time_field = config.get('report', {}).get('time_field', '')
+        self._send = self.setup_report(transport)
+        self.busy = WORKER_BUSY_SECONDS.labels(self.name)
         self.setDaemon(True)
         self.start()
 
+    def setup_report(self, transport):
+        if transport is None:
+            transport = Transport(**self.config.get('transport', {}))
+        self.transport = transport
+        report_config = self.config.get('report', {})
+        if report_config.get('mode') == 'batch':
+            self.batch = BatchReporter(max_hits=report_config.get('batch_size', 20),
+                                       max_bytes=report_config.get('batch_bytes', 16384),
+                                       linger=report_config.get('batch_linger', 1.0),
+                                       transport=self.transport,
+                                       spill=self.spill.append if self.spill is not None else None)
+            return self.batch.report_lines
+        if self.spill is not None:
+            return self.spilling_report_lines
+        return partial(report_lines, transport=self.transport)
+
+    def spilling_report_lines(self, lines, extra_headers=None):
+        responses = []
+        for line in lines:
+            try:
+                sent = report_lines([line], extra_headers, self.transport)
+                for response in sent:
+                    self.check(response)
+            except (DeliveryError, RequestException) as e:
+                logger.warning('Spilling undelivered hit: %s', e)
+                self.spill.append([line])
+                sent = [None]
+            responses.extend(sent)
+        return responses
+
     def run(self):
         logger.info('Starting Worker')
-        while True:
-            if not self.__queue.empty():
-                job = self.__queue.get()
-                self.message_processing(*job)
-                self.__queue.task_done()
-            else:
-                if self.need_exit:
-                    break
-                time.sleep(0.1)
+        running = True
+        while running:
+            jobs = self.dequeue()
+            with Timer(self.busy.inc):
+                for job in chain(self.release(), self.prepare(jobs)):
+                    if job is STOP:
+                        running = False
+                    elif not self.stale(job):
+                        job = self.expire(job)
+                        if job is not None:
+                            self.job_processing(*job)
+                    self.__queue.task_done()
+                self.batch_processing()
+        self.batch_processing(force=True)
         logger.info('Stopping Worker')
 
-    def message_processing(self, key, data):
+    def poll_timeout(self):
+        """Seconds to wait for new jobs before a pending batch or held back job is due."""
+        timeouts = []
+        if self.batch is not None and len(self.batch):
+            timeouts.append(self.batch.remaining())
+        if self.aggregator is not None and len(self.aggregator):
+            timeouts.append(self.aggregator.remaining())
+        if self._deferred:
+            timeouts.append(min(self.limiter.wait(tracking_id) for tracking_id in self._deferred))
+        return min(timeouts) if timeouts else None
+
+    def dequeue(self):
+        try:
+            jobs = [self.__queue.get(timeout=self.poll_timeout())]
+        except Empty:
+            return []
+        while jobs[-1] is not STOP and len(jobs) < self.drain_size:
+            try:
+                jobs.append(self.__queue.get_nowait())
+            except Empty:
+                break
+        return jobs
+
+    def prepare(self, jobs):
+        """Decode the messages of drained jobs, sample and aggregate them, prefetch their enrichment and hold
+        back rate limited ones."""
+        decoded_jobs = []
+        for job in jobs:
+            if job is STOP:
+                if self.aggregator is not None:
+                    decoded_jobs.extend(self.aggregator.expired(force=True))
+                decoded_jobs.append(job)
+                continue
+            key, data, tokens = job.key, job.body, job.tokens
+            try:
+                decoded = json_loads(data)
+            except Exception:
+                decoded = None
+            try:
+                event_time = self.event_time(decoded, job.received)
+                if (time.time() - event_time) * 1000 > MAX_QUEUE_TIME:
+                    self.discard(key, tokens, 'expired')
+                    continue
+                job = (key, data, tokens, decoded, False, event_time)
+                if self.sampler is not None and isinstance(decoded, dict) and not self.sample(job):
+                    continue
+            except Exception as e:
+                logger.error(exception_message(exc=str(e)))
+                self.discard(key, tokens, 'invalid')
+                continue
+            decoded_jobs.append(job)
+        if self.aggregator is not None:
+            decoded_jobs.extend(self.aggregator.expired())
+        if self.enricher is not None:
+            self.enricher.prefetch([job[3] for job in decoded_jobs if job is not STOP and isinstance(job[3], dict)])
+        prepared = []
+        for job in decoded_jobs:
+            if job is STOP:
+                prepared.extend(self.release(force=True))
+                prepared.append(job)
+            elif self.limiter is None:
+                prepared.append(job)
+            else:
+                try:
+                    job = self.defer(job)
+                except Exception as e:
+                    logger.error(exception_message(exc=str(e)))
+                    self.discard(job[0], job[2], 'invalid')
+                    continue
+                if job is not None:
+                    prepared.append(job)
+        return prepared
+
+    def event_time(self, decoded, received):
+        """Epoch seconds of the event of a message, from its ``report.time_field`` or when it was received.
+
+        The field may hold epoch seconds or milliseconds or an ISO 8601
+        date and time.
+        """
+        value = decoded.get(self.time_field) if self.time_field and isinstance(decoded, dict) else None
+        if value is None:
+            return received
+        try:
+            if isinstance(value, str):
+                try:
+                    value = float(value)
+                except ValueError:
+                    return datetime.fromisoformat(value).timestamp()
+            value = float(value)
+        except (TypeError, ValueError):
+            return received
+        return value / 1000 if value > 1e11 else value
+
+    def discard(self, key, tokens, reason):
+        """Drop a message before any hit is built, acknowledging it."""
+        MESSAGES_DROPPED.labels(reason).inc()
+        if self.acker is not None and tokens:
+            self.resolve([(key, tokens)], True)
+        self.__queue.task_done()
+
+    def sample(self, job):
+        """Apply the sampling policy of the account of a job before any hit is built.
+
+        Returns True when the job is to be processed now. Jobs sampled out
+        are acknowledged right away, jobs merged into a held one are
+        settled along with it and held jobs come back from
+        ``Aggregator.expired`` once their window closes.
+        """
+        key, data, tokens, decoded = job[:4]
+        account_id = decoded.get('account_id')
+        if not self.sampler.sampled(account_id, decoded.get('cid')):
+            self.discard(key, tokens, 'sampled')
+        elif self.aggregator is not None and key in self.aggregator.keys and self.sampler.aggregated(account_id):
+            if self.aggregator.add(job):
+                MESSAGES_DROPPED.labels('aggregated').inc()
+                self.__queue.task_done()
+        else:
+            return True
+        return False
+
+    def defer(self, job):
+        """Hold a job back while the bucket of its tracking id is empty.
+
+        Returns the job when it can be processed now. Once ``max_pending``
+        jobs of a tracking id are held, further ones are processed with
+        their hits spilled, or sent over the limit when there is no spill
+        log, so nothing is dropped.
+        """
+        decoded = job[3]
+        if not isinstance(decoded, dict):
+            return job
+        tracking_id = self.router.resolve(decoded.get('account_id'))
+        if not tracking_id:
+            return job
+        deferred = self._deferred.get(tracking_id)
+        if not deferred and not self.limiter.wait(tracking_id):
+            return job
+        if deferred is not None and len(deferred) >= self.max_pending:
+            if self.spill is not None:
+                MESSAGES_THROTTLED.labels('spilled').inc()
+                return job[:4] + (True,) + job[5:]
+            MESSAGES_THROTTLED.labels('over_limit').inc()
+            return job
+        if deferred is None:
+            deferred = self._deferred[tracking_id] = deque()
+        MESSAGES_THROTTLED.labels('deferred').inc()
+        deferred.append(job)
+        return None
+
+    def release(self, force=False):
+        """Yield held back jobs as the buckets of their tracking ids refill."""
+        for tracking_id in list(self._deferred):
+            deferred = self._deferred[tracking_id]
+            while deferred and (force or not self.limiter.wait(tracking_id)):
+                yield deferred.popleft()
+            if not deferred:
+                del self._deferred[tracking_id]
+
+    def stop(self, deadline=None):
+        """Finish the queued jobs, giving up on delivering them at the monotonic ``deadline``."""
+        self.deadline = deadline
+        self.__queue.put(STOP)
+
+    def overdue(self):
+        """Return True past the drain deadline when undelivered messages can be kept."""
+        return (self.deadline is not None and time.monotonic() >= self.deadline and
+                (self.acker is not None or self.spill is not None))
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def stale(self, job):
+        """Return True, counting the job dropped, when the channels of all of its deliveries are gone.
+
+        The broker redelivers those messages, their hits would be reported
+        twice.
+        """
+        if self.acker is None or not job[2] or self.acker.tracked(job[2]):
+            return False
+        MESSAGES_DROPPED.labels('stale').inc()
+        return True
+
+    def expire(self, job):
+        """Past the drain deadline, nack a job back to the queue or mark its hits to be spilled."""
+        if not self.overdue():
+            return job
+        if self.acker is not None:
+            self.resolve([(job[0], job[2])], False)
+            return None
+        return job[:4] + (True,) + job[5:]
+
+    def job_processing(self, key, data, tokens, decoded=None, spill=False, event_time=None):
+        self._spilling = spill
+        self._event_time = event_time
+        flushed = self.batch.flushed if self.batch is not None else 0
         try:
-            d = json.loads(data)
-            if key == 'action.click':
-                self.gpageview(d)
-            elif key == 'action.goal':
-                self.gevent(d)
+            delivered = self.message_processing(key, data, decoded)
+        finally:
+            identity = self._identity
+            lines = self._sink_lines
+            self._spilling = False
+            self._event_time = None
+            self._identity = None
+            self._sink_lines = []
+        if self.acker is None:
+            if delivered:
+                self.sink(lines)
+            return
+        pending = delivered and self.batch is not None and len(self.batch)
+        if pending and self.batch.flushed != flushed and self._unacked:
+            # A batch sent while reporting this message carried every hit of the ones before it.
+            self.resolve_unacked(True)
+        self._unacked.append((key, tokens))
+        if identity is not None:
+            self._identities.append(identity)
+        if lines:
+            self._pending_lines.append(lines)
+        if not pending:
+            self.resolve_unacked(delivered)
+
+    def resolve_unacked(self, delivered):
+        """Resolve the messages waiting for their hits to be delivered.
+
+        Hits of delivered messages go to the sinks now. Undelivered
+        messages are nacked and come back as redeliveries, so their hits
+        are not handed to the sinks and their identities are forgotten by
+        the dedup window.
+        """
+        if delivered:
+            for lines in self._pending_lines:
+                self.sink(lines)
+        elif self.dedup is not None:
+            for identity in self._identities:
+                self.dedup.forget(identity)
+        self._identities = []
+        self._pending_lines = []
+        self.resolve(self._unacked, delivered)
+        self._unacked = []
+
+    def resolve(self, jobs, delivered):
+        """Settle the deliveries of ``(key, tokens)`` jobs, counting them per routing key."""
+        counter = MESSAGES_ACKED if delivered else MESSAGES_NACKED
+        tokens = []
+        for key, job_tokens in jobs:
+            if job_tokens:
+                counter.labels(key).inc(len(job_tokens))
+                tokens.extend(job_tokens)
+        self.acker.resolve(tokens, delivered)
+
+    def batch_processing(self, force=False):
+        if self.batch is None:
+            return
+        if self.overdue() and len(self.batch):
+            self.abandon_batch()
+            return
+        delivered = True
+        try:
+            if force:
+                self.check(self.batch.flush())
             else:
-                logger.info('Received message # %s: %s', key, data)
+                self.check(self.batch.flush_expired())
         except Exception as e:
             logger.error(exception_message(exc=str(e)))
+            delivered = False
+        if self.acker is not None and self._unacked and not len(self.batch):
+            self.resolve_unacked(delivered)
+
+    def abandon_batch(self):
+        """Requeue the messages of the pending batch, or spill its hits, instead of sending it."""
+        lines = self.batch.take()
+        if self.acker is not None:
+            self.resolve_unacked(False)
+        else:
+            self.spill.append(lines)
+        logger.warning('Abandoned a batch of %s hits at the drain deadline', len(lines))
+
+    def report(self, tracking_id, client_id, payloads, extra_headers=None, **extra_data):
+        lines = _encode_payloads(_finalize_payloads(tracking_id, client_id, payloads, **extra_data))
+        return self.send(lines, extra_headers, tracking_id)
+
+    def send(self, lines, extra_headers=None, tracking_id=None):
+        lines = _within_hit_limit(lines)
+        if self._event_time is not None:
+            marker = EVENT_TIME + str(int(self._event_time * 1000))
+            lines = [line + marker for line in lines]
+        else:
+            lines = list(lines)
+        if self.sinks:
+            self._sink_lines.extend(lines)
+        if self._spilling:
+            self.spill.append(lines)
+            return []
+        if self.limiter is not None and tracking_id:
+            self.limiter.charge(tracking_id, len(lines))
+        responses = self._send(lines, extra_headers)
+        for response in responses:
+            self.check(response)
+        return responses
+
+    def sink(self, lines):
+        """Hand the hits of a settled message to the sinks."""
+        if lines:
+            for sink in self.sinks:
+                sink.submit(lines)
+
+    def check(self, response):
+        if response is not None and not is_healthy(response.status_code):
+            raise DeliveryError('Google Analytics responded {}'.format(response.status_code))
+
+    def message_processing(self, key, data, decoded=None):
+        """Report hits of a message, returning False when they could not be delivered."""
+        try:
+            d = decoded if decoded is not None else json_loads(data)
+            if self.dedup is not None:
+                identity = self.dedup.identity(key, d, data)
+                if self.dedup.seen(identity):
+                    logger.debug('Dropped duplicate message # %s', key)
+                    MESSAGES_DROPPED.labels('duplicate').inc()
+                    return True
+                self._identity = identity
+            builder = self.dispatcher.resolve(key)
+            if builder is None:
+                logger.warning('Dropped message with unknown routing key # %s: %s', key, data)
+                MESSAGES_DROPPED.labels('unknown').inc()
+                return True
+            if not builder(self, d):
+                MESSAGES_DROPPED.labels('unrouted').inc()
+        except (DeliveryError, RequestException) as e:
+            logger.error(exception_message(exc=str(e)))
+            MESSAGES_DROPPED.labels('undelivered').inc()
+            return False
+        except Exception as e:
+            logger.error(exception_message(exc=str(e)))
+            MESSAGES_DROPPED.labels('invalid').inc()
+        return True
 
     def gpageview(self, data):
-        analytics = self.config.get('analytics', {})
-        account_id = data.get('account_id', '')
+        account_id = data.get('account_id')
         referer = data.get('referer')
         url = data.get('url')
         ip = data.get('ip')
         ua = data.get('user_agent')
         cid = data.get('cid')
-        analytic = analytics.get(account_id.lower(), analytics.get('default'))
-        if analytic:
-            headers = {'User-Agent': ua}
-            d = pageview(location=url, referrer=referer, ip=ip, ua=ua)
-            report(analytic, cid, d, extra_header=headers)
+        analytic = self.router.resolve(account_id)
+        if not analytic:
+            return False
+        item_params, params = split_params(self.enricher.params(data) if self.enricher is not None else {})
+        if self.templates:
+            suffix = '&' + urlencode(params) if params else ''
+            self.send([PAGEVIEW.render(analytic, cid, url, referer, ip, ua) + suffix], tracking_id=analytic)
+        else:
+            d = pageview(location=url, referrer=referer, ip=ip, ua=ua, **params)
+            self.report(analytic, cid, d)
+        return True
 
     def gevent(self, data):
-        analytics = self.config.get('analytics', {})
-        account_id = data.get('account_id', '')
+        account_id = data.get('account_id')
         referer = data.get('referer')
         currency = data.get('currency')
         url = data.get('url')
@@ -67,14 +497,33 @@ class Worker(Thread):
         ua = data.get('user_agent')
         price = data.get('price')
         cid = data.get('cid')
-        analytic = analytics.get(account_id.lower(), analytics.get('default'))
-        if analytic:
-            headers = {'User-Agent': ua}
-            d = pageview(location=url, referrer=referer, ip=ip, ua=ua)
-            e = event('click', 'click', label='click', value=price, uip=ip, dl=url, ua=ua)
+        analytic = self.router.resolve(account_id)
+        if not analytic:
+            return False
+        item_params, params = split_params(self.enricher.params(data) if self.enricher is not None else {})
+        name = item_params.get('in', 'offer')
+        category = item_params.get('iv')
+        item_id = item_params.get('ic')
+        if self.templates:
+            suffix = '&' + urlencode(params) if params else ''
+            amount = str(Decimal(price))
+            transaction_id = str(uuid4())
+            self.send([PAGEVIEW.render(analytic, cid, url, referer, ip, ua) + suffix,
+                       EVENT.render(analytic, cid, price, ip, url, ua) + suffix,
+                       TRANSACTION.render(analytic, cid, transaction_id, amount, currency, ip, url, ua) + suffix,
+                       ITEM.render(analytic, cid, name, amount, currency, transaction_id, category, item_id)],
+                      tracking_id=analytic)
+        else:
+            d = pageview(location=url, referrer=referer, ip=ip, ua=ua, **params)
+            e = event('click', 'click', label='click', value=price, uip=ip, dl=url, ua=ua, **params)
             m = Money(price, currency)
-            i = item('offer', m, 1)
-            t = transaction(transaction_id=str(uuid4()), items=[i], revenue=m, uip=ip, dl=url, ua=ua, pa='purchase')
-            report(analytic, cid, d, extra_header=headers)
-            report(analytic, cid, e, extra_header=headers)
-            report(analytic, cid, t, extra_header=headers)
+            i = item(name, m, 1, item_id=item_id, category=category)
+            t = transaction(transaction_id=str(uuid4()), items=[i], revenue=m, uip=ip, dl=url, ua=ua, pa='purchase',
+                            **params)
+            self.report(analytic, cid, d)
+            self.report(analytic, cid, e)
+            self.report(analytic, cid, t)
+        return True
+
+
+BUILDERS = {'pageview': Worker.gpageview, 'goal': Worker.gevent}
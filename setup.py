@@ -37,6 +37,10 @@ setup(
     },
     include_package_data=True,
     install_requires=install_requires,
+    extras_require={
+        'asyncio': ['aiohttp>=3.3'],
+        'fast': ['orjson'],
+    },
     zip_safe=False,
     test_suite='proxy_google_analytics.tests',
     entry_points={